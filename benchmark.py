@@ -0,0 +1,446 @@
+"""قياس أداء واجهة الخادم بحمل متزامن وقابل للتكرار
+
+يشغل الخادم في عملية منفصلة على قاعدة SQLite مؤقتة، ويُنشئ مستخدمين
+بأحجام بيانات مختلفة (1k و 10k و 100k منتج افتراضياً) ثم يرسل طلبات
+متزامنة لنقاط النهاية الرئيسية. تحميل الصور يذهب إلى خادم صور محلي
+بتأخير قابل للضبط. النتيجة JSON فيها p50/p95/p99 والإنتاجية لكل سيناريو،
+ويمكن مقارنتها بنتيجة سابقة محفوظة.
+
+الاستخدام:
+    python benchmark.py run --output bench.json
+    python benchmark.py run --sizes 1000 --duration 3 --baseline bench.json
+    python benchmark.py compare new.json baseline.json
+
+المقارنة تعيد رمز خروج 1 إذا تراجع p95 أو الإنتاجية بأكثر من --tolerance.
+"""
+import argparse
+import http.server
+import io
+import json
+import logging
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = [1000, 10000, 100000]
+SEED = 1234
+SEED_BATCH_SIZE = 1000
+SEASONS_PER_USER = 5
+PASSWORD = 'benchmark-password'
+JOB_POLL_INTERVAL = 0.05
+# إعدادات يجب أن تتطابق لتكون المقارنة ذات معنى
+COMPARABLE_CONFIG = ['concurrency', 'duration', 'image_latency', 'image_kb', 'images_per_product']
+JOB_TIMEOUT = 120
+
+WORDS = ['فستان', 'قميص', 'بنطال', 'حذاء', 'حقيبة', 'ساعة', 'عباية', 'جاكيت', 'أحمر', 'أسود',
+         'أبيض', 'قطن', 'حرير', 'جلد', 'صيفي', 'شتوي', 'dress', 'shirt', 'leather', 'cotton']
+STATUSES = ['pending', 'approved', 'disapproved']
+SEARCH_QUERIES = ['فستان', 'احمر', 'قطن حرير', 'leather', 'حذاء اسود']
+
+
+def percentile(sorted_values, p):
+    """النسبة المئوية بطريقة الرتبة الأقرب"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'max': ms(latencies[-1]) if latencies else None,
+        },
+    }
+
+
+# ---- خادم الصور المحلي ----
+
+def _base_image(size_kb):
+    """صورة JPEG صالحة (لتعمل الصور المصغرة) بحجم تقريبي"""
+    try:
+        from PIL import Image
+        rng = random.Random(SEED)
+        image = Image.frombytes('RGB', (256, 256), bytes(rng.getrandbits(8) for _ in range(256 * 256 * 3)))
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=90)
+        data = buffer.getvalue()
+    except ImportError:
+        data = b'\xff\xd8\xff\xe0' + b'\x00' * 1024 + b'\xff\xd9'
+    # حشو بعد نهاية الصورة للوصول إلى الحجم المطلوب
+    return data + b'\x00' * max(0, size_kb * 1024 - len(data))
+
+
+def start_image_server(latency, size_kb):
+    """خادم صور بتأخير ثابت؛ كل مسار يعيد محتوى مختلفاً حتى لا يُتجاوز الحفظ كتكرار"""
+    base = _base_image(size_kb)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(latency)
+            body = base + self.path.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# ---- خادم التطبيق ----
+
+def _serve(workdir, ready):
+    """تشغيل التطبيق في عملية منفصلة داخل مجلد مؤقت"""
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    from werkzeug.serving import make_server
+    import server
+    # إنهاء منظم عند terminate() لتُغلق عمليات الصور المصغرة معه دون إكمال ما تراكم لها
+    def stop(*_):
+        server.thumbnails.shutdown()
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, stop)
+    httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+    ready.put(httpd.server_port)
+    httpd.serve_forever()
+
+
+def start_app(workdir):
+    context = multiprocessing.get_context('spawn')
+    ready = context.Queue()
+    # ليست daemon لأن الخادم ينشئ عمليات للصور المصغرة
+    process = context.Process(target=_serve, args=(workdir, ready))
+    process.start()
+    port = ready.get(timeout=60)
+    return process, f"http://127.0.0.1:{port}"
+
+
+def register_user(base_url, name):
+    """إنشاء مستخدم عبر الواجهة وإرجاع (رقمه, كوكيز جلسته)"""
+    session = requests.Session()
+    response = session.post(f"{base_url}/api/register", json={
+        'username': name, 'email': f"{name}@bench.local", 'password': PASSWORD,
+    })
+    response.raise_for_status()
+    return response.json()['user']['id'], session.cookies.get_dict()
+
+
+def seed_products(db, user_id, count, rng):
+    """إدراج منتجات اصطناعية على دفعات"""
+    seasons = [f"موسم {index + 1}" for index in range(SEASONS_PER_USER)]
+    for season in seasons:
+        db.create_season(user_id, season)
+    for start in range(0, count, SEED_BATCH_SIZE):
+        batch = []
+        for index in range(start, min(count, start + SEED_BATCH_SIZE)):
+            batch.append({
+                'name': ' '.join(rng.choice(WORDS) for _ in range(3)) + f" {index}",
+                'description': ' '.join(rng.choice(WORDS) for _ in range(20)),
+                'url': f"https://shop.example/products/{user_id}/{index}",
+                'price': round(rng.uniform(10, 1000), 2),
+                'images': [f"https://cdn.example/{user_id}/{index}/{n}.jpg" for n in range(3)],
+                'status': rng.choice(STATUSES),
+                'season': rng.choice(seasons + [None]),
+            })
+        db.bulk_create_products(user_id, batch)
+
+
+# ---- الحمل ----
+
+def run_load(make_request, cookies, concurrency, duration, warmup=2):
+    """تشغيل make_request(session) من عدة خيوط لمدة محددة وجمع الأزمنة"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    window = {}
+
+    def start_window():
+        window['started'] = time.monotonic()
+        window['deadline'] = window['started'] + duration
+
+    # القياس يبدأ بعد أن تنهي كل الخيوط طلبات الإحماء
+    barrier = threading.Barrier(concurrency, action=start_window)
+
+    def worker(_):
+        session = requests.Session()
+        session.cookies.update(cookies)
+        for _ in range(warmup):
+            try:
+                make_request(session)
+            except Exception:
+                pass
+        barrier.wait()
+        deadline = window['deadline']
+        local, failed = [], 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                ok = make_request(session)
+            except Exception:
+                ok = False
+            if ok:
+                local.append(time.perf_counter() - started)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    return summarize(latencies, errors[0], time.monotonic() - window['started'])
+
+
+def product_scenarios(base_url, product_ids, rng):
+    """سيناريوهات القراءة والكتابة لمستخدم واحد: {الاسم: دالة الطلب}"""
+    def ok(response, *codes):
+        return response.status_code in (codes or (200,))
+
+    def products_page(session):
+        return ok(session.get(f"{base_url}/api/products", params={'limit': 100}))
+
+    def products_all(session):
+        return ok(session.get(f"{base_url}/api/products"))
+
+    etags = {}
+
+    def products_revalidate(session):
+        # المتصفح يعيد التحقق بـ ETag المحفوظ؛ يُحدّث فقط إذا تغيرت البيانات
+        url = f"{base_url}/api/products?limit=100"
+        response = session.get(url, headers={'If-None-Match': etags.get(url, '')})
+        if response.status_code == 200:
+            etags[url] = response.headers.get('ETag', '')
+        return ok(response, 200, 304)
+
+    def products_filtered(session):
+        return ok(session.get(f"{base_url}/api/products", params={
+            'limit': 100, 'status': rng.choice(STATUSES), 'fields': 'id,name,status'}))
+
+    def search(session):
+        return ok(session.get(f"{base_url}/api/products/search", params={'q': rng.choice(SEARCH_QUERIES)}))
+
+    def seasons(session):
+        return ok(session.get(f"{base_url}/api/seasons"))
+
+    def batch_update(session):
+        ids = rng.sample(product_ids, min(50, len(product_ids)))
+        return ok(session.patch(f"{base_url}/api/products/batch", json={
+            'ids': ids, 'status': rng.choice(STATUSES)}))
+
+    return {
+        'products_page': products_page,
+        'products_all': products_all,
+        'products_revalidate': products_revalidate,
+        'products_filtered': products_filtered,
+        'search': search,
+        'seasons': seasons,
+        'batch_update': batch_update,
+    }
+
+
+def save_images_scenario(base_url, image_base, images_per_product):
+    """طلب حفظ صور ثم متابعة المهمة حتى تنتهي (الزمن من الطلب إلى انتهاء المهمة)"""
+    def save_images(session):
+        token = uuid.uuid4().hex
+        response = session.post(f"{base_url}/save-images-locally", json={
+            'product_name': f"bench {token}",
+            'image_urls': [f"{image_base}/img/{token}/{n}.jpg" for n in range(images_per_product)],
+        })
+        if response.status_code != 202:
+            return False
+        status_url = f"{base_url}{response.json()['status_url']}"
+        deadline = time.monotonic() + JOB_TIMEOUT
+        while time.monotonic() < deadline:
+            job = session.get(status_url).json()
+            if job['status'] in ('done', 'failed'):
+                return job['status'] == 'done'
+            time.sleep(JOB_POLL_INTERVAL)
+        return False
+    return save_images
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_benchmark(args):
+    sizes = [int(size) for size in args.sizes.split(',')]
+    scenarios_filter = set(args.scenarios.split(',')) if args.scenarios else None
+    workdir = tempfile.mkdtemp(prefix='10ai-bench-')
+    image_server, image_base = start_image_server(args.image_latency, args.image_kb)
+    app_process = None
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'config': {key: value for key, value in vars(args).items() if key != 'func'},
+        },
+        'results': {},
+    }
+    try:
+        app_process, base_url = start_app(workdir)
+        # قاعدة البيانات نفسها من هذه العملية لإدخال البيانات بسرعة
+        os.chdir(workdir)
+        sys.path.insert(0, REPO_DIR)
+        from database_cloud import Database
+        db = Database()
+        rng = random.Random(SEED)
+
+        for size in sizes:
+            user_id, cookies = register_user(base_url, f"bench{size}")
+            started = time.monotonic()
+            seed_products(db, user_id, size, rng)
+            print(f"Seeded {size} products in {time.monotonic() - started:.1f}s")
+            product_ids = [p['id'] for p in db.get_user_products(user_id, fields=['id'])]
+            for name, make_request in product_scenarios(base_url, product_ids, rng).items():
+                if scenarios_filter and name not in scenarios_filter:
+                    continue
+                key = f"{name}@{size}"
+                result = run_load(make_request, cookies, args.concurrency, args.duration)
+                report['results'][key] = result
+                print(f"{key:32} {result['throughput_rps']:>9} req/s  p50 {result['latency_ms']['p50']} ms"
+                      f"  p95 {result['latency_ms']['p95']} ms  p99 {result['latency_ms']['p99']} ms"
+                      f"  errors {result['errors']}")
+
+        if not scenarios_filter or 'save_images' in scenarios_filter:
+            _, cookies = register_user(base_url, 'bench_images')
+            key = f"save_images@{args.images_per_product}"
+            result = run_load(save_images_scenario(base_url, image_base, args.images_per_product),
+                              cookies, args.concurrency, args.duration, warmup=0)
+            report['results'][key] = result
+            print(f"{key:32} {result['throughput_rps']:>9} jobs/s p50 {result['latency_ms']['p50']} ms"
+                  f"  p95 {result['latency_ms']['p95']} ms  errors {result['errors']}")
+    finally:
+        os.chdir(REPO_DIR)
+        if app_process:
+            app_process.terminate()
+            app_process.join(10)
+        image_server.shutdown()
+        if args.keep:
+            print(f"Working directory kept: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            return print_comparison(report, json.load(f), args.tolerance)
+    return 0
+
+
+def compare(report, baseline, tolerance):
+    """مقارنة كل سيناريو مشترك: p95 أعلى أو إنتاجية أقل بأكثر من tolerance = تراجع"""
+    rows = []
+    for key, result in report['results'].items():
+        base = baseline.get('results', {}).get(key)
+        if not base:
+            continue
+        p95, base_p95 = result['latency_ms']['p95'], base['latency_ms']['p95']
+        rps, base_rps = result['throughput_rps'], base['throughput_rps']
+        p95_change = (p95 / base_p95 - 1) if p95 and base_p95 else 0
+        rps_change = (rps / base_rps - 1) if base_rps else 0
+        rows.append({
+            'scenario': key,
+            'p95_ms': p95, 'baseline_p95_ms': base_p95, 'p95_change': round(p95_change, 3),
+            'rps': rps, 'baseline_rps': base_rps, 'rps_change': round(rps_change, 3),
+            'regression': p95_change > tolerance or rps_change < -tolerance,
+        })
+    return rows
+
+
+def print_comparison(report, baseline, tolerance):
+    rows = compare(report, baseline, tolerance)
+    print(f"\nComparison with baseline ({baseline.get('meta', {}).get('git_commit')}), tolerance {tolerance:.0%}:")
+    config = report.get('meta', {}).get('config', {})
+    base_config = baseline.get('meta', {}).get('config', {})
+    for key in COMPARABLE_CONFIG:
+        if config.get(key) != base_config.get(key):
+            print(f"Warning: {key} differs ({base_config.get(key)} -> {config.get(key)}), results are not comparable")
+    for row in rows:
+        flag = 'REGRESSION' if row['regression'] else 'ok'
+        print(f"{row['scenario']:32} p95 {row['baseline_p95_ms']} -> {row['p95_ms']} ms ({row['p95_change']:+.1%})"
+              f"  rps {row['baseline_rps']} -> {row['rps']} ({row['rps_change']:+.1%})  {flag}")
+    return 1 if any(row['regression'] for row in rows) else 0
+
+
+def compare_files(args):
+    with open(args.result) as f:
+        report = json.load(f)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    return print_comparison(report, baseline, args.tolerance)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='قياس أداء واجهة الخادم')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='تشغيل القياس')
+    run.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='أعداد المنتجات لكل مستخدم')
+    run.add_argument('--scenarios', help='أسماء سيناريوهات محددة مفصولة بفواصل')
+    run.add_argument('--concurrency', type=int, default=8)
+    run.add_argument('--duration', type=float, default=5, help='ثوانٍ لكل سيناريو')
+    run.add_argument('--image-latency', type=float, default=0.05, help='تأخير خادم الصور بالثواني')
+    run.add_argument('--image-kb', type=int, default=100, help='حجم الصورة التقريبي')
+    run.add_argument('--images-per-product', type=int, default=5)
+    run.add_argument('--output', help='ملف JSON للنتيجة')
+    run.add_argument('--baseline', help='نتيجة سابقة للمقارنة')
+    run.add_argument('--tolerance', type=float, default=0.2)
+    run.add_argument('--keep', action='store_true', help='عدم حذف المجلد المؤقت')
+    run.set_defaults(func=run_benchmark)
+
+    cmp = commands.add_parser('compare', help='مقارنة نتيجتين محفوظتين')
+    cmp.add_argument('result')
+    cmp.add_argument('baseline')
+    cmp.add_argument('--tolerance', type=float, default=0.2)
+    cmp.set_defaults(func=compare_files)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,18 @@
 import os
+import base64
 import hashlib
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
 import json
 
 # للنشر السحابي - استخدام PostgreSQL
 try:
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    from psycopg2.extras import RealDictCursor, execute_values
+    from psycopg2.pool import ThreadedConnectionPool
     POSTGRES_AVAILABLE = True
 except ImportError:
     POSTGRES_AVAILABLE = False
@@ -14,115 +20,261 @@ except ImportError:
 # للتطوير المحلي - استخدام SQLite
 import sqlite3
 
+from cache import TTLCache
+from migrations import run_migrations
+from product_images import BLOB_PATH_RE, IMAGE_COLUMNS, image_rows, insert_image_rows
+from season_stats import apply_stats_delta, collect_stats, rebuild_season_stats
+from search import fts5_query, highlight, query_terms, tsquery, write_search_index, SNIPPET_WORDS
+
+# إعدادات مجمع الاتصالات
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+# فحص صحة الاتصال فقط إذا بقي خاملاً أكثر من هذه المدة (بالثواني)
+DB_HEALTH_CHECK_INTERVAL = float(os.environ.get('DB_HEALTH_CHECK_INTERVAL', 30))
+
+# سجل المحذوفات للمزامنة: يُضغط ما هو أقدم من المدة أو ما زاد عن العدد لكل مستخدم
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 30))
+MAX_TOMBSTONES_PER_USER = int(os.environ.get('MAX_TOMBSTONES_PER_USER', 10000))
+
+# ذاكرة المستخدمين داخل العملية: تُمسح مع كل كتابة فيها، والمدة تحد من قدم
+# البيانات إذا كتبت عملية أخرى (عامل آخر) في الجدول نفسه. قائمة المواسم لا
+# تُخزن هنا: ردها يُخزن في server.py بمفتاح رقم إصدار المستخدم، وهو صحيح بين العمال
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 300))
+
+# أعمدة المستخدم التي تُعاد للواجهة (بدون كلمة المرور)
+USER_PUBLIC_FIELDS = ['id', 'username', 'email', 'is_verified', 'created_at', 'is_active']
+
+# أعمدة المنتجات المسموح بطلبها عبر fields=
+# (images و cover_image و image_count تُقرأ من جدول product_images)
+PRODUCT_FIELDS = ['id', 'user_id', 'name', 'url', 'description', 'price', 'currency', 'images',
+                  'cover_image', 'image_count', 'derivatives', 'status', 'season', 'created_at', 'updated_at']
+# القوائم تعرض الغلاف وعدد الصور فقط، وقائمة الصور كاملة عند طلبها في fields=
+LIST_FIELDS = [field for field in PRODUCT_FIELDS if field != 'images']
+# أقصى عدد منتجات في استعلام جلب الصور الواحد
+IMAGE_LOOKUP_BATCH = 500
+
+
+# الملفات التي يحتفظ بها كاش HTTP (http_cache.py) لا تُحذف حتى تخرج منه
+NOT_HTTP_CACHED = "NOT EXISTS (SELECT 1 FROM http_cache WHERE http_cache.hash = image_blobs.hash)"
+
+# أعمدة سجل كاش HTTP لصور المواقع الخارجية
+HTTP_CACHE_FIELDS = ['url_key', 'url', 'hash', 'extension', 'size', 'width', 'height', 'etag',
+                     'last_modified', 'cache_control', 'expires_at', 'stored_at', 'last_used_at']
+
+# الأعمدة التي يقبلها الاستيراد الجماعي
+IMPORT_FIELDS = ['name', 'url', 'description', 'price', 'currency', 'images', 'status', 'season', 'created_at']
+
+
+# قيمة غير مخزنة (None مخزنة تعني مستخدماً غير موجود)
+_NOT_CACHED = object()
+
+
+def decode_product(row):
+    """تحويل صف منتج إلى قاموس مع فك حقول JSON"""
+    product = dict(row)
+    if 'derivatives' in product:
+        try:
+            product['derivatives'] = json.loads(product['derivatives']) if product['derivatives'] else {}
+        except ValueError:
+            product['derivatives'] = {}
+    return product
+
+
+def decode_job(row):
+    """تحويل صف مهمة إلى قاموس مع فك حقول JSON"""
+    job = dict(row)
+    for field in ('payload', 'progress', 'result'):
+        if job.get(field):
+            try:
+                job[field] = json.loads(job[field])
+            except ValueError:
+                job[field] = None
+    return job
+
+
+def encode_cursor(created_at, product_id):
+    """ترميز موضع الصفحة (created_at, id) كنص معتم"""
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat(sep=' ')
+    raw = json.dumps([created_at, product_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """فك ترميز موضع الصفحة، ويرفع ValueError إذا كان غير صالح"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, product_id = json.loads(raw)
+        return str(created_at), int(product_id)
+    except Exception:
+        raise ValueError('مؤشر الصفحة غير صالح')
+
+def encode_sync_cursor(seq, product_id=0):
+    """ترميز موضع المزامنة (رقم الإصدار، وآخر منتج إذا توقفت الصفحة داخل إصدار واحد)"""
+    return f"{seq}-{product_id}" if product_id else str(seq)
+
+
+def decode_sync_cursor(cursor):
+    """فك ترميز موضع المزامنة، ويرفع ValueError إذا كان غير صالح"""
+    try:
+        seq, _, product_id = str(cursor).partition('-')
+        seq, product_id = int(seq), int(product_id or 0)
+    except ValueError:
+        raise ValueError('مؤشر المزامنة غير صالح')
+    if seq < 0 or product_id < 0:
+        raise ValueError('مؤشر المزامنة غير صالح')
+    return seq, product_id
+
 class Database:
-    def __init__(self, db_url=None):
+    def __init__(self, db_url=None, pool_size=None):
         self.db_url = db_url or os.environ.get('DATABASE_URL')
         self.use_postgres = bool(self.db_url and POSTGRES_AVAILABLE)
+        self.pool_size = pool_size or DB_POOL_SIZE
         
         if not self.use_postgres:
             self.db_path = 'app.db'
-            
+        
+        # موارد ورثتها العملية الابنة بعد fork ولا يجوز استخدامها أو إغلاقها
+        self._abandoned = []
+        self._reset_pool()
         self.init_database()
     
-    def get_connection(self):
-        """الحصول على اتصال قاعدة البيانات"""
-        if self.use_postgres:
-            return psycopg2.connect(self.db_url, cursor_factory=RealDictCursor)
-        else:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
+    def _reset_pool(self):
+        """تهيئة موارد الاتصال الخاصة بالعملية الحالية"""
+        self._pid = os.getpid()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._pool_slots = threading.BoundedSemaphore(self.pool_size)
+        self._local = threading.local()
+        self._last_used = {}
+        self._sqlite_connections = []
+        self._user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+    
+    def _check_fork(self):
+        """إعادة إنشاء المجمع إذا كنا في عملية ابنة بعد fork"""
+        if self._pid != os.getpid():
+            self._abandoned.append((self._pool, self._sqlite_connections))
+            self._reset_pool()
+    
+    def _new_sqlite_connection(self):
+        conn = sqlite3.connect(self.db_path, timeout=DB_POOL_TIMEOUT, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+    
+    def _is_healthy(self, conn):
+        """فحص صحة الاتصال إذا طال خموله"""
+        if getattr(conn, 'closed', 0):
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0) < DB_HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+    
+    def _acquire(self):
+        if not self.use_postgres:
+            # اتصال SQLite واحد دائم لكل خيط
+            conn = getattr(self._local, 'sqlite_conn', None)
+            if conn is None or not self._is_healthy(conn):
+                conn = self._new_sqlite_connection()
+                self._local.sqlite_conn = conn
+                self._sqlite_connections.append(conn)
             return conn
+        
+        if not self._pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise RuntimeError('انتهت مهلة انتظار اتصال من مجمع قاعدة البيانات')
+        try:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadedConnectionPool(
+                        1, self.pool_size, self.db_url, cursor_factory=RealDictCursor
+                    )
+            conn = self._pool.getconn()
+            if not self._is_healthy(conn):
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+            return conn
+        except Exception:
+            self._pool_slots.release()
+            raise
     
-    def init_database(self):
-        """إنشاء قاعدة البيانات والجداول"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def _release(self, conn, broken=False):
+        self._last_used[id(conn)] = time.monotonic()
+        if not self.use_postgres:
+            return
+        try:
+            self._pool.putconn(conn, close=broken or bool(conn.closed))
+        finally:
+            self._pool_slots.release()
+    
+    @contextmanager
+    def connection(self):
+        """الحصول على اتصال من المجمع ضمن معاملة واحدة (commit عند النجاح و rollback عند الخطأ)"""
+        self._check_fork()
         
-        if self.use_postgres:
-            # PostgreSQL syntax
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    username VARCHAR(255) UNIQUE NOT NULL,
-                    email VARCHAR(255) UNIQUE NOT NULL,
-                    password_hash VARCHAR(255) NOT NULL,
-                    is_verified BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT TRUE
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS products (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    name VARCHAR(255) NOT NULL,
-                    url TEXT,
-                    description TEXT,
-                    price DECIMAL(10,2) DEFAULT 0,
-                    images TEXT,
-                    status VARCHAR(50) DEFAULT 'pending',
-                    season VARCHAR(100),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS seasons (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    name VARCHAR(255) NOT NULL,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-        else:
-            # SQLite syntax (للتطوير المحلي)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    email TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    is_verified BOOLEAN DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT 1
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS products (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    name TEXT NOT NULL,
-                    url TEXT,
-                    description TEXT,
-                    price REAL DEFAULT 0,
-                    images TEXT,
-                    status TEXT DEFAULT 'pending',
-                    season TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS seasons (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    name TEXT NOT NULL,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
+        # الاستدعاءات المتداخلة تشارك نفس الاتصال والمعاملة
+        active = getattr(self._local, 'active', None)
+        if active is not None:
+            yield active
+            return
         
-        conn.commit()
-        conn.close()
+        conn = self._acquire()
+        self._local.active = conn
+        self._local.on_commit = []
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+            for callback in self._local.on_commit:
+                callback()
+        except BaseException:
+            # يشمل GeneratorExit عند إغلاق مولد بث قبل اكتماله
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self._local.active = None
+            self._local.on_commit = []
+            self._release(conn, broken)
+    
+    def _after_commit(self, callback):
+        """تنفيذ callback بعد نجاح المعاملة الحالية (الخارجية إن كانت متداخلة)"""
+        self._local.on_commit.append(callback)
+    
+    def _cache_usable(self):
+        # داخل معاملة مفتوحة قد تختلف البيانات عما في الذاكرة (كتابات لم تُعتمد بعد)
+        self._check_fork()
+        return getattr(self._local, 'active', None) is None
+    
+    def cache_stats(self):
+        """عدادات ذاكرة المستخدمين في هذه العملية"""
+        self._check_fork()
+        return {'users': self._user_cache.stats()}
+    
+    def close(self):
+        """إغلاق كل اتصالات العملية الحالية (مثلاً قبل fork)"""
+        if self._pool is not None:
+            self._pool.closeall()
+        for conn in self._sqlite_connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._reset_pool()
+    
+    def init_database(self):
+        """إنشاء قاعدة البيانات وتطبيق الترحيلات المعلقة فقط"""
+        run_migrations(self)
     
     def hash_password(self, password):
         """تشفير كلمة المرور"""
@@ -130,12 +282,10 @@ class Database:
     
     def create_user(self, username, email, password):
         """إنشاء مستخدم جديد"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         password_hash = self.hash_password(password)
         
-        try:
+        with self.connection() as conn:
+            cursor = conn.cursor()
             if self.use_postgres:
                 cursor.execute(
                     "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s) RETURNING id",
@@ -148,266 +298,1267 @@ class Database:
                     (username, email, password_hash)
                 )
                 user_id = cursor.lastrowid
-            
-            conn.commit()
-            return user_id
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+            # قد يكون الرقم مخزناً كمستخدم غير موجود
+            self._after_commit(lambda: self._user_cache.pop(user_id))
+        
+        return user_id
     
     def authenticate_user(self, username, password):
         """التحقق من صحة بيانات المستخدم"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         password_hash = self.hash_password(password)
         
-        if self.use_postgres:
-            cursor.execute(
-                "SELECT * FROM users WHERE username = %s AND password_hash = %s AND is_active = TRUE",
-                (username, password_hash)
-            )
-        else:
-            cursor.execute(
-                "SELECT * FROM users WHERE username = ? AND password_hash = ? AND is_active = 1",
-                (username, password_hash)
-            )
-        
-        user = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if self.use_postgres:
+                cursor.execute(
+                    "SELECT * FROM users WHERE username = %s AND password_hash = %s AND is_active = TRUE",
+                    (username, password_hash)
+                )
+            else:
+                cursor.execute(
+                    "SELECT * FROM users WHERE username = ? AND password_hash = ? AND is_active = 1",
+                    (username, password_hash)
+                )
+            user = cursor.fetchone()
         
         return dict(user) if user else None
     
     def get_user_by_username(self, username):
         """الحصول على المستخدم بالاسم"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if self.use_postgres:
+                cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
+            else:
+                cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+            user = cursor.fetchone()
         
-        if self.use_postgres:
-            cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
-        else:
-            cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+        return dict(user) if user else None
+    
+    def get_user_by_id(self, user_id):
+        """بيانات المستخدم العامة (بدون كلمة المرور)، أو None إذا لم يوجد"""
+        use_cache = self._cache_usable()
+        cached = self._user_cache.get(user_id, _NOT_CACHED) if use_cache else _NOT_CACHED
+        if cached is not _NOT_CACHED:
+            return dict(cached) if cached else None
         
-        user = cursor.fetchone()
-        conn.close()
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {', '.join(USER_PUBLIC_FIELDS)} FROM users WHERE id = {ph}", (user_id,))
+            user = cursor.fetchone()
         
+        # يُخزن عدم الوجود أيضاً (None) لتجنب تكرار الاستعلام
+        user = dict(user) if user else None
+        if use_cache:
+            self._user_cache.set(user_id, user)
         return dict(user) if user else None
     
-    def create_product(self, user_id, name, url=None, description=None, price=0, images=None, season=None):
+    def create_product(self, user_id, name, url=None, description=None, price=0, images=None, season=None, currency='SAR'):
         """إنشاء منتج جديد"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        images_json = json.dumps(images) if images else None
-        
-        try:
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            season_id = self._season_ids(cursor, user_id, [season]).get(season)
             if self.use_postgres:
                 cursor.execute(
-                    """INSERT INTO products (user_id, name, url, description, price, images, season) 
+                    """INSERT INTO products (user_id, name, url, description, price, season_id, currency) 
                        VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id""",
-                    (user_id, name, url, description, price, images_json, season)
+                    (user_id, name, url, description, price, season_id, currency)
                 )
                 product_id = cursor.fetchone()['id']
             else:
                 cursor.execute(
-                    """INSERT INTO products (user_id, name, url, description, price, images, season) 
+                    """INSERT INTO products (user_id, name, url, description, price, season_id, currency) 
                        VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                    (user_id, name, url, description, price, images_json, season)
+                    (user_id, name, url, description, price, season_id, currency)
                 )
                 product_id = cursor.lastrowid
             
-            conn.commit()
-            return product_id
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+            self._write_images(cursor, product_id, images)
+            self._touch_products(cursor, user_id, [product_id])
+            condition = f"id = {'%s' if self.use_postgres else '?'}"
+            self._index_products(cursor, condition, [product_id])
+            apply_stats_delta(cursor, self.use_postgres, {}, collect_stats(cursor, condition, [product_id]))
+        
+        return product_id
     
-    def get_user_products(self, user_id):
+    def get_user_products(self, user_id, fields=None, status=None, season=None):
         """الحصول على منتجات المستخدم"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        products, _ = self.get_user_products_page(user_id, fields=fields, status=status, season=season)
+        return products
+    
+    def get_product(self, product_id, user_id, fields=None):
+        """الحصول على منتج واحد للمستخدم، أو None"""
+        if fields:
+            unknown = [f for f in fields if f not in PRODUCT_FIELDS]
+            if unknown:
+                raise ValueError(f"حقول غير معروفة: {', '.join(unknown)}")
+            columns = [f for f in PRODUCT_FIELDS if f in fields or f == 'id']
+        else:
+            columns = PRODUCT_FIELDS
+        select, join = self._select_products(columns)
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT {select} FROM products p{join} WHERE p.id = {ph} AND p.user_id = {ph}",
+                (product_id, user_id)
+            )
+            row = cursor.fetchone()
+            if not row:
+                return None
+            product = decode_product(row)
+            if 'images' in columns:
+                self._attach_images(cursor, [product])
+        return product
+    
+    def get_product_images(self, product_id, user_id):
+        """صور منتج بترتيبها مع بياناتها (المصدر والحجم والبصمة والأبعاد)، أو None"""
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT 1 FROM products WHERE id = {ph} AND user_id = {ph}", (product_id, user_id))
+            if not cursor.fetchone():
+                return None
+            cursor.execute(
+                f"SELECT {', '.join(IMAGE_COLUMNS)} FROM product_images WHERE product_id = {ph} ORDER BY position",
+                (product_id,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def add_product_images(self, product_id, user_id, images):
+        """إضافة صور بعد آخر صور المنتج، ويعيد False إذا لم يوجد المنتج"""
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # تحديث المنتج أولاً يقفل صفه فلا تتداخل إضافتان على الترتيب نفسه
+            cursor.execute(
+                f"UPDATE products SET updated_at = CURRENT_TIMESTAMP WHERE id = {ph} AND user_id = {ph}",
+                (product_id, user_id)
+            )
+            if cursor.rowcount == 0:
+                return False
+            before = collect_stats(cursor, f"id = {ph}", [product_id])
+            cursor.execute(
+                f"SELECT COALESCE(MAX(position) + 1, 0) AS next FROM product_images WHERE product_id = {ph}",
+                (product_id,)
+            )
+            start = cursor.fetchone()['next']
+            rows = image_rows(images)
+            for row in rows:
+                row['position'] += start
+            insert_image_rows(cursor, self.use_postgres, product_id, rows)
+            self._adjust_blob_refs(cursor, added=[row['hash'] for row in rows if row['hash']])
+            self._touch_products(cursor, user_id, [product_id])
+            apply_stats_delta(cursor, self.use_postgres, before, collect_stats(cursor, f"id = {ph}", [product_id]))
+            return True
+    
+    def _select_products(self, columns):
+        """نص SELECT لأعمدة منتجات من الجدول p مع ربط الغلاف والموسم عند طلبهما
+
+        يعيد (الأعمدة, الربط). images لا تُقرأ هنا بل عبر _attach_images.
+        """
+        select = []
+        for column in columns:
+            if column == 'cover_image':
+                select.append("cover.path AS cover_image")
+            elif column == 'image_count':
+                select.append("(SELECT COUNT(*) FROM product_images counted WHERE counted.product_id = p.id) AS image_count")
+            elif column == 'season':
+                select.append("product_season.name AS season")
+            elif column != 'images':
+                select.append(f"p.{column}")
+        join = ''
+        if 'cover_image' in columns:
+            join += " LEFT JOIN product_images cover ON cover.product_id = p.id AND cover.position = 0"
+        if 'season' in columns:
+            # المنتج يخزن رقم الموسم، والاسم من جدول seasons
+            join += " LEFT JOIN seasons product_season ON product_season.id = p.season_id"
+        return ', '.join(select), join
+    
+    def _attach_images(self, cursor, products):
+        """إضافة مسارات الصور بترتيبها إلى منتجات مقروءة، باستعلام واحد لكل دفعة"""
+        by_id = {}
+        for product in products:
+            product['images'] = []
+            by_id[product['id']] = product
+        ids = list(by_id)
+        ph = '%s' if self.use_postgres else '?'
+        for start in range(0, len(ids), IMAGE_LOOKUP_BATCH):
+            batch = ids[start:start + IMAGE_LOOKUP_BATCH]
+            cursor.execute(
+                f"""SELECT product_id, path FROM product_images
+                    WHERE product_id IN ({', '.join([ph] * len(batch))}) ORDER BY product_id, position""",
+                batch
+            )
+            for row in cursor.fetchall():
+                by_id[row['product_id']]['images'].append(row['path'])
+        return products
+    
+    def _write_images(self, cursor, product_id, images):
+        """استبدال صور منتج بقائمة جديدة ضمن المعاملة مع تعديل مراجع ملفات المخزن
+
+        الصفوف التي لم تتغير في موضعها تبقى كما هي، والصورة المرسلة كنص
+        تحتفظ ببياناتها إذا كانت ضمن صور المنتج من قبل.
+        """
+        ph = '%s' if self.use_postgres else '?'
+        cursor.execute(
+            f"SELECT {', '.join(IMAGE_COLUMNS)} FROM product_images WHERE product_id = {ph}",
+            (product_id,)
+        )
+        old = {row['position']: dict(row) for row in cursor.fetchall()}
+        rows = image_rows(images, known={row['path']: row for row in old.values()})
+        changed = [row for row in rows if old.get(row['position']) != row]
+        stale = [position for position, row in old.items() if position >= len(rows) or rows[position] != row]
+        if stale:
+            cursor.execute(
+                f"DELETE FROM product_images WHERE product_id = {ph} AND position IN ({', '.join([ph] * len(stale))})",
+                [product_id] + stale
+            )
+        insert_image_rows(cursor, self.use_postgres, product_id, changed)
+        self._adjust_blob_refs(
+            cursor,
+            added=[row['hash'] for row in changed if row['hash']],
+            removed=[old[position]['hash'] for position in stale if old[position]['hash']]
+        )
+    
+    def _image_hashes(self, cursor, condition, params):
+        """بصمات ملفات المخزن لصور المنتجات المطابقة لشرط على الجدول p"""
+        cursor.execute(
+            f"""SELECT i.hash FROM product_images i JOIN products p ON p.id = i.product_id
+                WHERE {condition} AND i.hash IS NOT NULL""",
+            params
+        )
+        return [row['hash'] for row in cursor.fetchall()]
+    
+    def get_user_products_page(self, user_id, limit=None, cursor=None, fields=None, status=None, season=None):
+        """الحصول على صفحة من منتجات المستخدم مرتبة بـ (created_at, id) تنازلياً
         
-        if self.use_postgres:
-            cursor.execute("SELECT * FROM products WHERE user_id = %s ORDER BY created_at DESC", (user_id,))
+        يعيد (المنتجات, مؤشر الصفحة التالية أو None)
+        """
+        if fields:
+            unknown = [f for f in fields if f not in PRODUCT_FIELDS]
+            if unknown:
+                raise ValueError(f"حقول غير معروفة: {', '.join(unknown)}")
+            # id و created_at لازمان لبناء مؤشر الصفحة
+            columns = [f for f in PRODUCT_FIELDS if f in fields or f in ('id', 'created_at')]
         else:
-            cursor.execute("SELECT * FROM products WHERE user_id = ? ORDER BY created_at DESC", (user_id,))
+            columns = LIST_FIELDS
+        select, join = self._select_products(columns)
         
-        products = cursor.fetchall()
-        conn.close()
+        ph = '%s' if self.use_postgres else '?'
+        conditions = [f"p.user_id = {ph}"]
+        values = [user_id]
+        if status:
+            conditions.append(f"p.status = {ph}")
+            values.append(status)
+        if season:
+            # رقم الموسم يُحسب مرة واحدة فيُستخدم فهرس (user_id, season_id)
+            conditions.append(f"p.season_id = (SELECT id FROM seasons WHERE user_id = {ph} AND name = {ph})")
+            values.extend([user_id, season])
+        if cursor:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+            conditions.append(f"(p.created_at, p.id) < ({ph}, {ph})")
+            values.extend([cursor_created_at, cursor_id])
         
-        # تحويل النتائج إلى قائمة من القواميس
-        result = []
-        for product in products:
-            product_dict = dict(product)
-            if product_dict['images']:
-                try:
-                    product_dict['images'] = json.loads(product_dict['images'])
-                except:
-                    product_dict['images'] = []
+        query = f"SELECT {select} FROM products p{join} WHERE {' AND '.join(conditions)} ORDER BY p.created_at DESC, p.id DESC"
+        if limit:
+            # صف إضافي لمعرفة وجود صفحة تالية
+            query += f" LIMIT {ph}"
+            values.append(limit + 1)
+        
+        with self.connection() as conn:
+            cursor_obj = conn.cursor()
+            cursor_obj.execute(query, values)
+            rows = cursor_obj.fetchall()
+            
+            next_cursor = None
+            if limit and len(rows) > limit:
+                rows = rows[:limit]
+                last = rows[-1]
+                next_cursor = encode_cursor(last['created_at'], last['id'])
+            
+            # تحويل النتائج إلى قائمة من القواميس
+            products = [decode_product(row) for row in rows]
+            if 'images' in columns:
+                self._attach_images(cursor_obj, products)
+        return products, next_cursor
+    
+    def iter_user_products(self, user_id, batch_size=500):
+        """المرور على كل منتجات المستخدم دون تحميلها كلها في الذاكرة"""
+        columns, join = self._select_products([f for f in PRODUCT_FIELDS if f not in ('cover_image', 'image_count')])
+        with self.connection() as conn:
+            if self.use_postgres:
+                # مؤشر على الخادم يجلب الصفوف على دفعات
+                cursor = conn.cursor(name=f"export_products_{user_id}")
+                cursor.itersize = batch_size
+                cursor.execute(
+                    f"SELECT {columns} FROM products p{join} WHERE p.user_id = %s ORDER BY p.created_at DESC, p.id DESC",
+                    (user_id,)
+                )
             else:
-                product_dict['images'] = []
-            result.append(product_dict)
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"SELECT {columns} FROM products p{join} WHERE p.user_id = ? ORDER BY p.created_at DESC, p.id DESC",
+                    (user_id,)
+                )
+            # الصور تُجلب لكل دفعة بمؤشر آخر على الاتصال نفسه
+            images_cursor = conn.cursor()
+            
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from self._attach_images(images_cursor, [decode_product(row) for row in rows])
+            cursor.close()
+    
+    def iter_products_with_images(self, batch_size=500):
+        """المرور على كل المنتجات التي لها صور (لكل المستخدمين)"""
+        last_id = 0
+        ph = '%s' if self.use_postgres else '?'
+        while True:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"""SELECT p.id, p.user_id FROM products p
+                        WHERE p.id > {ph} AND EXISTS (SELECT 1 FROM product_images i WHERE i.product_id = p.id)
+                        ORDER BY p.id LIMIT {ph}""",
+                    (last_id, batch_size)
+                )
+                products = self._attach_images(cursor, [dict(row) for row in cursor.fetchall()])
+            if not products:
+                return
+            yield from products
+            last_id = products[-1]['id']
+    
+    def set_product_derivatives(self, product_id, derivatives):
+        """حفظ مسارات النسخ المصغرة مع المنتج (تُدمج مع الموجود)"""
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT user_id, derivatives FROM products WHERE id = {ph}", (product_id,))
+            row = cursor.fetchone()
+            if not row:
+                return False
+            merged = decode_product(row)['derivatives']
+            merged.update(derivatives)
+            cursor.execute(
+                f"UPDATE products SET derivatives = {ph}, updated_at = CURRENT_TIMESTAMP WHERE id = {ph}",
+                (json.dumps(merged), product_id)
+            )
+            updated = cursor.rowcount > 0
+            if updated:
+                self._touch_products(cursor, row['user_id'], [product_id])
+            return updated
+    
+    def bulk_create_products(self, user_id, products):
+        """إدراج عدة منتجات في معاملة واحدة، ويعيد عدد المنتجات المدرجة"""
+        rows = []
+        for product in products:
+            rows.append((
+                user_id,
+                product['name'],
+                product.get('url'),
+                product.get('description'),
+                product.get('price') or 0,
+                product.get('currency') or 'SAR',
+                product.get('status') or 'pending',
+                product.get('season'),
+                product.get('created_at'),
+            ))
+        if not rows:
+            return 0
         
-        return result
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # أسماء المواسم تتحول إلى أرقامها (الموسم غير الموجود يُنشأ)
+            season_ids = self._season_ids(cursor, user_id, [row[7] for row in rows])
+            # الإصدار أولاً ليُسجل مع كل صف مدرج
+            version = self._bump_user_version(cursor, user_id)
+            rows = [row[:7] + (season_ids.get(row[7]),) + row[8:] + (version,) for row in rows]
+            if self.use_postgres:
+                # VALUES متعددة الصفوف في استعلام واحد
+                execute_values(
+                    cursor,
+                    """INSERT INTO products (user_id, name, url, description, price, currency, status, season_id, created_at, change_seq)
+                       VALUES %s""",
+                    rows,
+                    template="(%s, %s, %s, %s, %s, %s, %s, %s, COALESCE(%s::timestamp, CURRENT_TIMESTAMP), %s)",
+                    page_size=len(rows)
+                )
+            else:
+                cursor.executemany(
+                    """INSERT INTO products (user_id, name, url, description, price, currency, status, season_id, created_at, change_seq)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)""",
+                    rows
+                )
+            
+            # الصفوف المدرجة هي وحدها التي تحمل رقم الإصدار الجديد، وأرقامها بترتيب الإدراج
+            ph = '%s' if self.use_postgres else '?'
+            if any(product.get('images') for product in products):
+                cursor.execute(
+                    f"SELECT id FROM products WHERE user_id = {ph} AND change_seq = {ph} ORDER BY id",
+                    (user_id, version)
+                )
+                added = []
+                for row, product in zip(cursor.fetchall(), products):
+                    images = image_rows(product.get('images'))
+                    insert_image_rows(cursor, self.use_postgres, row['id'], images)
+                    added.extend(image['hash'] for image in images if image['hash'])
+                self._adjust_blob_refs(cursor, added=added)
+            inserted = f"user_id = {ph} AND change_seq = {ph}"
+            self._index_products(cursor, inserted, [user_id, version])
+            apply_stats_delta(cursor, self.use_postgres, {}, collect_stats(cursor, inserted, [user_id, version]))
+            self._emit_event(cursor, user_id, 'products.changed', {'ids': [], 'count': len(rows), 'version': version})
+        return len(rows)
     
     def update_product(self, product_id, user_id, **kwargs):
         """تحديث منتج"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # بناء استعلام التحديث
-        set_clauses = []
-        values = []
-        
-        for key, value in kwargs.items():
-            if key == 'images' and value is not None:
-                value = json.dumps(value)
-            set_clauses.append(f"{key} = {'%s' if self.use_postgres else '?'}")
-            values.append(value)
+        # الصور في جدولها، وتُستبدل بعد التأكد من ملكية المنتج
+        has_images = 'images' in kwargs
+        images = kwargs.pop('images', None)
         
-        if not set_clauses:
+        if not kwargs and not has_images:
             return False
         
-        # إضافة updated_at
-        set_clauses.append(f"updated_at = {'CURRENT_TIMESTAMP' if self.use_postgres else 'CURRENT_TIMESTAMP'}")
+        ph = '%s' if self.use_postgres else '?'
+        owned = f"id = {ph} AND user_id = {ph}"
+        # الموسم والحالة والصور تغير ملخص season_stats
+        affects_stats = has_images or 'season' in kwargs or 'status' in kwargs
         
-        query = f"UPDATE products SET {', '.join(set_clauses)} WHERE id = {'%s' if self.use_postgres else '?'} AND user_id = {'%s' if self.use_postgres else '?'}"
-        values.extend([product_id, user_id])
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            before = self._locked_stats(cursor, owned, [product_id, user_id]) if affects_stats else {}
+            if affects_stats and not before:
+                return False
+            if 'season' in kwargs:
+                season = kwargs.pop('season')
+                kwargs['season_id'] = self._season_ids(cursor, user_id, [season]).get(season)
+            
+            # بناء استعلام التحديث مع updated_at
+            set_clauses = [f"{key} = {ph}" for key in kwargs] + ["updated_at = CURRENT_TIMESTAMP"]
+            cursor.execute(
+                f"UPDATE products SET {', '.join(set_clauses)} WHERE {owned}",
+                list(kwargs.values()) + [product_id, user_id]
+            )
+            updated = cursor.rowcount > 0
+            if updated and has_images:
+                self._write_images(cursor, product_id, images)
+            if updated:
+                self._touch_products(cursor, user_id, [product_id])
+                if 'name' in kwargs or 'description' in kwargs:
+                    self._index_products(cursor, f"id = {ph}", [product_id])
+                if affects_stats:
+                    apply_stats_delta(cursor, self.use_postgres, before, collect_stats(cursor, owned, [product_id, user_id]))
+            return updated
+    
+    def update_products(self, user_id, product_ids, **fields):
+        """تحديث نفس الحقول لعدة منتجات باستعلام واحد، ويعيد أرقام المنتجات المحدثة"""
+        product_ids = list(dict.fromkeys(product_ids))
+        if not product_ids or not fields:
+            return []
         
-        try:
-            cursor.execute(query, values)
-            conn.commit()
-            return cursor.rowcount > 0
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+        ph = '%s' if self.use_postgres else '?'
+        id_list = ', '.join([ph] * len(product_ids))
+        where = f"id IN ({id_list}) AND user_id = {ph}"
+        affects_stats = 'season' in fields or 'status' in fields
+        
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if self.use_postgres:
+                before = self._locked_stats(cursor, where, product_ids + [user_id]) if affects_stats else {}
+            else:
+                # قفل الكتابة أولاً ليطابق الاستعلامان نفس الصفوف
+                if not conn.in_transaction:
+                    cursor.execute("BEGIN IMMEDIATE")
+                before = collect_stats(cursor, where, product_ids + [user_id]) if affects_stats else {}
+            if 'season' in fields:
+                # لا يُنشأ موسم جديد إذا لم يطابق الطلب أي منتج
+                season = fields.pop('season')
+                fields['season_id'] = self._season_ids(cursor, user_id, [season] if before else []).get(season)
+            set_clause = ', '.join(f"{key} = {ph}" for key in fields)
+            values = list(fields.values()) + product_ids + [user_id]
+            if self.use_postgres:
+                cursor.execute(
+                    f"UPDATE products SET {set_clause}, updated_at = CURRENT_TIMESTAMP WHERE {where} RETURNING id",
+                    values
+                )
+                updated_ids = [row['id'] for row in cursor.fetchall()]
+            else:
+                cursor.execute(f"SELECT id FROM products WHERE {where}", product_ids + [user_id])
+                updated_ids = [row['id'] for row in cursor.fetchall()]
+                cursor.execute(
+                    f"UPDATE products SET {set_clause}, updated_at = CURRENT_TIMESTAMP WHERE {where}",
+                    values
+                )
+            if updated_ids:
+                self._touch_products(cursor, user_id, updated_ids)
+                if 'name' in fields or 'description' in fields:
+                    self._index_products(cursor, f"id IN ({', '.join([ph] * len(updated_ids))})", updated_ids)
+                if affects_stats:
+                    apply_stats_delta(cursor, self.use_postgres, before, collect_stats(cursor, where, product_ids + [user_id]))
+        return sorted(updated_ids)
     
     def delete_product(self, product_id, user_id):
         """حذف منتج"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            ph = '%s' if self.use_postgres else '?'
+            before = self._locked_stats(cursor, f"id = {ph} AND user_id = {ph}", [product_id, user_id])
+            removed = self._image_hashes(cursor, f"p.id = {ph} AND p.user_id = {ph}", (product_id, user_id))
             if self.use_postgres:
                 cursor.execute("DELETE FROM products WHERE id = %s AND user_id = %s", (product_id, user_id))
             else:
                 cursor.execute("DELETE FROM products WHERE id = ? AND user_id = ?", (product_id, user_id))
-            
-            conn.commit()
-            return cursor.rowcount > 0
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+            deleted = cursor.rowcount > 0
+            if deleted:
+                if not self.use_postgres:
+                    # لا ON DELETE CASCADE في SQLite دون PRAGMA foreign_keys
+                    cursor.execute("DELETE FROM product_images WHERE product_id = ?", (product_id,))
+                    cursor.execute("DELETE FROM products_fts WHERE rowid = ?", (product_id,))
+                self._adjust_blob_refs(cursor, removed=removed)
+                self._record_tombstones(cursor, user_id, [product_id])
+                apply_stats_delta(cursor, self.use_postgres, before, {})
+            return deleted
     
     def delete_all_products(self, user_id):
         """حذف جميع منتجات المستخدم"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self.connection() as conn:
+            cursor = conn.cursor()
             if self.use_postgres:
-                cursor.execute("DELETE FROM products WHERE user_id = %s", (user_id,))
+                # يُحذف ما قُفل فقط: منتج تضيفه معاملة أخرى بعد القفل يبقى ومعه فرقه في الملخص
+                cursor.execute("SELECT id FROM products WHERE user_id = %s", (user_id,))
+                condition, params = "p.user_id = %s AND p.id = ANY(%s)", [user_id, [row['id'] for row in cursor.fetchall()]]
             else:
-                cursor.execute("DELETE FROM products WHERE user_id = ?", (user_id,))
+                condition, params = "p.user_id = ?", [user_id]
+            before = self._locked_stats(cursor, condition, params)
+            removed = self._image_hashes(cursor, condition, params)
             
-            conn.commit()
+            if self.use_postgres:
+                cursor.execute(f"DELETE FROM products p WHERE {condition}", params)
+            else:
+                cursor.execute("DELETE FROM product_images WHERE product_id IN (SELECT id FROM products WHERE user_id = ?)", (user_id,))
+                cursor.execute("DELETE FROM products_fts WHERE rowid IN (SELECT id FROM products WHERE user_id = ?)", (user_id,))
+                cursor.execute("DELETE FROM products WHERE user_id = ?", (user_id,))
+            deleted = cursor.rowcount
+            self._adjust_blob_refs(cursor, removed=removed)
+            if deleted:
+                self._record_tombstones(cursor, user_id)
+            apply_stats_delta(cursor, self.use_postgres, before, {})
+            return deleted
+    
+    def _locked_stats(self, cursor, condition, params):
+        """لقطة season_stats لمنتجات ستتغير، بعد قفلها حتى الكتابة
+
+        القفل يمنع معاملة أخرى من تغيير الصفوف بين اللقطة والكتابة فيُحسب الفرق
+        على قيم قديمة. SQLite يقفل الكتابة كلها من بداية المعاملة.
+        """
+        if self.use_postgres:
+            cursor.execute(f"SELECT id FROM products p WHERE {condition} FOR UPDATE", params)
+        elif not cursor.connection.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        return collect_stats(cursor, condition, params)
+    
+    def get_season_stats(self, user_id):
+        """عدد المنتجات لكل موسم وحالة مع حجم صورها، من الملخص المحدث مع كل كتابة"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # الاسم الحالي للموسم من جدوله، فلا يتأثر الملخص بتغيير الاسم
+            cursor.execute(
+                f"""SELECT st.season_id, s.name AS season, st.status, st.product_count, st.image_bytes
+                    FROM season_stats st LEFT JOIN seasons s ON s.id = st.season_id
+                    WHERE st.user_id = {'%s' if self.use_postgres else '?'} ORDER BY s.name, st.status""",
+                (user_id,)
+            )
+            rows = cursor.fetchall()
+        
+        seasons = {}
+        totals = {'product_count': 0, 'image_bytes': 0, 'statuses': {}}
+        for row in rows:
+            season = seasons.setdefault(row['season_id'], {
+                'season_id': row['season_id'] or None, 'season': row['season'],
+                'product_count': 0, 'image_bytes': 0, 'statuses': {}
+            })
+            for summary in (season, totals):
+                summary['product_count'] += row['product_count']
+                summary['image_bytes'] += int(row['image_bytes'])
+                summary['statuses'][row['status']] = summary['statuses'].get(row['status'], 0) + row['product_count']
+        return dict(totals, seasons=list(seasons.values()))
+    
+    def rebuild_season_stats(self, user_id=None):
+        """إعادة حساب season_stats من المنتجات (للإصلاح)، ويعيد عدد صفوف الملخص"""
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if self.use_postgres:
+                # يمنع كتابة متزامنة من إضافة فرق إلى ملخص يُعاد بناؤه
+                cursor.execute("LOCK TABLE season_stats IN EXCLUSIVE MODE")
+            rebuild_season_stats(cursor, self.use_postgres, user_id)
+            if user_id is None:
+                cursor.execute("SELECT COUNT(*) AS total FROM season_stats")
+            else:
+                cursor.execute(f"SELECT COUNT(*) AS total FROM season_stats WHERE user_id = {ph}", (user_id,))
+            return cursor.fetchone()['total']
+    
+    def _index_products(self, cursor, condition, params):
+        """تحديث فهرس البحث للمنتجات المطابقة للشرط ضمن معاملة الكتابة نفسها"""
+        cursor.execute(f"SELECT id, name, description FROM products WHERE {condition}", params)
+        write_search_index(cursor, self.use_postgres, cursor.fetchall())
+    
+    def search_products(self, user_id, query, limit=50, offset=0, fields=None):
+        """البحث النصي في اسم ووصف منتجات المستخدم مرتبة بالأقرب
+        
+        يعيد (المنتجات مع snippet لكل منها, موضع الصفحة التالية أو None)
+        """
+        terms = query_terms(query)
+        if not terms:
+            return [], None
+        if fields:
+            unknown = [f for f in fields if f not in PRODUCT_FIELDS]
+            if unknown:
+                raise ValueError(f"حقول غير معروفة: {', '.join(unknown)}")
+            # الاسم والوصف لازمان لبناء المقتطف
+            columns = [f for f in PRODUCT_FIELDS if f in fields or f in ('id', 'name', 'description')]
+        else:
+            columns = LIST_FIELDS
+        select, join = self._select_products(columns)
+        
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if self.use_postgres:
+                cursor.execute(
+                    f"""SELECT {select}, ts_rank_cd(p.search_vector, q) AS rank
+                        FROM products p{join} CROSS JOIN to_tsquery('simple', %s) q
+                        WHERE p.user_id = %s AND p.search_vector @@ q
+                        ORDER BY rank DESC, p.id DESC LIMIT %s OFFSET %s""",
+                    (tsquery(terms), user_id, limit + 1, offset)
+                )
+            else:
+                # bm25 أصغر = أقرب، والاسم بوزن أعلى من الوصف
+                cursor.execute(
+                    f"""SELECT {select}, -bm25(products_fts, 10.0, 1.0) AS rank
+                        FROM products_fts JOIN products p ON p.id = products_fts.rowid{join}
+                        WHERE products_fts MATCH ? AND p.user_id = ?
+                        ORDER BY rank DESC, p.id DESC LIMIT ? OFFSET ?""",
+                    (fts5_query(terms), user_id, limit + 1, offset)
+                )
+            rows = [decode_product(row) for row in cursor.fetchall()]
+            if 'images' in columns:
+                self._attach_images(cursor, rows[:limit])
+        
+        next_offset = offset + limit if len(rows) > limit else None
+        products = []
+        for product in rows[:limit]:
+            product['snippet'] = {
+                'name': highlight(product['name'], terms),
+                'description': highlight(product['description'], terms, max_words=SNIPPET_WORDS),
+            }
+            if fields:
+                product = {key: value for key, value in product.items() if key in fields or key in ('id', 'rank', 'snippet')}
+            products.append(product)
+        return products, next_offset
+    
+    def _adjust_blob_refs(self, cursor, added=(), removed=()):
+        """تعديل عدد مراجع ملفات المخزن المعنون ضمن معاملة كتابة المنتج نفسها"""
+        delta = Counter(added)
+        delta.subtract(Counter(removed))
+        ph = '%s' if self.use_postgres else '?'
+        for blob_hash, change in delta.items():
+            if change == 0:
+                continue
+            cursor.execute(
+                f"""UPDATE image_blobs SET refcount = refcount + {ph},
+                       released_at = CASE WHEN refcount + {ph} <= 0 THEN CURRENT_TIMESTAMP ELSE NULL END
+                    WHERE hash = {ph}""",
+                (change, change, blob_hash)
+            )
+    
+    def _bump_user_version(self, cursor, user_id):
+        """زيادة رقم إصدار بيانات المستخدم ضمن معاملة الكتابة (يبطل ETag والذاكرة المؤقتة)
+
+        يعيد الرقم الجديد. قفل الصف حتى نهاية المعاملة يجعل الكتابات لنفس
+        المستخدم متتالية، فلا يظهر رقم أصغر بعد رقم أكبر منه.
+        """
+        ph = '%s' if self.use_postgres else '?'
+        cursor.execute(
+            f"""INSERT INTO user_versions (user_id, version) VALUES ({ph}, 1)
+                ON CONFLICT (user_id) DO UPDATE SET version = user_versions.version + 1""",
+            (user_id,)
+        )
+        cursor.execute(f"SELECT version FROM user_versions WHERE user_id = {ph}", (user_id,))
+        return cursor.fetchone()['version']
+    
+    def _touch_products(self, cursor, user_id, product_ids):
+        """تسجيل تغير منتجات برقم الإصدار الجديد لتظهر في مزامنة التغييرات"""
+        version = self._bump_user_version(cursor, user_id)
+        ph = '%s' if self.use_postgres else '?'
+        cursor.execute(
+            f"UPDATE products SET change_seq = {ph} WHERE id IN ({', '.join([ph] * len(product_ids))})",
+            [version] + list(product_ids)
+        )
+        self._emit_event(cursor, user_id, 'products.changed', {'ids': list(product_ids), 'version': version})
+        return version
+    
+    def _record_tombstones(self, cursor, user_id, product_ids=None):
+        """تسجيل حذف منتجات في سجل المحذوفات؛ بدون product_ids يعني حذف الكل"""
+        version = self._bump_user_version(cursor, user_id)
+        ph = '%s' if self.use_postgres else '?'
+        if product_ids is None:
+            # علامة حذف الكل تغني عن كل ما قبلها
+            cursor.execute(f"DELETE FROM product_tombstones WHERE user_id = {ph}", (user_id,))
+            cursor.execute(
+                f"INSERT INTO product_tombstones (user_id, product_id, seq) VALUES ({ph}, NULL, {ph})",
+                (user_id, version)
+            )
+        else:
+            cursor.executemany(
+                f"INSERT INTO product_tombstones (user_id, product_id, seq) VALUES ({ph}, {ph}, {ph})",
+                [(user_id, product_id, version) for product_id in product_ids]
+            )
+        self._compact_tombstones(cursor, user_id)
+        self._emit_event(cursor, user_id, 'products.deleted', {
+            'ids': list(product_ids or []), 'cleared': product_ids is None, 'version': version
+        })
+        return version
+    
+    def _emit_event(self, cursor, user_id, event_type, data):
+        """تسجيل حدث للمستخدم ضمن المعاملة الحالية (يصل لاتصالات SSE بعد نجاحها فقط)"""
+        ph = '%s' if self.use_postgres else '?'
+        cursor.execute(
+            f"INSERT INTO events (user_id, type, data) VALUES ({ph}, {ph}, {ph})",
+            (user_id, event_type, json.dumps(data, ensure_ascii=False, default=str))
+        )
+    
+    def publish_event(self, user_id, event_type, data):
+        """تسجيل حدث خارج أي عملية كتابة أخرى (مثل تقدم مهمة)"""
+        with self.connection() as conn:
+            self._emit_event(conn.cursor(), user_id, event_type, data)
+    
+    def get_events_after(self, last_id, limit=1000, extra_ids=()):
+        """الأحداث بعد last_id مرتبة، مع أرقام محددة قد تكون تأخرت في الحفظ"""
+        ph = '%s' if self.use_postgres else '?'
+        condition = f"id > {ph}"
+        params = [last_id]
+        if extra_ids:
+            condition = f"({condition} OR id IN ({', '.join([ph] * len(extra_ids))}))"
+            params.extend(extra_ids)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, user_id, type, data FROM events WHERE {condition} ORDER BY id LIMIT {ph}",
+                params + [limit]
+            )
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def latest_event_id(self):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MAX(id) AS id FROM events")
+            row = cursor.fetchone()
+        return row['id'] or 0
+    
+    def prune_events(self, retention_seconds):
+        """حذف الأحداث الأقدم من مدة الاحتفاظ"""
+        ph = '%s' if self.use_postgres else '?'
+        if self.use_postgres:
+            older_than = f"created_at < CURRENT_TIMESTAMP - ({ph} * INTERVAL '1 second')"
+        else:
+            older_than = f"created_at < datetime('now', '-' || {ph} || ' seconds')"
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"DELETE FROM events WHERE {older_than}", (retention_seconds,))
             return cursor.rowcount
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
     
-    def create_season(self, user_id, name, description=None):
-        """إنشاء موسم جديد"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def _compact_tombstones(self, cursor, user_id):
+        """حذف السجلات القديمة أو الزائدة، ومن يزامن من قبلها يعيد التحميل الكامل"""
+        ph = '%s' if self.use_postgres else '?'
+        if self.use_postgres:
+            older_than = "deleted_at < CURRENT_TIMESTAMP - (%s * INTERVAL '1 day')"
+        else:
+            older_than = "deleted_at < datetime('now', '-' || ? || ' days')"
+        cursor.execute(
+            f"SELECT MAX(seq) AS seq FROM product_tombstones WHERE user_id = {ph} AND {older_than}",
+            (user_id, TOMBSTONE_RETENTION_DAYS)
+        )
+        thresholds = [cursor.fetchone()['seq']]
+        cursor.execute(
+            f"SELECT seq FROM product_tombstones WHERE user_id = {ph} ORDER BY seq DESC LIMIT 1 OFFSET {ph}",
+            (user_id, MAX_TOMBSTONES_PER_USER)
+        )
+        row = cursor.fetchone()
+        thresholds.append(row['seq'] if row else None)
+        thresholds = [seq for seq in thresholds if seq is not None]
+        if not thresholds:
+            return
+        threshold = max(thresholds)
+        cursor.execute(f"DELETE FROM product_tombstones WHERE user_id = {ph} AND seq <= {ph}", (user_id, threshold))
+        cursor.execute(
+            f"""UPDATE user_versions SET compacted_seq = CASE WHEN compacted_seq < {ph} THEN {ph} ELSE compacted_seq END
+                WHERE user_id = {ph}""",
+            (threshold, threshold, user_id)
+        )
+    
+    def get_product_changes(self, user_id, since, limit=500):
+        """المنتجات المضافة أو المعدلة والمحذوفة بعد موضع المزامنة since
         
-        try:
+        يعيد قاموساً فيه products و deleted_ids و cleared (حُذفت كل المنتجات قبل
+        تطبيق هذه الصفحة) و reset (الموضع أقدم من السجل، يلزم تحميل كامل)
+        و cursor و has_more.
+        """
+        since_seq, since_id = decode_sync_cursor(since)
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # الإصدار يُقرأ أولاً: كل ما هو أقدم منه قد اكتمل
+            cursor.execute(f"SELECT version, compacted_seq FROM user_versions WHERE user_id = {ph}", (user_id,))
+            row = cursor.fetchone()
+            version, compacted_seq = (row['version'], row['compacted_seq']) if row else (0, 0)
+            if since_seq < compacted_seq or since_seq > version:
+                return {'products': [], 'deleted_ids': [], 'cleared': False, 'reset': True,
+                        'cursor': encode_sync_cursor(version), 'has_more': False}
+            
+            # بنفس أعمدة القوائم لتُدمج في القائمة المحلية كما هي
+            columns, join = self._select_products(LIST_FIELDS + ['change_seq'])
+            if since_id:
+                # صفحة توقفت داخل إصدار واحد (تحديث جماعي كبير)
+                after = f"(p.change_seq > {ph} OR (p.change_seq = {ph} AND p.id > {ph}))"
+                params = (user_id, since_seq, since_seq, since_id, limit + 1)
+            else:
+                after = f"p.change_seq > {ph}"
+                params = (user_id, since_seq, limit + 1)
+            cursor.execute(
+                f"""SELECT {columns} FROM products p{join}
+                    WHERE p.user_id = {ph} AND {after}
+                    ORDER BY p.change_seq, p.id LIMIT {ph}""",
+                params
+            )
+            rows = cursor.fetchall()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            if has_more:
+                last = rows[-1]
+                upto, next_cursor = last['change_seq'], encode_sync_cursor(last['change_seq'], last['id'])
+            else:
+                upto, next_cursor = version, encode_sync_cursor(version)
+            
+            cursor.execute(
+                f"""SELECT product_id FROM product_tombstones
+                    WHERE user_id = {ph} AND seq > {ph} AND seq <= {ph} ORDER BY seq""",
+                (user_id, since_seq, upto)
+            )
+            tombstones = [row['product_id'] for row in cursor.fetchall()]
+        
+        products = []
+        for row in rows:
+            product = decode_product(row)
+            product.pop('change_seq')
+            products.append(product)
+        return {
+            'products': products,
+            'deleted_ids': [product_id for product_id in tombstones if product_id is not None],
+            'cleared': None in tombstones,
+            'reset': False,
+            'cursor': next_cursor,
+            'has_more': has_more,
+        }
+    
+    def get_user_version(self, user_id):
+        """رقم إصدار بيانات المستخدم (منتجات ومواسم)"""
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT version FROM user_versions WHERE user_id = {ph}", (user_id,))
+            row = cursor.fetchone()
+        return row['version'] if row else 0
+    
+    def _register_blob(self, cursor, blob_hash, size, extension):
+        ph = '%s' if self.use_postgres else '?'
+        cursor.execute(
+            f"""INSERT INTO image_blobs (hash, size, extension, refcount, released_at)
+                VALUES ({ph}, {ph}, {ph}, 0, CURRENT_TIMESTAMP)
+                ON CONFLICT (hash) DO UPDATE SET released_at = CASE
+                    WHEN image_blobs.refcount <= 0 THEN CURRENT_TIMESTAMP
+                    ELSE image_blobs.released_at END""",
+            (blob_hash, size, extension)
+        )
+    
+    def register_blob(self, blob_hash, size, extension):
+        """تسجيل ملف في المخزن المعنون؛ يجدد مهلة الحذف إذا كان غير مرتبط بأي منتج"""
+        with self.connection() as conn:
+            self._register_blob(conn.cursor(), blob_hash, size, extension)
+    
+    @contextmanager
+    def storing_blob(self, blob_hash, size, extension):
+        """تسجيل ملف وإبقاء قفل سجله حتى تنتهي كتابته على القرص
+
+        deleting_unreferenced_blob يحذف تحت القفل نفسه، فلا يُحذف ملف وجده put
+        موجوداً واعتمد عليه قبل أن يُعتمد تسجيله.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if not self.use_postgres and not conn.in_transaction:
+                cursor.execute("BEGIN IMMEDIATE")
+            self._register_blob(cursor, blob_hash, size, extension)
+            yield
+    
+    def _released_before_clause(self):
+        if self.use_postgres:
+            return "released_at < CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')"
+        return "released_at < datetime('now', '-' || ? || ' seconds')"
+    
+    def unreferenced_blobs(self, grace_seconds):
+        """الملفات التي لا يشير إليها أي منتج ولا كاش HTTP منذ grace_seconds"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""SELECT hash, extension FROM image_blobs
+                    WHERE refcount <= 0 AND {self._released_before_clause()} AND {NOT_HTTP_CACHED}""",
+                (grace_seconds,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+    
+    @contextmanager
+    def deleting_unreferenced_blob(self, blob_hash, grace_seconds):
+        """حذف سجل ملف إذا بقي غير مرتبط، ويُعطي True إذا حُذف
+
+        المعاملة تبقى مفتوحة داخل with ليُحذف الملف نفسه قبل أن يستطيع
+        storing_blob تسجيله من جديد (قفل الصف في PostgreSQL وقفل الكتابة في SQLite).
+        """
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if not self.use_postgres and not conn.in_transaction:
+                cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(
+                f"""DELETE FROM image_blobs
+                    WHERE hash = {ph} AND refcount <= 0 AND {self._released_before_clause()} AND {NOT_HTTP_CACHED}""",
+                (blob_hash, grace_seconds)
+            )
+            yield cursor.rowcount > 0
+    
+    def get_http_cache_entry(self, url_key):
+        """سجل كاش HTTP لرابط (حسب بصمة الرابط الموحد)، أو None"""
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT * FROM http_cache WHERE url_key = {ph}", (url_key,))
+            row = cursor.fetchone()
+        return dict(row) if row else None
+    
+    def save_http_cache_entry(self, entry):
+        """إضافة سجل كاش HTTP أو استبداله بالاستجابة الأحدث"""
+        ph = '%s' if self.use_postgres else '?'
+        columns = ', '.join(HTTP_CACHE_FIELDS)
+        updates = ', '.join(f"{field} = excluded.{field}" for field in HTTP_CACHE_FIELDS[1:])
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""INSERT INTO http_cache ({columns}) VALUES ({', '.join([ph] * len(HTTP_CACHE_FIELDS))})
+                    ON CONFLICT (url_key) DO UPDATE SET {updates}""",
+                tuple(entry.get(field) for field in HTTP_CACHE_FIELDS)
+            )
+    
+    def touch_http_cache_entry(self, url_key, **fields):
+        """تحديث وقت آخر استخدام وما تغير من ترويسات التحقق بعد 304"""
+        fields = {field: value for field, value in fields.items() if field in HTTP_CACHE_FIELDS[7:]}
+        if not fields:
+            return
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"UPDATE http_cache SET {', '.join(f'{field} = {ph}' for field in fields)} WHERE url_key = {ph}",
+                tuple(fields.values()) + (url_key,)
+            )
+    
+    def _delete_http_cache_rows(self, cursor, rows):
+        """حذف سجلات كاش HTTP ضمن المعاملة، وبدء مهلة حذف ملفاتها غير المرتبطة بأي منتج"""
+        if not rows:
+            return
+        ph = '%s' if self.use_postgres else '?'
+        cursor.executemany(f"DELETE FROM http_cache WHERE url_key = {ph}", [(row['url_key'],) for row in rows])
+        cursor.executemany(
+            f"""UPDATE image_blobs SET released_at = CURRENT_TIMESTAMP
+                WHERE hash = {ph} AND refcount <= 0 AND {NOT_HTTP_CACHED}""",
+            [(blob_hash,) for blob_hash in {row['hash'] for row in rows}]
+        )
+    
+    def delete_http_cache_entry(self, entry):
+        """حذف سجل رابط من كاش HTTP (ملفه اختفى أو لم تعد الاستجابة قابلة للتخزين)"""
+        with self.connection() as conn:
+            self._delete_http_cache_rows(conn.cursor(), [entry])
+    
+    def http_cache_entries(self, limit=None):
+        """سجلات كاش HTTP من الأحدث استخداماً إلى الأقدم"""
+        ph = '%s' if self.use_postgres else '?'
+        query = "SELECT * FROM http_cache ORDER BY last_used_at DESC"
+        params = ()
+        if limit:
+            query += f" LIMIT {ph}"
+            params = (limit,)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def http_cache_stats(self):
+        """عدد سجلات كاش HTTP ومجموع أحجام ملفاتها"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM http_cache")
+            row = cursor.fetchone()
+        return {'entries': row['entries'], 'bytes': int(row['bytes'])}
+    
+    def evict_http_cache(self, max_bytes):
+        """إخراج الأقدم استخداماً من كاش HTTP حتى لا يتجاوز مجموعه max_bytes؛ يعيد عدد المحذوف"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(SUM(size), 0) AS total FROM http_cache")
+            excess = int(cursor.fetchone()['total']) - max_bytes
+            if excess <= 0:
+                return 0
+            cursor.execute("SELECT url_key, hash, size FROM http_cache ORDER BY last_used_at")
+            evicted = []
+            for row in cursor:
+                if excess <= 0:
+                    break
+                evicted.append(row)
+                excess -= row['size']
+            self._delete_http_cache_rows(cursor, evicted)
+            return len(evicted)
+    
+    def _season_ids(self, cursor, user_id, names):
+        """{الاسم: رقم الموسم} لأسماء مواسم المستخدم، مع إنشاء ما لا يوجد منها"""
+        names = list(dict.fromkeys(name for name in names if name))
+        if not names:
+            return {}
+        ph = '%s' if self.use_postgres else '?'
+        query = f"SELECT id, name FROM seasons WHERE user_id = {ph} AND name IN ({', '.join([ph] * len(names))})"
+        cursor.execute(query, [user_id] + names)
+        ids = {row['name']: row['id'] for row in cursor.fetchall()}
+        missing = [name for name in names if name not in ids]
+        if missing:
+            # المنتج المحفوظ باسم موسم جديد ينشئ الموسم كما في الترحيل
+            cursor.executemany(
+                f"INSERT INTO seasons (user_id, name) VALUES ({ph}, {ph}) ON CONFLICT (user_id, name) DO NOTHING",
+                [(user_id, name) for name in missing]
+            )
+            cursor.execute(query, [user_id] + names)
+            ids = {row['name']: row['id'] for row in cursor.fetchall()}
+            version = self._bump_user_version(cursor, user_id)
+            for name in missing:
+                self._emit_event(cursor, user_id, 'seasons.changed', {'name': name, 'action': 'created', 'version': version})
+        return ids
+    
+    def create_season(self, user_id, name, description=None):
+        """إنشاء موسم جديد، ويعيد رقمه أو None إذا كان الاسم موجوداً"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
             if self.use_postgres:
                 cursor.execute(
-                    "INSERT INTO seasons (user_id, name, description) VALUES (%s, %s, %s) RETURNING id",
+                    """INSERT INTO seasons (user_id, name, description) VALUES (%s, %s, %s)
+                       ON CONFLICT (user_id, name) DO NOTHING RETURNING id""",
                     (user_id, name, description)
                 )
-                season_id = cursor.fetchone()['id']
+                row = cursor.fetchone()
+                season_id = row['id'] if row else None
             else:
                 cursor.execute(
-                    "INSERT INTO seasons (user_id, name, description) VALUES (?, ?, ?)",
+                    "INSERT INTO seasons (user_id, name, description) VALUES (?, ?, ?) ON CONFLICT (user_id, name) DO NOTHING",
                     (user_id, name, description)
                 )
-                season_id = cursor.lastrowid
-            
-            conn.commit()
-            return season_id
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+                season_id = cursor.lastrowid if cursor.rowcount > 0 else None
+            if season_id is None:
+                return None
+            version = self._bump_user_version(cursor, user_id)
+            self._emit_event(cursor, user_id, 'seasons.changed', {'name': name, 'action': 'created', 'version': version})
+        
+        return season_id
     
     def get_user_seasons(self, user_id):
         """الحصول على مواسم المستخدم"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        if self.use_postgres:
-            cursor.execute("SELECT * FROM seasons WHERE user_id = %s ORDER BY created_at DESC", (user_id,))
-        else:
-            cursor.execute("SELECT * FROM seasons WHERE user_id = ? ORDER BY created_at DESC", (user_id,))
-        
-        seasons = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if self.use_postgres:
+                cursor.execute("SELECT * FROM seasons WHERE user_id = %s ORDER BY created_at DESC", (user_id,))
+            else:
+                cursor.execute("SELECT * FROM seasons WHERE user_id = ? ORDER BY created_at DESC", (user_id,))
+            seasons = cursor.fetchall()
         
         return [dict(season) for season in seasons]
     
     def delete_season(self, season_name, user_id):
-        """حذف موسم"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            if self.use_postgres:
-                cursor.execute("DELETE FROM seasons WHERE name = %s AND user_id = %s", (season_name, user_id))
-            else:
-                cursor.execute("DELETE FROM seasons WHERE name = ? AND user_id = ?", (season_name, user_id))
+        """حذف موسم؛ منتجاته تبقى بلا موسم"""
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if not self.use_postgres and not conn.in_transaction:
+                cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(f"SELECT id FROM seasons WHERE name = {ph} AND user_id = {ph}", (season_name, user_id))
+            row = cursor.fetchone()
+            if not row:
+                return False
+            season_id = row['id']
             
-            conn.commit()
-            return cursor.rowcount > 0
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+            in_season = f"user_id = {ph} AND season_id = {ph}"
+            before = self._locked_stats(cursor, in_season, [user_id, season_id])
+            cursor.execute(f"SELECT id FROM products WHERE {in_season}", (user_id, season_id))
+            product_ids = [product['id'] for product in cursor.fetchall()]
+            version = self._bump_user_version(cursor, user_id)
+            if product_ids:
+                # تغير موسم المنتجات يظهر في مزامنة التغييرات برقم الإصدار نفسه
+                cursor.execute(
+                    f"""UPDATE products SET season_id = NULL, change_seq = {ph}, updated_at = CURRENT_TIMESTAMP
+                        WHERE {in_season}""",
+                    (version, user_id, season_id)
+                )
+                # نفس الأعداد تنتقل إلى "بلا موسم" (0)
+                apply_stats_delta(cursor, self.use_postgres, before, {
+                    (key[0], 0, key[2]): value for key, value in before.items()
+                })
+                self._emit_event(cursor, user_id, 'products.changed', {'ids': product_ids, 'version': version})
+            cursor.execute(f"DELETE FROM seasons WHERE id = {ph}", (season_id,))
+            self._emit_event(cursor, user_id, 'seasons.changed', {'name': season_name, 'action': 'deleted', 'version': version})
+            return True
     
     def update_season(self, old_name, new_name, user_id, description=None):
-        """تحديث موسم"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        """تغيير اسم موسم (ووصفه إذا أُعطي)؛ المنتجات تشير إلى رقمه فلا تتغير
+
+        يعيد False إذا لم يوجد الموسم أو كان الاسم الجديد مستخدماً.
+        """
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if new_name != old_name:
+                cursor.execute(f"SELECT 1 FROM seasons WHERE name = {ph} AND user_id = {ph}", (new_name, user_id))
+                if cursor.fetchone():
+                    return False
+            cursor.execute(
+                f"""UPDATE seasons SET name = {ph}, description = COALESCE({ph}, description)
+                    WHERE name = {ph} AND user_id = {ph}""",
+                (new_name, description, old_name, user_id)
+            )
+            updated = cursor.rowcount > 0
+            if updated:
+                version = self._bump_user_version(cursor, user_id)
+                self._emit_event(cursor, user_id, 'seasons.changed', {
+                    'name': new_name, 'old_name': old_name, 'action': 'updated', 'version': version
+                })
+            return updated
+    
+    def _lease_until_expr(self):
+        if self.use_postgres:
+            return "CURRENT_TIMESTAMP + (%s * INTERVAL '1 second')"
+        return "datetime('now', '+' || ? || ' seconds')"
+    
+    def create_job(self, user_id, kind, payload):
+        """إضافة مهمة إلى الطابور"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
             if self.use_postgres:
                 cursor.execute(
-                    "UPDATE seasons SET name = %s, description = %s WHERE name = %s AND user_id = %s",
-                    (new_name, description, old_name, user_id)
+                    "INSERT INTO jobs (user_id, kind, payload) VALUES (%s, %s, %s) RETURNING id",
+                    (user_id, kind, json.dumps(payload))
                 )
-            else:
+                return cursor.fetchone()['id']
+            cursor.execute(
+                "INSERT INTO jobs (user_id, kind, payload) VALUES (?, ?, ?)",
+                (user_id, kind, json.dumps(payload))
+            )
+            return cursor.lastrowid
+    
+    def get_job(self, job_id, user_id=None):
+        """الحصول على مهمة (لمالكها فقط إذا حُدد user_id)"""
+        ph = '%s' if self.use_postgres else '?'
+        query = f"SELECT * FROM jobs WHERE id = {ph}"
+        params = [job_id]
+        if user_id is not None:
+            query += f" AND user_id = {ph}"
+            params.append(user_id)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+        return decode_job(row) if row else None
+    
+    def claim_job(self, worker_id, lease_seconds):
+        """حجز أقدم مهمة منتظرة (أو مهمة انتهت مهلة حجزها) لهذا العامل"""
+        ph = '%s' if self.use_postgres else '?'
+        claimable = "(status = 'queued' OR (status = 'running' AND locked_until < CURRENT_TIMESTAMP))"
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if self.use_postgres:
+                # SKIP LOCKED يمنع تنافس العمال على نفس الصف
                 cursor.execute(
-                    "UPDATE seasons SET name = ?, description = ? WHERE name = ? AND user_id = ?",
-                    (new_name, description, old_name, user_id)
+                    f"""UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_by = %s,
+                           locked_until = {self._lease_until_expr()}, updated_at = CURRENT_TIMESTAMP
+                        WHERE id = (
+                            SELECT id FROM jobs WHERE {claimable}
+                            ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING *""",
+                    (worker_id, lease_seconds)
                 )
+                row = cursor.fetchone()
+                return decode_job(row) if row else None
             
-            conn.commit()
+            if not conn.in_transaction:
+                cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(f"SELECT id FROM jobs WHERE {claimable} ORDER BY id LIMIT 1")
+            row = cursor.fetchone()
+            if not row:
+                return None
+            cursor.execute(
+                f"""UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_by = ?,
+                       locked_until = {self._lease_until_expr()}, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?""",
+                (worker_id, lease_seconds, row['id'])
+            )
+            cursor.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],))
+            return decode_job(cursor.fetchone())
+    
+    def update_job_progress(self, job_id, worker_id, progress, lease_seconds):
+        """حفظ تقدم المهمة وتمديد حجزها؛ يعيد False إذا لم يعد العامل يملكها"""
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""UPDATE jobs SET progress = {ph}, locked_until = {self._lease_until_expr()},
+                       updated_at = CURRENT_TIMESTAMP
+                    WHERE id = {ph} AND locked_by = {ph} AND status = 'running'""",
+                (json.dumps(progress), lease_seconds, job_id, worker_id)
+            )
             return cursor.rowcount > 0
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
\ No newline at end of file
+    
+    def finish_job(self, job_id, worker_id, status, result=None, error=None):
+        """إنهاء المهمة بالحالة done أو failed؛ يعيد False إذا لم يعد العامل يملكها"""
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""UPDATE jobs SET status = {ph}, result = {ph}, error = {ph}, locked_by = NULL,
+                       locked_until = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = {ph} AND locked_by = {ph} AND status = 'running'""",
+                (status, json.dumps(result) if result is not None else None, error, job_id, worker_id)
+            )
+            return cursor.rowcount > 0
+    
+    def running_job_owners(self):
+        """معرفات العمال الذين يحجزون مهام قيد التنفيذ"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT DISTINCT locked_by FROM jobs WHERE status = 'running' AND locked_by IS NOT NULL")
+            return [row['locked_by'] for row in cursor.fetchall()]
+    
+    def requeue_jobs(self, worker_id):
+        """إعادة مهام عامل متوقف إلى الطابور لتُستأنف من حيث توقفت"""
+        ph = '%s' if self.use_postgres else '?'
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""UPDATE jobs SET status = 'queued', locked_by = NULL, locked_until = NULL,
+                       updated_at = CURRENT_TIMESTAMP
+                    WHERE status = 'running' AND locked_by = {ph}""",
+                (worker_id,)
+            )
+            return cursor.rowcount
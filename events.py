@@ -0,0 +1,216 @@
+"""بث الأحداث للمتصفح عبر Server-Sent Events دون وسيط خارجي
+
+الأحداث تُكتب في جدول events ضمن معاملة الكتابة نفسها، وخيط واحد في كل
+عملية يقرأ الجديد منها ويوزعه على اتصالات SSE المفتوحة لديها، فتصل أحداث
+أي عامل إلى كل العمال. آخر الأحداث تبقى في ذاكرة حلقية محدودة لاستئناف
+الاتصال عبر Last-Event-ID.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+EVENT_BUFFER_SIZE = int(os.environ.get('EVENT_BUFFER_SIZE', 2000))
+EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', 1))
+# مدة بقاء الأحداث في الجدول (تكفي لوصولها لكل العمال)
+EVENT_RETENTION_SECONDS = int(os.environ.get('EVENT_RETENTION_SECONDS', 600))
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+# أقصى عمر للاتصال، ثم يعيد المتصفح الاتصال تلقائياً من آخر حدث
+SSE_MAX_DURATION = float(os.environ.get('SSE_MAX_DURATION', 300))
+# حدود الاتصالات المفتوحة في كل عملية؛ كل اتصال يشغل خيط طلب طوال عمره، فتحت
+# gunicorn يُشتق الحد من عدد خيوط العامل (gunicorn.conf.py)
+SSE_MAX_CONNECTIONS = int(os.environ.get('SSE_MAX_CONNECTIONS', 100))
+SSE_MAX_PER_USER = int(os.environ.get('SSE_MAX_PER_USER', 5))
+SSE_RETRY_MS = 3000
+# أرقام أحداث تخطاها القارئ لأن معاملتها لم تكتمل بعد، تُفحص مجدداً لهذه المدة
+EVENT_GAP_TIMEOUT = 10
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+class TooManyConnections(Exception):
+    pass
+
+
+class _Subscriber:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class EventBroker:
+    """توزيع أحداث قاعدة البيانات على المشتركين في هذه العملية"""
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._buffer = deque(maxlen=EVENT_BUFFER_SIZE)
+        self._subscribers = {}
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._last_id = 0
+        # أعلى رقم حدث غير موجود في الذاكرة (ما قبل التشغيل أو ما خرج منها)
+        self._floor = 0
+        self._gaps = {}
+        self._last_prune = 0
+        self._closing = threading.Event()
+
+    @property
+    def closing(self):
+        return self._closing.is_set()
+
+    def _start(self):
+        # خيط قراءة واحد لكل عملية (يُعاد إنشاؤه بعد fork)
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._buffer.clear()
+        self._subscribers = {}
+        self._gaps = {}
+        self._last_id = self._floor = self.db.latest_event_id()
+        threading.Thread(target=self._run, name='event-broker', daemon=True).start()
+
+    def notify(self):
+        """إيقاظ القارئ فوراً بعد كتابة حدث في هذه العملية"""
+        self._wakeup.set()
+
+    def subscribe(self, user_id):
+        with self._lock:
+            self._start()
+            user_count = sum(1 for sub in self._subscribers if sub.user_id == user_id)
+            if self.closing or len(self._subscribers) >= SSE_MAX_CONNECTIONS or user_count >= SSE_MAX_PER_USER:
+                raise TooManyConnections()
+            subscriber = _Subscriber(user_id)
+            self._subscribers[subscriber] = True
+            return subscriber
+
+    def close(self):
+        """إنهاء كل الاتصالات المفتوحة ورفض الجديدة (عند توقف العامل)
+
+        المتصفح يعيد الاتصال بعامل آخر من آخر حدث وصله.
+        """
+        self._closing.set()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait(None)
+            except queue.Full:
+                subscriber.overflowed = True
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.pop(subscriber, None)
+
+    def replay(self, user_id, last_event_id):
+        """أحداث المستخدم بعد last_event_id من الذاكرة، أو None إذا لم تعد كلها فيها"""
+        with self._lock:
+            if last_event_id < self._floor:
+                return None
+            return [event for event in self._buffer if event['user_id'] == user_id and event['id'] > last_event_id]
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(EVENTS_POLL_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self._poll()
+            except Exception as e:
+                print(f"Error polling events: {e}")
+
+    def _poll(self):
+        now = time.monotonic()
+        self._gaps = {event_id: seen for event_id, seen in self._gaps.items() if now - seen < EVENT_GAP_TIMEOUT}
+        rows = self.db.get_events_after(self._last_id, extra_ids=list(self._gaps))
+        for row in rows:
+            event_id = row['id']
+            if event_id in self._gaps:
+                del self._gaps[event_id]
+            elif event_id > self._last_id:
+                # أرقام لم تظهر بعد قد تعود لمعاملات لم تكتمل
+                for missing in range(self._last_id + 1, event_id):
+                    self._gaps.setdefault(missing, now)
+                self._last_id = event_id
+            else:
+                continue
+            self._dispatch({
+                'id': event_id,
+                'user_id': row['user_id'],
+                'type': row['type'],
+                'data': row['data'],
+            })
+
+        if now - self._last_prune > EVENT_RETENTION_SECONDS / 2:
+            self._last_prune = now
+            self.db.prune_events(EVENT_RETENTION_SECONDS)
+
+    def _dispatch(self, event):
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self._floor = max(self._floor, self._buffer[0]['id'])
+            self._buffer.append(event)
+            subscribers = [sub for sub in self._subscribers if sub.user_id == event['user_id']]
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait(event)
+            except queue.Full:
+                # متصفح بطيء: يُقطع الاتصال ويعيد المزامنة الكاملة
+                subscriber.overflowed = True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'connections': len(self._subscribers),
+                'buffered_events': len(self._buffer),
+                'last_event_id': self._last_id,
+            }
+
+
+def format_event(event_id=None, event_type=None, data=None):
+    """نص حدث SSE واحد"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event_type:
+        lines.append(f"event: {event_type}")
+    if data is not None:
+        payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+        lines.extend(f"data: {line}" for line in payload.split('\n'))
+    return '\n'.join(lines) + '\n\n'
+
+
+def event_stream(broker, subscriber, last_event_id=None):
+    """مولد نص SSE: إعادة ما فات من الذاكرة ثم الأحداث الحية مع نبضات دورية"""
+    deadline = time.monotonic() + SSE_MAX_DURATION
+    # ما أُعيد من الذاكرة قد يصل أيضاً عبر الطابور فلا يُرسل مرتين
+    replayed = set()
+    try:
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        if last_event_id is not None:
+            missed = broker.replay(subscriber.user_id, last_event_id)
+            if missed is None:
+                # لا يمكن الاستئناف: على المتصفح إعادة تحميل بياناته
+                yield format_event(event_type='reset', data={})
+            else:
+                for event in missed:
+                    replayed.add(event['id'])
+                    yield format_event(event['id'], event['type'], event['data'])
+
+        while time.monotonic() < deadline and not subscriber.overflowed and not broker.closing:
+            try:
+                event = subscriber.queue.get(timeout=SSE_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+                continue
+            if event is None:
+                break
+            if event['id'] in replayed:
+                continue
+            yield format_event(event['id'], event['type'], event['data'])
+
+        if subscriber.overflowed:
+            yield format_event(event_type='reset', data={})
+    finally:
+        broker.unsubscribe(subscriber)
@@ -0,0 +1,76 @@
+"""إعدادات gunicorn للإنتاج (القيم قابلة للتغيير عبر متغيرات البيئة)
+
+- عدة عمليات (WEB_CONCURRENCY) وفي كل منها عدة خيوط (GUNICORN_THREADS)
+- preload_app: التهيئة والترحيلات مرة واحدة قبل fork
+- HUP يعيد تشغيل العمال تدريجياً؛ لتحميل كود جديد مع preload_app استخدم
+  USR2 ثم QUIT للعملية الرئيسية القديمة
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+port = os.environ.get('PORT', '5000')
+bind = f"0.0.0.0:{port}"
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 2))
+# خيوط لكل عامل: اتصالات SSE والتحميل تبقى مفتوحة طويلاً
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+# كل اتصال SSE يشغل خيطاً طوال عمره، فيبقى خيطان على الأقل لبقية الطلبات
+os.environ.setdefault('SSE_MAX_CONNECTIONS', str(max(1, threads - 2)))
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+# مهلة إنهاء الطلبات والمهام الجارية عند إعادة التشغيل؛ اتصالات SSE تُغلق فور
+# توقف العامل (post_worker_init) فلا تحتاج المهلة أن تغطي عمرها
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+# إعادة إنشاء العامل بعد عدد من الطلبات تحسباً لتسرب الذاكرة
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+
+# مجلد مشترك لتجميع مقاييس العمال (يجب تحديده قبل استيراد التطبيق)
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f"10ai-metrics-{port}"))
+
+
+def on_starting(server):
+    # مقاييس تشغيل سابق لا تخص هذا التشغيل
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+
+def pre_fork(server, worker):
+    from server import db
+    # العملية الرئيسية لا تحتاج اتصالات، ولا يرث العامل اتصالاً مشتركاً
+    db.close()
+
+
+def post_fork(server, worker):
+    from server import jobs
+    jobs.start()
+
+
+def post_worker_init(worker):
+    from server import broker
+
+    def close_streams_on_exit():
+        # العامل يتوقف بإشارة TERM (ومنها HUP و USR2) أو بعد max_requests،
+        # وفي كل الحالات تنتظر الخيوط اكتمال الطلبات المفتوحة
+        while worker.alive:
+            time.sleep(1)
+        broker.close()
+
+    threading.Thread(target=close_streams_on_exit, name='sse-shutdown', daemon=True).start()
+
+
+def child_exit(server, worker):
+    from metrics import registry
+    # عدادات العامل المنتهي تُضم إلى ملف واحد فلا تتراكم ملفاته مع max_requests
+    registry.retire(worker.pid)
+
+
+def worker_exit(server, worker):
+    from server import jobs, thumbnails
+    # المهام التي لم تنته خلال المهلة تعود للطابور لتستأنفها العمال الآخرون
+    jobs.stop(timeout=max(1, graceful_timeout - 5))
+    thumbnails.shutdown()
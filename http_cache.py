@@ -0,0 +1,208 @@
+"""كاش HTTP دائم لصور المواقع الخارجية، بمفتاح الرابط بعد توحيده
+
+لكل رابط حُمّل من قبل سجل في جدول http_cache فيه ترويسات التحقق (ETag و
+Last-Modified) و Cache-Control، أما بايتات الصورة فهي ملفها في المخزن المعنون
+بالمحتوى فلا تُحفظ مرتين. الاستجابة الطازجة حسب max-age أو Expires تُستخدم
+دون أي طلب، وغيرها يُرسل له طلب شرطي فإذا رد الموقع 304 تُستخدم البايتات
+المخزنة. عند تجاوز HTTP_CACHE_MAX_BYTES تخرج الروابط الأقدم استخداماً،
+وملفاتها غير المرتبطة بأي منتج تُحذف بعد مهلة GC المعتادة.
+
+الاستخدام من سطر الأوامر:
+    python http_cache.py stats              # عدد الروابط المخزنة وحجمها
+    python http_cache.py list [N]           # آخر N رابط استخداماً
+    python http_cache.py prune [MAX_BYTES]  # إخراج الأقدم حتى الحد
+"""
+import hashlib
+import os
+import sys
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit, urlunsplit
+
+import metrics
+
+HTTP_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_HTTP_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# ترويسات الاستجابة التي تُحفظ في السجل وتُحدّث من رد 304
+VALIDATOR_HEADERS = (('ETag', 'etag'), ('Last-Modified', 'last_modified'), ('Cache-Control', 'cache_control'))
+
+
+def normalize_url(url):
+    """الرابط بصيغة موحدة: المخطط والمضيف بأحرف صغيرة، بدون المنفذ الافتراضي وما بعد #"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        return url.strip()
+    host = parts.hostname or ''
+    if ':' in host:
+        host = f'[{host}]'
+    userinfo = parts.netloc.rpartition('@')[0]
+    netloc = f'{userinfo}@{host}' if userinfo else host
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc += f':{port}'
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def url_key(url):
+    """مفتاح السجل: بصمة الرابط الموحد"""
+    return hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
+
+
+def parse_cache_control(value):
+    """توجيهات Cache-Control كقاموس (الاسم بأحرف صغيرة: القيمة أو None)"""
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, argument = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip().strip('"') or None
+    return directives
+
+
+def freshness_deadline(cache_control, expires, age, now):
+    """وقت انتهاء طزاجة الاستجابة (ثوانٍ منذ epoch)، أو None إذا لزم التحقق دائماً"""
+    directives = parse_cache_control(cache_control)
+    if 'no-cache' in directives:
+        return None
+    if directives.get('max-age') is not None:
+        try:
+            max_age = int(directives['max-age'])
+        except ValueError:
+            return None
+        try:
+            age = int(age or 0)
+        except ValueError:
+            age = 0
+        return now + max_age - age if max_age > age else None
+    if expires:
+        try:
+            return parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+class HttpCache:
+    """سجلات كاش HTTP فوق مخزن الصور (ImageStore) وقاعدة بياناته"""
+
+    def __init__(self, store, max_bytes=HTTP_CACHE_MAX_BYTES):
+        self.store = store
+        self.db = store.db
+        self.max_bytes = max_bytes
+
+    def _path(self, entry):
+        return self.store.relative_path(entry['hash'], entry['extension'] or '')
+
+    def lookup(self, url):
+        """سجل الرابط إذا كان ملفه ما زال في المخزن، أو None"""
+        entry = self.db.get_http_cache_entry(url_key(url))
+        if entry and not os.path.exists(self._path(entry)):
+            self.db.delete_http_cache_entry(entry)
+            return None
+        return entry
+
+    @staticmethod
+    def is_fresh(entry):
+        return entry['expires_at'] is not None and entry['expires_at'] > time.time()
+
+    @staticmethod
+    def conditional_headers(entry):
+        """ترويسات الطلب الشرطي من محققات السجل"""
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def reuse(self, entry, headers=None):
+        """وصف الصورة المخزنة بنفس شكل ImageStore.put
+
+        headers: ترويسات رد 304، تجدد طزاجة السجل وما تغير من محققاته.
+        """
+        now = time.time()
+        updates = {'last_used_at': now}
+        if headers is not None:
+            for header, field in VALIDATOR_HEADERS:
+                if headers.get(header):
+                    updates[field] = headers[header]
+            updates['expires_at'] = freshness_deadline(
+                updates.get('cache_control', entry['cache_control']), headers.get('Expires'), headers.get('Age'), now)
+        self.db.touch_http_cache_entry(entry['url_key'], **updates)
+        # يجدد مهلة الحذف إذا خرج السجل من الكاش قبل أن يرتبط الملف بمنتج
+        self.db.register_blob(entry['hash'], entry['size'], entry['extension'])
+        path = self._path(entry)
+        return {
+            'filename': os.path.basename(path),
+            'path': path,
+            'size': entry['size'],
+            'hash': entry['hash'],
+            'width': entry['width'],
+            'height': entry['height'],
+            'created': False,
+        }
+
+    def save(self, url, image, headers):
+        """حفظ استجابة 200 بعد وضع صورتها في المخزن، إذا سمحت ترويساتها بالتخزين"""
+        key = url_key(url)
+        if 'no-store' in parse_cache_control(headers.get('Cache-Control')):
+            entry = self.db.get_http_cache_entry(key)
+            if entry:
+                self.db.delete_http_cache_entry(entry)
+            return
+        now = time.time()
+        entry = {
+            'url_key': key,
+            'url': normalize_url(url),
+            'hash': image['hash'],
+            'extension': os.path.splitext(image['filename'])[1],
+            'size': image['size'],
+            'width': image.get('width'),
+            'height': image.get('height'),
+            'expires_at': freshness_deadline(headers.get('Cache-Control'), headers.get('Expires'), headers.get('Age'), now),
+            'stored_at': now,
+            'last_used_at': now,
+        }
+        for header, field in VALIDATOR_HEADERS:
+            entry[field] = headers.get(header)
+        # استجابة بلا محققات ولا طزاجة لا يمكن إعادة استخدامها
+        if not (entry['etag'] or entry['last_modified'] or (entry['expires_at'] or 0) > now):
+            return
+        self.db.save_http_cache_entry(entry)
+        self.prune()
+
+    def prune(self, max_bytes=None):
+        """إخراج الروابط الأقدم استخداماً حتى لا يتجاوز الكاش حده؛ يعيد عدد المحذوف"""
+        evicted = self.db.evict_http_cache(self.max_bytes if max_bytes is None else max_bytes)
+        if evicted:
+            metrics.image_http_cache_evictions.inc(evicted)
+        return evicted
+
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S') if timestamp else '-'
+
+
+if __name__ == '__main__':
+    from database_cloud import Database
+    from image_store import ImageStore
+
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command not in ('stats', 'list', 'prune'):
+        print(__doc__)
+        sys.exit(1)
+    cache = HttpCache(ImageStore(Database()))
+    if command == 'stats':
+        stats = cache.db.http_cache_stats()
+        print(f"{stats['entries']} URLs, {stats['bytes']} bytes (limit {cache.max_bytes})")
+    elif command == 'list':
+        for entry in cache.db.http_cache_entries(int(sys.argv[2]) if len(sys.argv) > 2 else 50):
+            fresh = 'fresh' if cache.is_fresh(entry) else 'stale'
+            print(f"{_format_time(entry['last_used_at'])}  {entry['size']:>10}  {fresh}  "
+                  f"etag={entry['etag'] or '-'}  {entry['url']}")
+    else:
+        max_bytes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        print(f"Evicted {cache.prune(max_bytes)} URLs")
@@ -0,0 +1,171 @@
+"""محرك تحميل الصور المتوازي مع حدود تزامن عامة ولكل مضيف"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# الإعدادات قابلة للتغيير عبر متغيرات البيئة
+MAX_WORKERS = int(os.environ.get('IMAGE_DOWNLOAD_WORKERS', 16))
+PER_HOST_LIMIT = int(os.environ.get('IMAGE_DOWNLOAD_PER_HOST', 4))
+MAX_RETRIES = int(os.environ.get('IMAGE_DOWNLOAD_RETRIES', 3))
+CONNECT_TIMEOUT = float(os.environ.get('IMAGE_DOWNLOAD_CONNECT_TIMEOUT', 10))
+READ_TIMEOUT = float(os.environ.get('IMAGE_DOWNLOAD_READ_TIMEOUT', 60))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+CHUNK_SIZE = 64 * 1024
+# أخطاء العميل لا تفيد إعادة المحاولة فيها باستثناء هذه
+RETRYABLE_CLIENT_ERRORS = {408, 425, 429}
+
+
+def guess_extension(url, content_type):
+    """تحديد امتداد الملف من الرابط أو نوع المحتوى"""
+    file_extension = os.path.splitext(urlparse(url).path)[1]
+    if file_extension:
+        return file_extension
+    content_type = content_type or ''
+    if 'jpeg' in content_type or 'jpg' in content_type:
+        return '.jpg'
+    if 'png' in content_type:
+        return '.png'
+    if 'webp' in content_type:
+        return '.webp'
+    return '.jpg'  # افتراضي
+
+
+class ImageDownloader:
+    """تحميل صور متعددة بالتوازي عبر جلسة HTTP مشتركة تحافظ على الاتصالات"""
+
+    def __init__(self, max_workers=MAX_WORKERS, per_host_limit=PER_HOST_LIMIT, max_retries=MAX_RETRIES):
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.max_retries = max_retries
+        self.timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        # مجمع اتصالات keep-alive يكفي لكل العمال
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # المجمع مشترك بين كل الطلبات فيمثل الحد العام للتزامن
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-download')
+        # حد كل مضيف يُطبق قبل المجمع: ما زاد عنه ينتظر في طابور مضيفه ولا يحجز عاملاً،
+        # فالمضيف البطيء لا يعطل تحميل صور المضيفين الآخرين
+        self._host_active = {}
+        self._host_pending = {}
+        self._host_lock = threading.Lock()
+
+    def _submit(self, url, store, cache=None):
+        """جدولة تحميل رابط، ويعيد Future تكتمل بنتيجة download"""
+        future = Future()
+        host = urlparse(url).netloc.lower()
+        task = (future, url, store, cache)
+        with self._host_lock:
+            if self._host_active.get(host, 0) >= self.per_host_limit:
+                self._host_pending.setdefault(host, deque()).append(task)
+                return future
+            self._host_active[host] = self._host_active.get(host, 0) + 1
+        self._executor.submit(self._run, host, *task)
+        return future
+
+    def _run(self, host, future, url, store, cache):
+        try:
+            future.set_result(self.download(url, store, cache))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            self._release_host(host)
+
+    def _release_host(self, host):
+        """تسليم مكان المضيف لأول رابط ينتظره، أو تحريره"""
+        with self._host_lock:
+            pending = self._host_pending.get(host)
+            task = pending.popleft() if pending else None
+            if task is None:
+                self._host_pending.pop(host, None)
+                self._host_active[host] -= 1
+                if not self._host_active[host]:
+                    del self._host_active[host]
+        if task is not None:
+            self._executor.submit(self._run, host, *task)
+
+    def _backoff(self, attempt):
+        """تأخير أسي مع تشويش كامل (full jitter)"""
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+    def _fetch_to_store(self, url, store, cache=None):
+        entry = cache.lookup(url) if cache else None
+        if entry and cache.is_fresh(entry):
+            metrics.image_http_cache_requests.inc(result='fresh')
+            return cache.reuse(entry)
+
+        headers = cache.conditional_headers(entry) if entry else None
+        with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+            if entry and response.status_code == 304:
+                metrics.image_http_cache_requests.inc(result='revalidated')
+                return cache.reuse(entry, response.headers)
+            response.raise_for_status()
+            default_extension = guess_extension(url, response.headers.get('content-type'))
+            # الهاش يُحسب أثناء البث في الذاكرة، والمحتوى المكرر لا يُكتب على القرص إلا إذا تجاوز SPOOL_MAX_SIZE
+            image = store.put(self._count_bytes(response.iter_content(chunk_size=CHUNK_SIZE)), default_extension)
+        if cache:
+            metrics.image_http_cache_requests.inc(result='changed' if entry else 'miss')
+            cache.save(url, image, response.headers)
+        return image
+
+    def _count_bytes(self, chunks):
+        for chunk in chunks:
+            metrics.image_download_bytes.inc(len(chunk))
+            yield chunk
+
+    def download(self, url, store, cache=None):
+        """تحميل صورة واحدة إلى المخزن مع إعادة المحاولة، ويعيد None عند الفشل
+
+        مع cache (HttpCache) تُستخدم النسخة المخزنة ما دامت طازجة أو أكدها الموقع بـ 304.
+        """
+        started = time.perf_counter()
+        result = self._download(url, store, cache)
+        outcome = 'success' if result else 'failed'
+        metrics.image_downloads.inc(result=outcome)
+        metrics.image_download_duration.observe(time.perf_counter() - started, result=outcome)
+        return result
+
+    def _download(self, url, store, cache=None):
+        for attempt in range(self.max_retries):
+            try:
+                return self._fetch_to_store(url, store, cache)
+            except Exception as e:
+                print(f"Attempt {attempt + 1} failed for image {url}: {e}")
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                if status and 400 <= status < 500 and status not in RETRYABLE_CLIENT_ERRORS:
+                    break
+                if attempt == self.max_retries - 1:
+                    print(f"Failed to download image after {self.max_retries} attempts: {url}")
+                else:
+                    time.sleep(self._backoff(attempt))
+        return None
+
+    def download_all(self, image_urls, store, cache=None):
+        """تحميل كل الصور بالتوازي مع الحفاظ على ترتيب الروابط"""
+        futures = [self._submit(url, store, cache) for url in image_urls]
+        return [future.result() for future in futures]
+
+    def download_iter(self, image_urls, store, cache=None):
+        """تحميل الصور بالتوازي وإرجاع (الترتيب، النتيجة) لكل صورة فور اكتمالها"""
+        futures = {self._submit(url, store, cache): index for index, url in enumerate(image_urls)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+downloader = ImageDownloader()
@@ -0,0 +1,209 @@
+"""مخزن صور معنون بالمحتوى: كل ملف يُحفظ مرة واحدة باسم بصمته SHA-256
+
+يُحسب الهاش أثناء البث إلى ذاكرة مؤقتة (تُنقل إلى ملف في مجلد المخزن إذا
+تجاوزت SPOOL_MAX_SIZE)، فإذا كان المحتوى موجوداً مسبقاً لا يُكتب شيء على
+القرص للصور المعتادة، وإلا يُكتب ملف مؤقت ثم يُنقل إلى مكانه بـ os.replace.
+عدد المراجع لكل ملف يُحدّث في قاعدة البيانات مع كتابة المنتج نفسه.
+
+الاستخدام من سطر الأوامر:
+    python image_store.py gc    # حذف الملفات غير المرتبطة بأي منتج
+"""
+import hashlib
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+import metrics
+
+# مهلة قبل حذف ملف لم يعد مرتبطاً بأي منتج، لتفادي السباق مع حفظ جديد لنفس المحتوى
+GC_GRACE_SECONDS = int(os.environ.get('IMAGE_GC_GRACE_SECONDS', 3600))
+# حجم المحتوى الذي يبقى في الذاكرة أثناء حساب الهاش قبل نقله إلى ملف مؤقت
+SPOOL_MAX_SIZE = int(os.environ.get('IMAGE_SPOOL_MAX_SIZE', 4 * 1024 * 1024))
+
+HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# البصمات السحرية لأنواع الصور الشائعة
+MAGIC_TYPES = [
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+    (b'BM', '.bmp'),
+]
+
+
+class UnsupportedImageType(ValueError):
+    pass
+
+
+def sniff_extension(head):
+    """تحديد امتداد الصورة من أول بايتات المحتوى، أو None إذا لم يُعرف"""
+    for magic, extension in MAGIC_TYPES:
+        if head.startswith(magic):
+            return extension
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'avif', b'avis'):
+        return '.avif'
+    if head.lstrip()[:5] in (b'<?xml', b'<svg ') or b'<svg' in head[:256]:
+        return '.svg'
+    return None
+
+
+def _check_type(head, allowed_extensions):
+    if sniff_extension(head) not in allowed_extensions:
+        raise UnsupportedImageType('نوع الملف غير مدعوم')
+
+
+def image_dimensions(fileobj):
+    """(العرض، الارتفاع) من ترويسة الصورة دون فك بكسلاتها، أو (None, None)"""
+    if not PIL_AVAILABLE:
+        return None, None
+    try:
+        with Image.open(fileobj) as image:
+            return image.size
+    except Exception:
+        return None, None
+
+
+class ImageStore:
+    """حفظ الصور باسم بصمتها تحت saved_images/blobs/<أول حرفين>/<الهاش><الامتداد>"""
+
+    def __init__(self, db, root='saved_images'):
+        self.db = db
+        self.root = root
+        self.blobs_dir = os.path.join(root, 'blobs')
+        self.tmp_dir = os.path.join(self.blobs_dir, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def relative_path(self, blob_hash, extension):
+        return os.path.join(self.blobs_dir, blob_hash[:2], f"{blob_hash}{extension}")
+
+    def _write_temp(self, spool):
+        """نسخ المحتوى إلى ملف مؤقت في مجلد المخزن (على نفس القرص لـ os.replace)"""
+        spool.seek(0)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(spool, f, 64 * 1024)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    def put(self, chunks, default_extension='.jpg', allowed_extensions=None):
+        """حفظ محتوى مبثوث وإرجاع وصفه؛ المحتوى الموجود مسبقاً لا يُكتب على القرص
+        ما لم يتجاوز SPOOL_MAX_SIZE
+
+        مع allowed_extensions يُرفض المحتوى (UnsupportedImageType) بمجرد أن تكشف
+        أول بايتاته نوعاً غير مسموح، قبل قراءة بقيته.
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        head = b''
+        checked = allowed_extensions is None
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, dir=self.tmp_dir) as spool:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if len(head) < 512:
+                    head += chunk[:512 - len(head)]
+                if not checked and len(head) >= 512:
+                    _check_type(head, allowed_extensions)
+                    checked = True
+                hasher.update(chunk)
+                spool.write(chunk)
+                size += len(chunk)
+            if not checked:
+                _check_type(head, allowed_extensions)
+            spool.seek(0)
+            width, height = image_dimensions(spool)
+
+            blob_hash = hasher.hexdigest()
+            extension = sniff_extension(head) or default_extension
+            path = self.relative_path(blob_hash, extension)
+
+            tmp_path = None
+            try:
+                # الملف الجديد يُكتب قبل أخذ القفل حتى لا تطول معاملة الكتابة
+                if not os.path.exists(path):
+                    tmp_path = self._write_temp(spool)
+
+                # التسجيل يجدد مهلة الحذف، وقفله يمنع GC من حذف الملف قبل اعتماده
+                with self.db.storing_blob(blob_hash, size, extension):
+                    created = not os.path.exists(path)
+                    if created and tmp_path is None:
+                        # كان موجوداً عند الفحص الأول ثم حذفه GC
+                        tmp_path = self._write_temp(spool)
+                    if created:
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        # الإعادة الذرية تمنع ظهور ملف ناقص لعملية أخرى
+                        os.replace(tmp_path, path)
+            finally:
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        if created:
+            metrics.image_store_bytes_written.inc(size)
+        metrics.image_store_writes.inc(result='stored' if created else 'duplicate')
+
+        return {
+            'filename': os.path.basename(path),
+            'path': path,
+            'size': size,
+            'hash': blob_hash,
+            'width': width,
+            'height': height,
+            'created': created,
+        }
+
+    def find(self, blob_hash):
+        """المسار الكامل للملف حسب الهاش، أو None"""
+        if not HASH_RE.match(blob_hash):
+            return None
+        shard = os.path.join(self.blobs_dir, blob_hash[:2])
+        try:
+            for entry in os.scandir(shard):
+                if entry.name.startswith(blob_hash):
+                    return entry.path
+        except FileNotFoundError:
+            pass
+        return None
+
+    def collect_garbage(self, grace_seconds=GC_GRACE_SECONDS):
+        """حذف الملفات التي لم يعد يشير إليها أي منتج منذ مهلة السماح"""
+        removed = 0
+        for blob in self.db.unreferenced_blobs(grace_seconds):
+            # الملف يُحذف قبل اعتماد حذف سجله، فلا يعتمد عليه put متزامن
+            with self.db.deleting_unreferenced_blob(blob['hash'], grace_seconds) as deleted:
+                if not deleted:
+                    continue
+                path = self.relative_path(blob['hash'], blob['extension'] or '')
+                if os.path.exists(path):
+                    os.remove(path)
+                # حذف النسخ المصغرة المشتقة من الملف أيضاً
+                derivatives_dir = os.path.join(self.root, 'derivatives')
+                if os.path.isdir(derivatives_dir):
+                    for size in os.listdir(derivatives_dir):
+                        derivative = os.path.join(derivatives_dir, size, blob['hash'][:2], f"{blob['hash']}.webp")
+                        if os.path.exists(derivative):
+                            os.remove(derivative)
+            removed += 1
+        return removed
+
+
+if __name__ == '__main__':
+    from database_cloud import Database
+
+    if len(sys.argv) < 2 or sys.argv[1] != 'gc':
+        print(__doc__)
+        sys.exit(1)
+    store = ImageStore(Database())
+    print(f"Removed {store.collect_garbage()} unreferenced blobs")
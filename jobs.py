@@ -0,0 +1,185 @@
+"""طابور مهام دائم مخزن في قاعدة البيانات مع عمال في خيوط محلية
+
+كل مهمة تُحجز لعامل واحد لمدة محددة (lease) تتجدد مع كل تحديث للتقدم.
+إذا توقف الخادم أثناء التنفيذ تعود المهمة إلى الطابور عند التشغيل التالي
+(أو بعد انتهاء مدة الحجز إذا كان العامل على جهاز آخر)، ويستأنف المعالج
+من التقدم المحفوظ بدلاً من البدء من الصفر.
+"""
+import os
+import socket
+import threading
+import time
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+# عدد مرات الحجز قبل اعتبار المهمة فاشلة (مثلاً إذا كانت توقف الخادم في كل مرة)
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+
+
+def _progress_summary(progress):
+    """عدد عناصر التقدم حسب حالتها لإرساله في أحداث المهمة"""
+    counts = {'total': len(progress) if isinstance(progress, list) else 0}
+    for item in progress if isinstance(progress, list) else []:
+        status = item.get('status') if isinstance(item, dict) else None
+        if status:
+            counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobContext:
+    """واجهة المعالج لحفظ التقدم وإنهاء المهمة"""
+
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.job = job
+        self.finished = False
+
+    def progress(self, progress):
+        if not self.queue.db.update_job_progress(self.job['id'], self.queue.worker_id, progress, JOB_LEASE_SECONDS):
+            raise RuntimeError(f"Lost lease on job {self.job['id']}")
+        self.queue.publish(self.job, 'job.progress', {'progress': _progress_summary(progress)})
+
+    def complete(self, result, status='done', error=None):
+        """إنهاء المهمة؛ يمكن استدعاؤها داخل معاملة المعالج لتُحفظ معها"""
+        if not self.queue.db.finish_job(self.job['id'], self.queue.worker_id, status, result, error):
+            raise RuntimeError(f"Lost lease on job {self.job['id']}")
+        self.finished = True
+        self.queue.publish(self.job, f'job.{status}', {'error': error})
+
+
+class JobQueue:
+    """إضافة المهام وتشغيلها في خيوط عاملة داخل العملية"""
+
+    def __init__(self, db, workers=JOB_WORKERS, on_event=None):
+        self.db = db
+        self.workers = workers
+        self.handlers = {}
+        # يُستدعى بعد تسجيل حدث للمهمة (لإيقاظ بث الأحداث)
+        self.on_event = on_event
+        self._pid = None
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def worker_id(self):
+        # يتضمن رقم العملية لمعرفة المهام اليتيمة بعد إعادة التشغيل
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def register(self, kind, handler):
+        """تسجيل معالج لنوع مهمة: handler(job, context)"""
+        self.handlers[kind] = handler
+
+    def enqueue(self, user_id, kind, payload):
+        job_id = self.db.create_job(user_id, kind, payload)
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def publish(self, job, event_type, data):
+        """تسجيل حدث للمهمة لصاحبها؛ فشل الحدث لا يوقف المهمة"""
+        try:
+            self.db.publish_event(job['user_id'], event_type, dict(data, job_id=job['id'], kind=job['kind']))
+        except Exception as e:
+            print(f"Error publishing event for job {job['id']}: {e}")
+            return
+        if self.on_event:
+            self.on_event()
+
+    def get(self, job_id, user_id=None):
+        return self.db.get_job(job_id, user_id)
+
+    def recover(self):
+        """إعادة مهام العمليات المتوقفة على هذا الجهاز إلى الطابور"""
+        host = socket.gethostname()
+        recovered = 0
+        for owner in self.db.running_job_owners():
+            owner_host, _, pid = owner.rpartition(':')
+            if owner_host == host and pid.isdigit() and not _process_alive(int(pid)):
+                recovered += self.db.requeue_jobs(owner)
+        if recovered:
+            print(f"Requeued {recovered} interrupted jobs")
+        return recovered
+
+    def start(self):
+        """تشغيل الخيوط العاملة مرة واحدة لكل عملية"""
+        with self._lock:
+            if self._pid == os.getpid() or self.workers <= 0:
+                return
+            self._pid = os.getpid()
+            self._threads = []
+            self._stopping.clear()
+            try:
+                self.recover()
+            except Exception as e:
+                print(f"Error recovering jobs: {e}")
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'job-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """إيقاف منظم: لا تُحجز مهام جديدة، وما لم ينته خلال timeout يعود إلى الطابور"""
+        if self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        if any(thread.is_alive() for thread in self._threads):
+            # تستأنفها عملية أخرى فوراً بدلاً من انتظار انتهاء الحجز
+            requeued = self.db.requeue_jobs(self.worker_id)
+            if requeued:
+                print(f"Requeued {requeued} unfinished jobs on shutdown")
+
+    def healthy(self):
+        """False إذا بدأت الخيوط العاملة في هذه العملية ثم توقفت (للتحقق من الجاهزية)"""
+        if self._pid != os.getpid():
+            return True
+        return not self._stopping.is_set() and all(thread.is_alive() for thread in self._threads)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                job = self.db.claim_job(self.worker_id, JOB_LEASE_SECONDS)
+            except Exception as e:
+                print(f"Error claiming job: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        context = JobContext(self, job)
+        try:
+            handler = self.handlers.get(job['kind'])
+            if handler is None:
+                context.complete(None, status='failed', error=f"Unknown job kind: {job['kind']}")
+            elif job['attempts'] > JOB_MAX_ATTEMPTS:
+                context.complete(None, status='failed', error='تجاوزت المهمة الحد الأقصى لمحاولات التنفيذ')
+            else:
+                result = handler(job, context)
+                if not context.finished:
+                    context.complete(result)
+        except Exception as e:
+            print(f"Error running job {job['id']}: {e}")
+            if not context.finished:
+                try:
+                    context.complete(None, status='failed', error=str(e))
+                except Exception as finish_error:
+                    print(f"Error finishing job {job['id']}: {finish_error}")
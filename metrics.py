@@ -0,0 +1,326 @@
+"""مقاييس الأداء (زمن الطلبات، تحميل الصور) بصيغة Prometheus النصية
+
+كل عملية تجمع مقاييسها في الذاكرة (قفل واحد لكل تحديث)، وإذا حُدد
+METRICS_DIR تكتب نسخة منها دورياً إلى ملف باسم رقم العملية. نقطة /metrics
+في أي عامل تجمع ملفات كل العمال مع قيمها الحية، فتبقى الأرقام صحيحة مع
+تعدد العمليات. عدادات العمليات المتوقفة تبقى في المجموع (تضمها العملية
+الرئيسية إلى ملف واحد عبر Registry.retire)، أما المقاييس اللحظية (gauges)
+فتُحسب للعمليات الحية فقط. يجب تفريغ المجلد عند بدء تشغيل الخادم الرئيسي.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 2))
+# حدود الزمن بالثواني
+# مجموع عدادات العمال المنتهين ومدرجاتهم في ملف واحد بدل ملف لكل رقم عملية
+RETIRED_FILE = 'retired.json'
+# حدود الزمن بالثواني
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DOWNLOAD_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _merge(metrics, totals, snapshot, include_gauges=True):
+    """إضافة لقطة عملية إلى المجاميع (الأعداد تُجمع، ومدرجات الزمن حداً بحد)"""
+    for name, values in snapshot.items():
+        metric = metrics.get(name)
+        if metric is None or (metric.kind == 'gauge' and not include_gauges):
+            continue
+        merged = totals.setdefault(name, {})
+        for key, value in values.items():
+            if isinstance(value, list):
+                current = merged.get(key)
+                if current is None or len(current) != len(value):
+                    merged[key] = list(value)
+                else:
+                    merged[key] = [a + b for a, b in zip(current, value)]
+            else:
+                merged[key] = merged.get(key, 0) + value
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help_text, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        registry.add(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def reset(self):
+        self.values = {}
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """نسخ عداد تحسبه جهة أخرى (من دوال التجميع)"""
+        with self.registry.lock:
+            self.values[self._key(labels)] = value
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.registry.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            # عدد لكل حد (غير تراكمي) ثم المجموع والعدد الكلي
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+
+class Registry:
+    """سجل مقاييس العملية، مع الحفظ في ملف لتجميعه مع العمليات الأخرى"""
+
+    def __init__(self, directory=METRICS_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []
+        self._pid = None
+        # العملية الابنة تبدأ من الصفر، فقيم العملية الأم في ملفها هي
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+
+    def on_collect(self, collector):
+        """دالة تحدّث مقاييس محسوبة في مكان آخر قبل كل لقطة"""
+        self.collectors.append(collector)
+        return collector
+
+    def _after_fork(self):
+        self.lock = threading.Lock()
+        self._pid = None
+        for metric in self.metrics.values():
+            metric.reset()
+
+    def start(self):
+        """تشغيل الحفظ الدوري مرة واحدة لكل عملية"""
+        if not self.directory or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def snapshot(self):
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+        with self.lock:
+            return {
+                name: {key: list(value) if isinstance(value, list) else value for key, value in metric.values.items()}
+                for name, metric in self.metrics.items()
+            }
+
+    @staticmethod
+    def _write(path, snapshot):
+        data = {name: [[list(key), value] for key, value in values.items()] for name, values in snapshot.items()}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read(path):
+        """لقطة من ملف، أو None إذا لم يوجد أو لم يكتمل"""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return {name: {tuple(key): value for key, value in values} for name, values in data.items()}
+
+    def flush(self):
+        if not self.directory or self._pid != os.getpid():
+            return
+        self._write(self._path(os.getpid()), self.snapshot())
+
+    def retire(self, pid):
+        """دمج عدادات عملية منتهية ومدرجاتها في RETIRED_FILE وحذف ملفها
+
+        تُستدعى من العملية الرئيسية بعد خروج العامل (child_exit في gunicorn)، فلا
+        يكبر المجلد مع تجدد العمال. المقاييس اللحظية للعملية المنتهية تُهمل.
+        """
+        if not self.directory:
+            return
+        path = self._path(pid)
+        snapshot = self._read(path)
+        if snapshot is not None:
+            retired_path = os.path.join(self.directory, RETIRED_FILE)
+            totals = self._read(retired_path) or {}
+            _merge(self.metrics, totals, snapshot, include_gauges=False)
+            self._write(retired_path, totals)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error writing metrics: {e}")
+
+    def _other_processes(self):
+        """لقطات العمليات الأخرى من ملفاتها: (حية؟, البيانات)"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            pid, ext = os.path.splitext(filename)
+            if filename == RETIRED_FILE:
+                alive = False
+            elif ext != '.json' or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            else:
+                alive = _process_alive(int(pid))
+            snapshot = self._read(os.path.join(self.directory, filename))
+            if snapshot is not None:
+                yield alive, snapshot
+
+    def collect(self):
+        """مجموع قيم هذه العملية والعمليات الأخرى"""
+        totals = self.snapshot()
+        for alive, snapshot in self._other_processes():
+            _merge(self.metrics, totals, snapshot, include_gauges=alive)
+        return totals
+
+    def render(self):
+        """نص المقاييس بصيغة Prometheus"""
+        lines = []
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(values.items()):
+                if metric.kind != 'histogram':
+                    lines.append(f"{name}{_format_labels(metric.labels, key)} {_format_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets, value):
+                    cumulative += count
+                    le = f'le="{_format_number(bound)}"'
+                    lines.append(f"{name}_bucket{_format_labels(metric.labels, key, le)} {cumulative}")
+                inf = 'le="+Inf"'
+                lines.append(f"{name}_bucket{_format_labels(metric.labels, key, inf)} {value[-1]}")
+                lines.append(f"{name}_sum{_format_labels(metric.labels, key)} {_format_number(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(metric.labels, key)} {value[-1]}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_request_duration = Histogram(
+    registry, 'http_request_duration_seconds', 'Time to build the HTTP response',
+    labels=('method', 'route', 'status'))
+http_requests_in_flight = Gauge(
+    registry, 'http_requests_in_flight', 'HTTP requests currently being handled')
+image_downloads = Counter(
+    registry, 'image_downloads_total', 'Remote image downloads by result',
+    labels=('result',))
+image_download_duration = Histogram(
+    registry, 'image_download_duration_seconds', 'Time spent fetching one remote image, retries included',
+    labels=('result',), buckets=DOWNLOAD_BUCKETS)
+image_download_bytes = Counter(
+    registry, 'image_download_bytes_total', 'Bytes received from remote image hosts')
+image_http_cache_requests = Counter(
+    registry, 'image_http_cache_requests_total',
+    'Remote image fetches by HTTP cache outcome (fresh, revalidated, changed, miss)',
+    labels=('result',))
+image_http_cache_evictions = Counter(
+    registry, 'image_http_cache_evictions_total', 'URLs evicted from the image HTTP cache to stay under its size limit')
+image_store_writes = Counter(
+    registry, 'image_store_writes_total', 'Images saved to the content-addressed store by outcome',
+    labels=('result',))
+image_store_bytes_written = Counter(
+    registry, 'image_store_bytes_written_total', 'Bytes written to disk by the image store')
+cache_hits = Counter(
+    registry, 'cache_hits_total', 'In-process cache lookups served from memory',
+    labels=('cache',))
+cache_misses = Counter(
+    registry, 'cache_misses_total', 'In-process cache lookups that fell through',
+    labels=('cache',))
+cache_evictions = Counter(
+    registry, 'cache_evictions_total', 'Entries evicted from in-process caches to stay under their size limit',
+    labels=('cache',))
+cache_entries = Gauge(
+    registry, 'cache_entries', 'Entries currently held by in-process caches',
+    labels=('cache',))
@@ -0,0 +1,613 @@
+"""ترحيلات مخطط قاعدة البيانات ذات الإصدارات (SQLite + PostgreSQL)
+
+كل ترحيل له رقم إصدار واسم وخطوات لكل محرك. الخطوة إما نص SQL أو دالة
+تستقبل (cursor, use_postgres). كل ترحيل يُطبق في معاملة واحدة مع تسجيل
+رقمه في جدول schema_migrations، ولذلك لا يُعاد تطبيقه عند التشغيل التالي.
+"""
+
+import sqlite3
+
+from product_images import backfill_product_images
+from search import backfill_search_index
+
+# مفتاح القفل الاستشاري في PostgreSQL لمنع تشغيل الترحيلات من عدة عمال معاً
+MIGRATION_LOCK_KEY = 7231001
+
+
+def _column_exists(cursor, use_postgres, table, column):
+    if use_postgres:
+        cursor.execute(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+            (table, column)
+        )
+        return cursor.fetchone() is not None
+    cursor.execute(f"PRAGMA table_info({table})")
+    return any(row['name'] == column for row in cursor.fetchall())
+
+
+def add_column(table, column, definition):
+    """خطوة ترحيل لإضافة عمود إذا لم يكن موجوداً"""
+    def step(cursor, use_postgres):
+        if not _column_exists(cursor, use_postgres, table, column):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+def drop_column(table, column):
+    """خطوة ترحيل لحذف عمود إذا كان موجوداً
+
+    SQLite قبل 3.35 لا يدعم DROP COLUMN، فيبقى العمود فيه دون استخدام.
+    """
+    def step(cursor, use_postgres):
+        if not use_postgres and sqlite3.sqlite_version_info < (3, 35, 0):
+            return
+        if _column_exists(cursor, use_postgres, table, column):
+            cursor.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+    return step
+
+
+# ملء season_stats كما طُبق في الترحيلين 13 (باسم الموسم) و 14 (برقمه)؛ نسخ ثابتة
+# لأن rebuild_season_stats يتبع مخطط الجدول الحالي وقد يتغير بعدهما
+SEASON_STATS_BY_NAME = '''
+    INSERT INTO season_stats (user_id, season, status, product_count, image_bytes)
+    SELECT user_id, season, status, COUNT(*), COALESCE(SUM(image_bytes), 0)
+    FROM (
+        SELECT p.user_id, COALESCE(p.season, '') AS season, COALESCE(p.status, '') AS status,
+               (SELECT SUM(i.size) FROM product_images i WHERE i.product_id = p.id) AS image_bytes
+        FROM products p
+    ) s
+    GROUP BY user_id, season, status
+'''
+SEASON_STATS_BY_ID = '''
+    INSERT INTO season_stats (user_id, season_id, status, product_count, image_bytes)
+    SELECT user_id, season_id, status, COUNT(*), COALESCE(SUM(image_bytes), 0)
+    FROM (
+        SELECT p.user_id, COALESCE(p.season_id, 0) AS season_id, COALESCE(p.status, '') AS status,
+               (SELECT SUM(i.size) FROM product_images i WHERE i.product_id = p.id) AS image_bytes
+        FROM products p
+    ) s
+    GROUP BY user_id, season_id, status
+'''
+
+MIGRATIONS = [
+    (1, 'initial_schema', {
+        'postgres': [
+            '''
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                username VARCHAR(255) UNIQUE NOT NULL,
+                email VARCHAR(255) UNIQUE NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                is_verified BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_active BOOLEAN DEFAULT TRUE
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS products (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                name VARCHAR(255) NOT NULL,
+                url TEXT,
+                description TEXT,
+                price DECIMAL(10,2) DEFAULT 0,
+                images TEXT,
+                status VARCHAR(50) DEFAULT 'pending',
+                season VARCHAR(100),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS seasons (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                name VARCHAR(255) NOT NULL,
+                description TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            ''',
+        ],
+        'sqlite': [
+            '''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                is_verified BOOLEAN DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_active BOOLEAN DEFAULT 1
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS products (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                url TEXT,
+                description TEXT,
+                price REAL DEFAULT 0,
+                images TEXT,
+                status TEXT DEFAULT 'pending',
+                season TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS seasons (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                description TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            ''',
+        ],
+    }),
+    (2, 'products_currency', {
+        'postgres': [add_column('products', 'currency', "VARCHAR(10) DEFAULT 'SAR'")],
+        'sqlite': [add_column('products', 'currency', "TEXT DEFAULT 'SAR'")],
+    }),
+    (3, 'products_seasons_indexes', {
+        'postgres': [
+            # يتضمن id ليغطي ترتيب التصفح (created_at, id)
+            "CREATE INDEX IF NOT EXISTS idx_products_user_created ON products (user_id, created_at, id)",
+            "CREATE INDEX IF NOT EXISTS idx_products_user_status ON products (user_id, status)",
+            "CREATE INDEX IF NOT EXISTS idx_products_user_season ON products (user_id, season)",
+            "CREATE INDEX IF NOT EXISTS idx_seasons_user_created ON seasons (user_id, created_at)",
+            # إزالة المواسم المكررة قبل إنشاء الفهرس الفريد
+            '''
+            DELETE FROM seasons a USING seasons b
+            WHERE a.user_id = b.user_id AND a.name = b.name AND a.id > b.id
+            ''',
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_seasons_user_name ON seasons (user_id, name)",
+        ],
+        'sqlite': [
+            "CREATE INDEX IF NOT EXISTS idx_products_user_created ON products (user_id, created_at, id)",
+            "CREATE INDEX IF NOT EXISTS idx_products_user_status ON products (user_id, status)",
+            "CREATE INDEX IF NOT EXISTS idx_products_user_season ON products (user_id, season)",
+            "CREATE INDEX IF NOT EXISTS idx_seasons_user_created ON seasons (user_id, created_at)",
+            '''
+            DELETE FROM seasons WHERE id NOT IN (
+                SELECT MIN(id) FROM seasons GROUP BY user_id, name
+            )
+            ''',
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_seasons_user_name ON seasons (user_id, name)",
+        ],
+    }),
+    (4, 'image_blobs', {
+        'postgres': [
+            '''
+            CREATE TABLE IF NOT EXISTS image_blobs (
+                hash CHAR(64) PRIMARY KEY,
+                size BIGINT NOT NULL,
+                extension VARCHAR(10),
+                refcount INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                released_at TIMESTAMP
+            )
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_image_blobs_unreferenced ON image_blobs (released_at) WHERE refcount <= 0",
+        ],
+        'sqlite': [
+            '''
+            CREATE TABLE IF NOT EXISTS image_blobs (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                extension TEXT,
+                refcount INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                released_at TIMESTAMP
+            )
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_image_blobs_unreferenced ON image_blobs (released_at) WHERE refcount <= 0",
+        ],
+    }),
+    (5, 'products_derivatives', {
+        'postgres': [add_column('products', 'derivatives', 'TEXT')],
+        'sqlite': [add_column('products', 'derivatives', 'TEXT')],
+    }),
+    (6, 'jobs', {
+        'postgres': [
+            '''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                kind VARCHAR(50) NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                payload TEXT NOT NULL,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                locked_by VARCHAR(255),
+                locked_until TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs (status, id) WHERE status IN ('queued', 'running')",
+        ],
+        'sqlite': [
+            '''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                payload TEXT NOT NULL,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                locked_by TEXT,
+                locked_until TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs (status, id) WHERE status IN ('queued', 'running')",
+        ],
+    }),
+    # جدول مستقل عن users لأن منتجات الحساب الثابت لا يقابلها صف في users
+    (7, 'user_versions', {
+        'postgres': [
+            '''
+            CREATE TABLE IF NOT EXISTS user_versions (
+                user_id INTEGER PRIMARY KEY,
+                version BIGINT NOT NULL DEFAULT 0
+            )
+            ''',
+        ],
+        'sqlite': [
+            '''
+            CREATE TABLE IF NOT EXISTS user_versions (
+                user_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+            ''',
+        ],
+    }),
+    # رقم الإصدار الذي تغير فيه المنتج، وسجل المحذوفات للمزامنة بالتغييرات
+    (8, 'product_changes', {
+        'postgres': [
+            add_column('products', 'change_seq', 'BIGINT NOT NULL DEFAULT 0'),
+            "CREATE INDEX IF NOT EXISTS idx_products_user_change ON products (user_id, change_seq)",
+            '''
+            CREATE TABLE IF NOT EXISTS product_tombstones (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                product_id INTEGER,
+                seq BIGINT NOT NULL,
+                deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_product_tombstones_user_seq ON product_tombstones (user_id, seq)",
+            "CREATE INDEX IF NOT EXISTS idx_product_tombstones_deleted ON product_tombstones (deleted_at)",
+            # أقدم رقم يمكن المزامنة منه بعد ضغط السجل
+            add_column('user_versions', 'compacted_seq', 'BIGINT NOT NULL DEFAULT 0'),
+        ],
+        'sqlite': [
+            add_column('products', 'change_seq', 'INTEGER NOT NULL DEFAULT 0'),
+            "CREATE INDEX IF NOT EXISTS idx_products_user_change ON products (user_id, change_seq)",
+            '''
+            CREATE TABLE IF NOT EXISTS product_tombstones (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                product_id INTEGER,
+                seq INTEGER NOT NULL,
+                deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_product_tombstones_user_seq ON product_tombstones (user_id, seq)",
+            "CREATE INDEX IF NOT EXISTS idx_product_tombstones_deleted ON product_tombstones (deleted_at)",
+            add_column('user_versions', 'compacted_seq', 'INTEGER NOT NULL DEFAULT 0'),
+        ],
+    }),
+    # سجل أحداث قصير العمر يوزعه كل خادم على اتصالات SSE لديه
+    (9, 'events', {
+        'postgres': [
+            '''
+            CREATE TABLE IF NOT EXISTS events (
+                id BIGSERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                type VARCHAR(50) NOT NULL,
+                data TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_events_created ON events (created_at)",
+        ],
+        'sqlite': [
+            '''
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                data TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_events_created ON events (created_at)",
+        ],
+    }),
+    # البحث النصي في الاسم والوصف بعد تطبيع النص العربي (search.py)
+    (10, 'products_search', {
+        'postgres': [
+            add_column('products', 'search_vector', 'tsvector'),
+            "CREATE INDEX IF NOT EXISTS idx_products_search ON products USING GIN (search_vector)",
+            backfill_search_index,
+        ],
+        'sqlite': [
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                name, description, tokenize = 'unicode61 remove_diacritics 2'
+            )
+            """,
+            backfill_search_index,
+        ],
+    }),
+    # صف لكل صورة بدلاً من قائمة JSON في products.images
+    (11, 'product_images', {
+        'postgres': [
+            '''
+            CREATE TABLE IF NOT EXISTS product_images (
+                id SERIAL PRIMARY KEY,
+                product_id INTEGER NOT NULL REFERENCES products (id) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                source_url TEXT,
+                size BIGINT,
+                hash CHAR(64),
+                width INTEGER,
+                height INTEGER
+            )
+            ''',
+            # يغطي جلب صور منتج بترتيبها وربط الغلاف (position = 0)
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_product_images_product ON product_images (product_id, position)",
+            backfill_product_images,
+            drop_column('products', 'images'),
+        ],
+        'sqlite': [
+            '''
+            CREATE TABLE IF NOT EXISTS product_images (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                source_url TEXT,
+                size INTEGER,
+                hash TEXT,
+                width INTEGER,
+                height INTEGER,
+                FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+            )
+            ''',
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_product_images_product ON product_images (product_id, position)",
+            backfill_product_images,
+            drop_column('products', 'images'),
+        ],
+    }),
+    (12, 'http_cache', {
+        'postgres': [
+            '''
+            CREATE TABLE IF NOT EXISTS http_cache (
+                url_key CHAR(64) PRIMARY KEY,
+                url TEXT NOT NULL,
+                hash CHAR(64) NOT NULL,
+                extension VARCHAR(10),
+                size BIGINT NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                etag TEXT,
+                last_modified TEXT,
+                cache_control TEXT,
+                expires_at DOUBLE PRECISION,
+                stored_at DOUBLE PRECISION NOT NULL,
+                last_used_at DOUBLE PRECISION NOT NULL
+            )
+            ''',
+            # ترتيب الإخراج (الأقدم استخداماً أولاً) واستبعاد الملفات المخزنة من الحذف
+            "CREATE INDEX IF NOT EXISTS idx_http_cache_last_used ON http_cache (last_used_at)",
+            "CREATE INDEX IF NOT EXISTS idx_http_cache_hash ON http_cache (hash)",
+        ],
+        'sqlite': [
+            '''
+            CREATE TABLE IF NOT EXISTS http_cache (
+                url_key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                extension TEXT,
+                size INTEGER NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                etag TEXT,
+                last_modified TEXT,
+                cache_control TEXT,
+                expires_at REAL,
+                stored_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_http_cache_last_used ON http_cache (last_used_at)",
+            "CREATE INDEX IF NOT EXISTS idx_http_cache_hash ON http_cache (hash)",
+        ],
+    }),
+    # عدد المنتجات وحجم صورها لكل موسم وحالة (season_stats.py)
+    (13, 'season_stats', {
+        'postgres': [
+            '''
+            CREATE TABLE IF NOT EXISTS season_stats (
+                user_id INTEGER NOT NULL,
+                season VARCHAR(255) NOT NULL,
+                status VARCHAR(50) NOT NULL,
+                product_count INTEGER NOT NULL DEFAULT 0,
+                image_bytes BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, season, status)
+            )
+            ''',
+            SEASON_STATS_BY_NAME,
+        ],
+        'sqlite': [
+            '''
+            CREATE TABLE IF NOT EXISTS season_stats (
+                user_id INTEGER NOT NULL,
+                season TEXT NOT NULL,
+                status TEXT NOT NULL,
+                product_count INTEGER NOT NULL DEFAULT 0,
+                image_bytes INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, season, status)
+            )
+            ''',
+            SEASON_STATS_BY_NAME,
+        ],
+    }),
+    # المنتج يشير إلى موسمه برقمه، فتغيير اسم الموسم يعدل صفاً واحداً
+    (14, 'products_season_id', {
+        'postgres': [
+            add_column('products', 'season_id', 'INTEGER REFERENCES seasons (id) ON DELETE SET NULL'),
+            # أسماء المواسم المكتوبة في المنتجات دون صف في seasons تصبح مواسم
+            '''
+            INSERT INTO seasons (user_id, name)
+            SELECT DISTINCT p.user_id, p.season FROM products p
+            WHERE p.season IS NOT NULL AND p.season <> ''
+              AND NOT EXISTS (SELECT 1 FROM seasons s WHERE s.user_id = p.user_id AND s.name = p.season)
+            ''',
+            '''
+            UPDATE products SET season_id = s.id FROM seasons s
+            WHERE s.user_id = products.user_id AND s.name = products.season
+            ''',
+            "DROP INDEX IF EXISTS idx_products_user_season",
+            # يغطي التصفية بالموسم مع ترتيب التصفح (created_at, id)
+            "CREATE INDEX IF NOT EXISTS idx_products_user_season_id ON products (user_id, season_id, created_at, id)",
+            drop_column('products', 'season'),
+            # الملخص يُعاد بناؤه بمفتاح رقم الموسم (0 للمنتجات بلا موسم)
+            "DROP TABLE IF EXISTS season_stats",
+            '''
+            CREATE TABLE season_stats (
+                user_id INTEGER NOT NULL,
+                season_id INTEGER NOT NULL,
+                status VARCHAR(50) NOT NULL,
+                product_count INTEGER NOT NULL DEFAULT 0,
+                image_bytes BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, season_id, status)
+            )
+            ''',
+            SEASON_STATS_BY_ID,
+        ],
+        'sqlite': [
+            add_column('products', 'season_id', 'INTEGER REFERENCES seasons (id) ON DELETE SET NULL'),
+            '''
+            INSERT INTO seasons (user_id, name)
+            SELECT DISTINCT p.user_id, p.season FROM products p
+            WHERE p.season IS NOT NULL AND p.season <> ''
+              AND NOT EXISTS (SELECT 1 FROM seasons s WHERE s.user_id = p.user_id AND s.name = p.season)
+            ''',
+            '''
+            UPDATE products SET season_id = (
+                SELECT s.id FROM seasons s WHERE s.user_id = products.user_id AND s.name = products.season
+            )
+            WHERE season IS NOT NULL AND season <> ''
+            ''',
+            # الفهرس القديم يمنع حذف العمود في SQLite
+            "DROP INDEX IF EXISTS idx_products_user_season",
+            "CREATE INDEX IF NOT EXISTS idx_products_user_season_id ON products (user_id, season_id, created_at, id)",
+            drop_column('products', 'season'),
+            "DROP TABLE IF EXISTS season_stats",
+            '''
+            CREATE TABLE season_stats (
+                user_id INTEGER NOT NULL,
+                season_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                product_count INTEGER NOT NULL DEFAULT 0,
+                image_bytes INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, season_id, status)
+            )
+            ''',
+            SEASON_STATS_BY_ID,
+        ],
+    }),
+    # إعادة الفهرسة لتضاف جذوع الكلمات بدون أداة التعريف والحروف المتصلة
+    (15, 'products_search_clitics', {
+        'postgres': [backfill_search_index],
+        'sqlite': [backfill_search_index],
+    }),
+]
+
+
+def _ensure_version_table(db):
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        if db.use_postgres:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+
+def applied_versions(db):
+    """أرقام الترحيلات المطبقة"""
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT version FROM schema_migrations")
+        return {row['version'] for row in cursor.fetchall()}
+
+
+def pending_migrations(db):
+    """أسماء الترحيلات غير المطبقة بعد"""
+    applied = applied_versions(db)
+    return [name for version, name, _ in MIGRATIONS if version not in applied]
+
+
+def _apply(db, version, name, steps):
+    engine = 'postgres' if db.use_postgres else 'sqlite'
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        # قفل يمنع عاملين من تطبيق نفس الترحيل في الوقت نفسه
+        if db.use_postgres:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+        else:
+            cursor.execute("BEGIN IMMEDIATE")
+
+        ph = '%s' if db.use_postgres else '?'
+        cursor.execute(f"SELECT 1 FROM schema_migrations WHERE version = {ph}", (version,))
+        if cursor.fetchone():
+            return False
+
+        for step in steps[engine]:
+            if callable(step):
+                step(cursor, db.use_postgres)
+            else:
+                cursor.execute(step)
+
+        cursor.execute(
+            f"INSERT INTO schema_migrations (version, name) VALUES ({ph}, {ph})",
+            (version, name)
+        )
+    return True
+
+
+def run_migrations(db):
+    """تطبيق الترحيلات المعلقة فقط بالترتيب، ويعيد أرقام ما طُبق منها"""
+    _ensure_version_table(db)
+    done = applied_versions(db)
+    applied = []
+    for version, name, steps in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in done:
+            continue
+        if _apply(db, version, name, steps):
+            print(f"Applied migration {version}: {name}")
+            applied.append(version)
+    return applied
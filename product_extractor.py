@@ -0,0 +1,603 @@
+"""جلب صفحات المنتجات وتحليلها على الخادم مرة واحدة لكل رابط
+
+يستخرج الاسم والصور والسعر والعملة معاً من البيانات المنظمة (JSON-LD و
+Open Graph) ثم من محددات خاصة بكل موقع، مع ذاكرة مؤقتة حسب الرابط الموحد.
+"""
+import ipaddress
+import json
+import os
+import re
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import parse_qsl, unquote, urlencode, urljoin, urlparse, urlunparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from cache import TTLCache
+from image_downloader import USER_AGENT
+
+EXTRACT_CACHE_TTL = int(os.environ.get('EXTRACT_CACHE_TTL', 3600))
+EXTRACT_CACHE_SIZE = int(os.environ.get('EXTRACT_CACHE_SIZE', 2048))
+FETCH_TIMEOUT = (10, 20)
+# أقصى حجم للصفحة المقروءة لتجنب استهلاك الذاكرة
+MAX_PAGE_BYTES = 3 * 1024 * 1024
+MAX_IMAGES = 5
+# التحويلات تُتبع يدوياً ليُتحقق من عنوان كل خطوة قبل طلبها
+MAX_REDIRECTS = 5
+# السماح بجلب عناوين الشبكة الداخلية (للتطوير فقط)
+ALLOW_PRIVATE_HOSTS = os.environ.get('EXTRACT_ALLOW_PRIVATE', 'False').lower() == 'true'
+
+# معاملات التتبع التي لا تغير محتوى الصفحة
+TRACKING_PARAMS = {'ref', 'ref_', 'ref_src', 'tag', 'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'psc', 'th'}
+
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+             'param', 'source', 'track', 'wbr'}
+# العناصر التي نحتفظ بنصها (بحد أقصى) لمحددات السعر
+MAX_TEXT_LENGTH = 200
+
+
+def normalize_url(url):
+    """توحيد الرابط لاستخدامه كمفتاح للذاكرة المؤقتة"""
+    parsed = urlparse(url.strip())
+    host = parsed.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+        if not k.lower().startswith('utm_') and k.lower() not in TRACKING_PARAMS
+    )
+    path = parsed.path.rstrip('/') or '/'
+    return urlunparse((parsed.scheme.lower(), host, path, '', urlencode(query), ''))
+
+
+def is_internal_address(address):
+    """هل العنوان من الشبكة الداخلية أو محجوز (ومنه عنوان بيانات السحابة 169.254.169.254)"""
+    ip = ipaddress.ip_address(address.split('%')[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return (ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_reserved
+            or ip.is_multicast or ip.is_unspecified)
+
+
+def validate_url(url):
+    """التحقق من أن الرابط http(s) ولا يشير إلى الشبكة الداخلية، ويرفع ValueError
+
+    يعيد العناوين التي تحقق منها ليتصل الطلب بها نفسها (None مع EXTRACT_ALLOW_PRIVATE).
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError('رابط غير صالح')
+    if ALLOW_PRIVATE_HOSTS:
+        return None
+    try:
+        addresses = list(dict.fromkeys(info[4][0] for info in socket.getaddrinfo(parsed.hostname, None)))
+    except socket.gaierror:
+        raise ValueError('تعذر الوصول إلى الموقع')
+    if not addresses or any(is_internal_address(address) for address in addresses):
+        raise ValueError('لا يمكن جلب عناوين الشبكة الداخلية')
+    return addresses
+
+
+# العنوان المتحقق منه لكل مضيف في الطلب الجاري على هذا الخيط
+_pinned = threading.local()
+
+
+class _PinnedConnectionMixin:
+    """اتصال بالعنوان الذي أعاده validate_url بدل حل الاسم مرة ثانية
+
+    اسم يعيد عنواناً عاماً عند التحقق ثم عنواناً داخلياً عند الاتصال لا يتجاوز
+    الفحص. ترويسة Host و SNI والتحقق من الشهادة تبقى باسم المضيف الأصلي.
+    """
+
+    def _new_conn(self):
+        address = getattr(_pinned, 'addresses', {}).get(self.host)
+        if address is None:
+            return super()._new_conn()
+        # urllib3 يحل _dns_host عند الاتصال، وبقية الاتصال تستخدم self.host
+        dns_host, self._dns_host = self._dns_host, address
+        try:
+            return super()._new_conn()
+        finally:
+            self._dns_host = dns_host
+
+
+class _PinnedHTTPConnection(_PinnedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _PinnedHTTPSConnection(_PinnedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _PinnedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _PinnedHTTPConnection
+
+
+class _PinnedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _PinnedHTTPSConnection
+
+
+class PinnedAdapter(HTTPAdapter):
+    """محول requests يتصل بالعناوين المثبتة في _pinned"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _PinnedHTTPConnectionPool,
+            'https': _PinnedHTTPSConnectionPool,
+        }
+
+
+class Element:
+    __slots__ = ('tag', 'attrs', 'ancestors', 'text')
+
+    def __init__(self, tag, attrs, ancestors):
+        self.tag = tag
+        self.attrs = attrs
+        self.ancestors = ancestors
+        self.text = []
+
+    def get_text(self):
+        return ''.join(self.text).strip()
+
+
+class PageDocument(HTMLParser):
+    """تحليل الصفحة مرة واحدة إلى عناصر قابلة للاستعلام بمحددات CSS بسيطة"""
+
+    def __init__(self, html):
+        super().__init__(convert_charrefs=True)
+        self.elements = []
+        self.meta = {}
+        self.json_ld = []
+        self.title = ''
+        self._stack = []
+        self._script_type = None
+        self._script_chunks = []
+        self._in_title = False
+        self.feed(html)
+        self.close()
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {k: (v or '') for k, v in attrs}
+        element = Element(tag, attrs, tuple(self._stack))
+        self.elements.append(element)
+
+        if tag == 'meta':
+            key = attrs.get('property') or attrs.get('name') or attrs.get('itemprop')
+            if key and 'content' in attrs:
+                self.meta.setdefault(key.lower(), attrs['content'])
+        elif tag == 'script':
+            self._script_type = attrs.get('type', '').lower()
+            self._script_chunks = []
+        elif tag == 'title':
+            self._in_title = True
+
+        if tag not in VOID_TAGS:
+            self._stack.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self._stack and self._stack[-1].tag == tag:
+            self._stack.pop()
+
+    def handle_endtag(self, tag):
+        if tag == 'script':
+            if self._script_type == 'application/ld+json':
+                try:
+                    self.json_ld.append(json.loads(''.join(self._script_chunks)))
+                except ValueError:
+                    pass
+            self._script_type = None
+        elif tag == 'title':
+            self._in_title = False
+        # إغلاق أقرب عنصر مطابق (HTML غير المنضبط شائع)
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i].tag == tag:
+                del self._stack[i:]
+                break
+
+    def handle_data(self, data):
+        if self._script_type is not None:
+            self._script_chunks.append(data)
+            return
+        if self._in_title:
+            self.title += data
+        for element in self._stack[-3:]:
+            if sum(len(t) for t in element.text) < MAX_TEXT_LENGTH:
+                element.text.append(data)
+
+    def select(self, selector):
+        """إرجاع العناصر المطابقة لمحدد مثل '.product-gallery img' أو 'img[src*="x"]'"""
+        parts = [_parse_compound(p) for p in selector.split()]
+        target, ancestors = parts[-1], parts[:-1]
+        return [
+            element for element in self.elements
+            if _matches(element, target) and _matches_ancestors(element.ancestors, ancestors)
+        ]
+
+
+_COMPOUND_RE = re.compile(r'([.#]?[\w-]+)|\[([\w-]+)(?:([*^$]?=)"?([^"\]]*)"?)?\]')
+
+
+def _parse_compound(text):
+    tag, classes, ids, attrs = None, [], [], []
+    for token, attr, op, value in _COMPOUND_RE.findall(text):
+        if attr:
+            attrs.append((attr, op, value))
+        elif token.startswith('.'):
+            classes.append(token[1:])
+        elif token.startswith('#'):
+            ids.append(token[1:])
+        else:
+            tag = token.lower()
+    return tag, classes, ids, attrs
+
+
+def _matches(element, compound):
+    tag, classes, ids, attrs = compound
+    if tag and element.tag != tag:
+        return False
+    if classes:
+        element_classes = element.attrs.get('class', '').split()
+        if any(c not in element_classes for c in classes):
+            return False
+    if ids and element.attrs.get('id') not in ids:
+        return False
+    for name, op, value in attrs:
+        actual = element.attrs.get(name)
+        if actual is None:
+            return False
+        if op == '*=' and value not in actual:
+            return False
+        if op == '^=' and not actual.startswith(value):
+            return False
+        if op == '$=' and not actual.endswith(value):
+            return False
+        if op == '=' and actual != value:
+            return False
+    return True
+
+
+def _matches_ancestors(ancestors, compounds):
+    index = len(ancestors) - 1
+    for compound in reversed(compounds):
+        while index >= 0 and not _matches(ancestors[index], compound):
+            index -= 1
+        if index < 0:
+            return False
+        index -= 1
+    return True
+
+
+def parse_price(text):
+    """تحويل نص السعر إلى رقم (يدعم الأرقام العربية والفواصل)"""
+    if text is None:
+        return 0
+    text = str(text).translate(str.maketrans('٠١٢٣٤٥٦٧٨٩٫٬', '0123456789.,'))
+    match = re.search(r'\d[\d,]*(?:\.\d+)?', text)
+    if not match:
+        return 0
+    try:
+        price = float(match.group(0).replace(',', ''))
+    except ValueError:
+        return 0
+    return price if price > 0 else 0
+
+
+def detect_currency(domain):
+    """العملة الافتراضية حسب نطاق الموقع (نفس منطق detectCurrencyFromUrl في الواجهة)"""
+    if domain.endswith('.sa') or 'salla' in domain or 'zid' in domain:
+        return 'SAR'
+    if domain.endswith('.ae'):
+        return 'AED'
+    if domain.endswith('.kw'):
+        return 'KWD'
+    if domain.endswith('.qa'):
+        return 'QAR'
+    if domain.endswith('.bh'):
+        return 'BHD'
+    if domain.endswith('.om'):
+        return 'OMR'
+    if domain.endswith('.jo'):
+        return 'JOD'
+    if domain.endswith('.eg'):
+        return 'EGP'
+    if domain.endswith('.co.uk') or domain.endswith('.uk'):
+        return 'GBP'
+    if any(domain.endswith(tld) for tld in ('.eu', '.de', '.fr', '.it', '.es')):
+        return 'EUR'
+    if domain.endswith('.com') or domain.endswith('.us'):
+        return 'USD'
+    return 'SAR'
+
+
+class SiteExtractor:
+    """محددات خاصة بموقع معين لاستخراج الصور والسعر والاسم من الرابط"""
+
+    def __init__(self, domains, image_selectors=(), image_hint=None, price_selectors=(),
+                 name_pattern=None, image_transform=None):
+        self.domains = domains
+        self.image_selectors = image_selectors
+        self.image_hint = image_hint
+        self.price_selectors = price_selectors
+        self.name_pattern = name_pattern
+        self.image_transform = image_transform
+
+    def handles(self, domain):
+        return any(d in domain for d in self.domains)
+
+    def images(self, doc, base_url):
+        images = []
+        for selector in self.image_selectors:
+            for element in doc.select(selector):
+                src = element.attrs.get('data-src') or element.attrs.get('src') or ''
+                dynamic = element.attrs.get('data-a-dynamic-image')
+                if dynamic and not src:
+                    try:
+                        src = next(iter(json.loads(dynamic)))
+                    except (ValueError, StopIteration):
+                        src = ''
+                if not src or src.startswith('data:'):
+                    continue
+                if self.image_hint and self.image_hint not in src:
+                    continue
+                src = urljoin(base_url, src)
+                if self.image_transform:
+                    src = self.image_transform(src)
+                if src not in images:
+                    images.append(src)
+            if len(images) >= MAX_IMAGES:
+                break
+        return images
+
+    def price(self, doc):
+        for selector in self.price_selectors:
+            for element in doc.select(selector):
+                price = parse_price(element.attrs.get('data-price') or element.get_text())
+                if price:
+                    return price
+        return 0
+
+    def name_from_url(self, url):
+        if self.name_pattern:
+            match = re.search(self.name_pattern, url)
+            if match:
+                return unquote(match.group(1)).replace('-', ' ').replace('_', ' ')
+        parts = [p for p in urlparse(url).path.split('/') if p]
+        if parts and len(parts[-1]) > 3:
+            return unquote(parts[-1]).replace('-', ' ').replace('_', ' ')
+        return None
+
+
+GENERIC = SiteExtractor(
+    domains=(),
+    image_selectors=('.product-image img', '.product-photo img', '.main-image img', '.featured-image img',
+                     'img[alt*="product"]', 'img[alt*="Product"]', 'img[class*="product"]', 'img[id*="product"]'),
+    image_hint='http',
+    price_selectors=('.price', '.product-price', '.cost', '.amount', '[class*="price"]', '[id*="price"]'),
+)
+
+SITE_EXTRACTORS = [
+    SiteExtractor(
+        domains=('etsy.com',),
+        image_selectors=('img[data-src*="il_794xN"]', 'img[src*="il_794xN"]', '.carousel-image img',
+                         '.listing-page-image img', 'img[alt*="listing"]'),
+        image_hint='etsystatic.com',
+        price_selectors=('[data-test-id="price"]', '.currency-value'),
+        name_pattern=r'/listing/\d+/([^?/]+)',
+    ),
+    SiteExtractor(
+        domains=('amazon.',),
+        image_selectors=('#landingImage', '#imgBlkFront', '.a-dynamic-image', 'img[data-src*="images/I/"]',
+                         'img[src*="images/I/"]', '#altImages img'),
+        image_hint='images/I/',
+        price_selectors=('.a-price .a-offscreen', '#priceblock_dealprice', '#priceblock_ourprice',
+                         '.a-price-whole'),
+    ),
+    SiteExtractor(
+        domains=('ebay.',),
+        image_selectors=('#icImg', '#mainImgHldr img', '.ux-image-carousel-item img',
+                         '.ux-image-filmstrip-carousel-item img', 'img[src*="ebayimg.com"]', '#PicturePanel img'),
+        image_hint='ebayimg.com',
+        price_selectors=('[data-testid="x-price-primary"] .notranslate', '.display-price .notranslate',
+                         '.ux-textspans.notranslate', '.notranslate'),
+        name_pattern=r'/itm/([^?/]+)',
+        image_transform=lambda src: re.sub(r's-l\d+', 's-l1600', src),
+    ),
+    SiteExtractor(
+        domains=('myshopify.com',),
+        image_selectors=('.product__media img', '.product-single__photo img', '.product-photo-container img',
+                         'img[src*="cdn.shopify.com"]', '.product-image-main img', '.featured-image img'),
+        image_hint='shopify.com',
+        price_selectors=('.price-item--regular', '.product__price', '.price'),
+    ),
+    SiteExtractor(
+        domains=('aliexpress.',),
+        image_selectors=('.images-view-item img', '.product-image img', 'img[src*="alicdn.com"]',
+                         '.image-view img', '.main-image img'),
+        image_hint='alicdn.com',
+        price_selectors=('.product-price-value', '.uniform-banner-box-price', '[class*="price"]'),
+    ),
+    SiteExtractor(
+        domains=('noon.com',),
+        image_selectors=('.swiper-slide img', '.product-image img', 'img[src*="nooncdn.com"]',
+                         '.image-gallery img', '.product-gallery img'),
+        image_hint='http',
+        price_selectors=('.priceNow', '[data-qa="pdp-price"]', '.productPrice', '.price-current', '.price'),
+    ),
+    SiteExtractor(
+        domains=('salla.sa', '.salla.me'),
+        image_selectors=('.product-gallery img', '.product-images img', '.gallery-item img', '.product-image img',
+                         '[data-src*="salla"]', 'img[src*="salla"]', '.swiper-slide img', '.product-slider img'),
+        image_hint='http',
+        price_selectors=('.product-price', '.s-product-card-price', '[data-price]', '.price'),
+        name_pattern=r'/product/([^?/]+)',
+    ),
+    SiteExtractor(
+        domains=('zid.sa', '.zid.store'),
+        image_selectors=('.product-gallery img', '.product-images img', '.gallery-item img', '.product-image img',
+                         '[data-src*="zid"]', 'img[src*="zid"]', '.swiper-slide img', '.product-photos img'),
+        image_hint='http',
+        price_selectors=('.product-price', '.price-current', '[data-price]', '.price'),
+        name_pattern=r'/products/([^?/]+)',
+    ),
+]
+
+
+def extractor_for(domain):
+    for extractor in SITE_EXTRACTORS:
+        if extractor.handles(domain):
+            return extractor
+    return GENERIC
+
+
+def _json_ld_product(doc):
+    """أول كائن Product في بيانات JSON-LD"""
+    stack = list(doc.json_ld)
+    while stack:
+        item = stack.pop(0)
+        if isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, dict):
+            item_type = item.get('@type')
+            types = item_type if isinstance(item_type, list) else [item_type]
+            if 'Product' in types:
+                return item
+            if '@graph' in item:
+                stack.extend(item['@graph'] if isinstance(item['@graph'], list) else [item['@graph']])
+    return None
+
+
+def extract_from_html(url, html):
+    """استخراج الاسم والصور والسعر والعملة من صفحة HTML محللة مرة واحدة"""
+    doc = PageDocument(html)
+    domain = urlparse(url).netloc.lower().replace('www.', '')
+    extractor = extractor_for(domain)
+
+    name = None
+    images = []
+    price = 0
+    currency = None
+
+    product = _json_ld_product(doc)
+    if product:
+        name = product.get('name')
+        ld_images = product.get('image') or []
+        if isinstance(ld_images, (str, dict)):
+            ld_images = [ld_images]
+        for image in ld_images:
+            src = image.get('url') if isinstance(image, dict) else image
+            if isinstance(src, str) and src:
+                images.append(urljoin(url, src))
+        offers = product.get('offers') or {}
+        if isinstance(offers, list):
+            offers = offers[0] if offers else {}
+        if isinstance(offers, dict):
+            price = parse_price(offers.get('price') or offers.get('lowPrice'))
+            currency = offers.get('priceCurrency')
+
+    name = name or doc.meta.get('og:title') or doc.title.strip() or extractor.name_from_url(url)
+    og_image = doc.meta.get('og:image')
+    if og_image:
+        images.append(urljoin(url, og_image))
+    images.extend(extractor.images(doc, url))
+    if extractor is not GENERIC and len(images) < MAX_IMAGES:
+        images.extend(GENERIC.images(doc, url))
+
+    price = price or parse_price(doc.meta.get('product:price:amount') or doc.meta.get('og:price:amount'))
+    price = price or extractor.price(doc)
+    currency = currency or doc.meta.get('product:price:currency') or doc.meta.get('og:price:currency')
+
+    unique_images = []
+    for image in images:
+        if image not in unique_images:
+            unique_images.append(image)
+
+    return {
+        'url': url,
+        'name': name.strip() if name else None,
+        'images': unique_images[:MAX_IMAGES],
+        'price': price,
+        'currency': (currency or detect_currency(domain)).upper(),
+    }
+
+
+class ProductExtractor:
+    """جلب صفحة المنتج مرة واحدة وتخزين النتيجة مؤقتاً حسب الرابط الموحد"""
+
+    def __init__(self, max_workers=8):
+        self.cache = TTLCache(max_entries=EXTRACT_CACHE_SIZE, ttl=EXTRACT_CACHE_TTL)
+        self.session = requests.Session()
+        self.session.headers.update({
+            'User-Agent': USER_AGENT,
+            'Accept': 'text/html,application/xhtml+xml',
+            'Accept-Language': 'ar,en;q=0.8',
+        })
+        adapter = PinnedAdapter()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='product-extract')
+
+    def _get(self, url):
+        """طلب الصفحة مع تتبع التحويلات يدوياً، والتحقق من كل Location قبل طلبه"""
+        for _ in range(MAX_REDIRECTS + 1):
+            addresses = validate_url(url)
+            _pinned.addresses = {urlparse(url).hostname: addresses[0]} if addresses else {}
+            try:
+                response = self.session.get(url, timeout=FETCH_TIMEOUT, stream=True, allow_redirects=False)
+            finally:
+                _pinned.addresses = {}
+            if not response.is_redirect:
+                return response
+            response.close()
+            url = urljoin(url, response.headers['location'])
+        raise ValueError('تحويلات كثيرة جداً')
+
+    def fetch_html(self, url):
+        with self._get(url) as response:
+            response.raise_for_status()
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= MAX_PAGE_BYTES:
+                    break
+            body = b''.join(chunks)
+            # requests يفترض ISO-8859-1 إذا غاب charset من الترويسة
+            if 'charset' in response.headers.get('content-type', '').lower():
+                encoding = response.encoding
+            else:
+                match = re.search(rb'<meta[^>]+charset=["\']?([\w-]+)', body[:4096], re.IGNORECASE)
+                encoding = match.group(1).decode('ascii') if match else 'utf-8'
+            try:
+                return body.decode(encoding, errors='replace')
+            except LookupError:
+                return body.decode('utf-8', errors='replace')
+
+    def extract(self, url):
+        key = normalize_url(url)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return dict(cached, url=url, cached=True)
+        result = extract_from_html(url, self.fetch_html(url))
+        self.cache.set(key, result)
+        return dict(result, cached=False)
+
+    def extract_many(self, urls):
+        """استخراج عدة روابط بالتوازي؛ الخطأ يُسجل في نتيجة الرابط نفسه"""
+        def safe_extract(url):
+            try:
+                return self.extract(url)
+            except Exception as e:
+                print(f"Error extracting product {url}: {e}")
+                return {'url': url, 'error': str(e)}
+        return list(self._executor.map(safe_extract, urls))
+
+
+extractor = ProductExtractor()
@@ -0,0 +1,88 @@
+"""صور المنتجات في جدول product_images: صف لكل صورة بترتيبها وبياناتها
+
+الصورة الأولى (position = 0) هي الغلاف الذي تعرضه القوائم، فتُجلب بربط
+واحد دون قراءة بقية الصور. الصورة تُعطى نصاً (مسار محلي أو رابط خارجي)
+أو قاموساً فيه path مع source_url و size و hash و width و height.
+"""
+import json
+import re
+
+# مسار ملف في مخزن الصور المعنون بالمحتوى (image_store.py)
+BLOB_PATH_RE = re.compile(r'blobs/[0-9a-f]{2}/([0-9a-f]{64})')
+
+IMAGE_COLUMNS = ['position', 'path', 'source_url', 'size', 'hash', 'width', 'height']
+
+
+def image_rows(images, known=None):
+    """صفوف product_images (بدون product_id) من قائمة صور بترتيبها
+
+    known: {المسار: صف موجود} لإبقاء بيانات الصور التي أُعيد إرسالها كنص فقط.
+    """
+    rows = []
+    for image in images or []:
+        if isinstance(image, str):
+            image = (known or {}).get(image) or {'path': image}
+        if not isinstance(image, dict) or not isinstance(image.get('path'), str) or not image['path']:
+            continue
+        match = BLOB_PATH_RE.search(image['path'].replace('\\', '/'))
+        rows.append({
+            'position': len(rows),
+            'path': image['path'],
+            'source_url': image.get('source_url'),
+            'size': image.get('size'),
+            # بصمة المخزن من المسار نفسه هي المرجع لعدّ الاستخدام
+            'hash': match.group(1) if match else image.get('hash'),
+            'width': image.get('width'),
+            'height': image.get('height'),
+        })
+    return rows
+
+
+def insert_image_rows(cursor, use_postgres, product_id, rows):
+    """إدراج صفوف صور منتج ضمن المعاملة الحالية"""
+    if not rows:
+        return
+    ph = '%s' if use_postgres else '?'
+    cursor.executemany(
+        f"""INSERT INTO product_images (product_id, {', '.join(IMAGE_COLUMNS)})
+            VALUES ({', '.join([ph] * (len(IMAGE_COLUMNS) + 1))})""",
+        [(product_id,) + tuple(row[column] for column in IMAGE_COLUMNS) for row in rows]
+    )
+
+
+# فاصل بين الروابط في عمود images قديم كُتب نصاً: فاصلة يتبعها بداية رابط أو مسار
+# (الفواصل داخل الرابط نفسه، كما في روابط التحويل عند خدمات الصور، تبقى)
+_LEGACY_SEPARATOR_RE = re.compile(r',\s*(?=https?://|data:|/|saved_images[/\\])')
+
+
+def legacy_images(value):
+    """قائمة الصور من قيمة عمود products.images القديم، أو None إذا لم تُفهم
+
+    القيمة JSON عادة؛ النص غير JSON يُعامل كرابط واحد أو روابط مفصولة بفواصل.
+    """
+    try:
+        images = json.loads(value)
+    except ValueError:
+        return [part.strip() for part in _LEGACY_SEPARATOR_RE.split(value) if part.strip()]
+    if isinstance(images, (str, dict)):
+        images = [images]
+    return images if isinstance(images, list) else None
+
+
+def backfill_product_images(cursor, use_postgres):
+    """خطوة ترحيل: نقل قوائم الصور من عمود products.images إلى الجدول
+
+    إذا وُجدت قيمة لا تُقرأ صورها يتوقف الترحيل بأرقام منتجاتها، لأن الخطوة
+    التالية تحذف العمود ومعه ما لم يُنقل.
+    """
+    cursor.execute("SELECT id, images FROM products WHERE images IS NOT NULL")
+    unreadable = []
+    for product in cursor.fetchall():
+        images = legacy_images(product['images'])
+        rows = image_rows(images) if images is not None else []
+        if images is None or len(rows) < len([image for image in images if image]):
+            unreadable.append(product['id'])
+            continue
+        insert_image_rows(cursor, use_postgres, product['id'], rows)
+    if unreadable:
+        raise ValueError(f"صور غير مقروءة في products.images للمنتجات: {', '.join(map(str, unreadable))}")
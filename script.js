@@ -3,6 +3,8 @@ let currentUser = null;
 let users = JSON.parse(localStorage.getItem('users')) || [];
 let products = [];
 let seasons = {};
+// إحصاءات المواسم من الخادم (/api/seasons/stats) دون الحاجة لتحميل كل المنتجات
+let seasonStats = null;
 
 // Authentication functions
 async function checkAuthStatus() {
@@ -16,6 +18,7 @@ async function checkAuthStatus() {
             currentUser = data.user;
             showUserInfo(data.user);
             await loadUserData();
+            connectEvents();
         } else {
             // Allow access without authentication - use guest mode
             currentUser = null;
@@ -63,32 +66,188 @@ async function logout() {
     }
 }
 
+// حجم صفحة المنتجات عند التحميل التدريجي
+const PRODUCTS_PAGE_SIZE = 100;
+// رقم جيل التحميل لإلغاء التحميلات القديمة عند بدء تحميل جديد
+let productsLoadGeneration = 0;
+// موضع المزامنة بعد اكتمال التحميل الكامل؛ بعده تُجلب التغييرات فقط
+let productsSyncCursor = null;
+
+async function fetchProductsPage(cursor = null, params = {}) {
+    const query = new URLSearchParams({ limit: PRODUCTS_PAGE_SIZE, ...params });
+    if (cursor) {
+        query.set('cursor', cursor);
+    }
+    const response = await fetch(`/api/products?${query.toString()}`, {
+        credentials: 'include'
+    });
+    if (!response.ok) {
+        throw new Error(`Failed to load products: ${response.status}`);
+    }
+    const data = await response.json();
+    data.sync_cursor = response.headers.get('X-Sync-Cursor');
+    return data;
+}
+
+function refreshProductsView() {
+    // إعادة عرض المنتجات إذا كان العنصر موجود
+    if (productsGrid) {
+        // إعادة تطبيق الفلتر الحالي
+        const activeTab = document.querySelector('.filter-tab.active');
+        if (activeTab) {
+            const currentFilter = activeTab.getAttribute('data-filter');
+            filterProducts(currentFilter);
+        } else {
+            displayProducts(products);
+        }
+    }
+}
+
+// تحميل بقية الصفحات في الخلفية بعد عرض الصفحة الأولى
+// syncCursor من الصفحة الأولى: التغييرات بعده تُعاد فلا يضيع شيء أثناء التحميل
+async function loadRemainingProducts(cursor, generation, syncCursor = null) {
+    while (cursor && generation === productsLoadGeneration) {
+        try {
+            const data = await fetchProductsPage(cursor);
+            if (generation !== productsLoadGeneration) {
+                return;
+            }
+            products = products.concat(data.products || []);
+            cursor = data.next_cursor;
+            refreshProductsView();
+        } catch (error) {
+            console.error('Error loading more products:', error);
+            return;
+        }
+    }
+    if (generation === productsLoadGeneration) {
+        productsSyncCursor = syncCursor;
+    }
+    console.log('Products loaded from server:', products.length, 'products');
+}
+
+// تطبيق التغييرات منذ آخر مزامنة على القائمة المحلية؛ تعيد false إذا لزم تحميل كامل
+async function syncProductChanges() {
+    let cursor = productsSyncCursor;
+    const generation = productsLoadGeneration;
+    let hasMore = true;
+    while (hasMore) {
+        const response = await fetch(`/api/products/changes?since=${encodeURIComponent(cursor)}`, {
+            credentials: 'include'
+        });
+        if (!response.ok) {
+            throw new Error(`Failed to sync products: ${response.status}`);
+        }
+        const changes = await response.json();
+        if (generation !== productsLoadGeneration) {
+            return true;
+        }
+        if (changes.reset) {
+            return false;
+        }
+        
+        if (changes.cleared) {
+            products = [];
+        }
+        if (changes.deleted_ids.length) {
+            const deleted = new Set(changes.deleted_ids);
+            products = products.filter(p => !deleted.has(p.id));
+        }
+        const added = [];
+        changes.products.forEach(changed => {
+            const index = products.findIndex(p => p.id === changed.id);
+            if (index > -1) {
+                products[index] = changed;
+            } else {
+                added.push(changed);
+            }
+        });
+        // المنتجات الجديدة في أول القائمة (الأحدث أولاً)
+        products = added.sort((a, b) => b.id - a.id).concat(products);
+        
+        cursor = changes.cursor;
+        hasMore = changes.has_more;
+    }
+    productsSyncCursor = cursor;
+    refreshProductsView();
+    return true;
+}
+
+// بث الأحداث من الخادم: تحديث البيانات فور تغيرها بدلاً من إعادة الطلب الدوري
+let eventSource = null;
+let eventsSyncTimer = null;
+// دوال انتظار أحداث المهام مفهرسة برقم المهمة
+const jobEventWaiters = new Map();
+const EVENTS_SYNC_DELAY_MS = 200;
+
+function connectEvents() {
+    if (eventSource || !window.EventSource || !currentUser) {
+        return;
+    }
+    // يعيد المتصفح الاتصال تلقائياً ويرسل Last-Event-ID
+    eventSource = new EventSource('/api/events', { withCredentials: true });
+    
+    // عدة أحداث متتالية تؤدي إلى مزامنة واحدة
+    const scheduleSync = () => {
+        clearTimeout(eventsSyncTimer);
+        eventsSyncTimer = setTimeout(() => loadUserData(), EVENTS_SYNC_DELAY_MS);
+    };
+    eventSource.addEventListener('products.changed', scheduleSync);
+    eventSource.addEventListener('products.deleted', scheduleSync);
+    eventSource.addEventListener('seasons.changed', () => loadSeasons());
+    eventSource.addEventListener('reset', scheduleSync);
+    ['job.progress', 'job.done', 'job.failed'].forEach(type => {
+        eventSource.addEventListener(type, event => {
+            const data = JSON.parse(event.data);
+            const resolve = jobEventWaiters.get(data.job_id);
+            if (resolve) {
+                resolve(data);
+            }
+        });
+    });
+}
+
+// انتظار حدث للمهمة أو انقضاء المهلة (إذا لم يكن البث متصلاً)
+function waitForJobEvent(jobId, timeoutMs) {
+    return new Promise(resolve => {
+        const timer = setTimeout(() => {
+            jobEventWaiters.delete(jobId);
+            resolve(null);
+        }, timeoutMs);
+        jobEventWaiters.set(jobId, data => {
+            clearTimeout(timer);
+            jobEventWaiters.delete(jobId);
+            resolve(data);
+        });
+    });
+}
+
 async function loadUserData() {
     try {
         // Only load data if user is authenticated
         if (currentUser) {
-            // Load user's products
-            const productsResponse = await fetch('/api/products', {
-                credentials: 'include'
-            });
-            if (productsResponse.ok) {
-                const data = await productsResponse.json();
-                products = data.products || [];
-                console.log('Products loaded from server:', products.length, 'products');
-                
-                // إعادة عرض المنتجات إذا كان العنصر موجود
-                if (productsGrid) {
-                    // إعادة تطبيق الفلتر الحالي
-            const activeTab = document.querySelector('.filter-tab.active');
-            if (activeTab) {
-                const currentFilter = activeTab.getAttribute('data-filter');
-                filterProducts(currentFilter);
-            } else {
-                displayProducts(products);
+            // بعد التحميل الأول تكفي التغييرات منذ آخر مزامنة
+            let synced = false;
+            if (productsSyncCursor !== null) {
+                try {
+                    synced = await syncProductChanges();
+                } catch (error) {
+                    console.error(error.message);
+                }
             }
+            
+            // Load the first page of user's products, the rest loads lazily
+            if (!synced) {
+                productsSyncCursor = null;
+                const generation = ++productsLoadGeneration;
+                try {
+                    const data = await fetchProductsPage();
+                    products = data.products || [];
+                    refreshProductsView();
+                    loadRemainingProducts(data.next_cursor, generation, data.sync_cursor);
+                } catch (error) {
+                    console.error(error.message);
                 }
-            } else {
-                console.error('Failed to load products:', productsResponse.status);
             }
             
             // Load seasons using the loadSeasons function
@@ -250,6 +409,7 @@ document.addEventListener('DOMContentLoaded', async function() {
     
     initializeNavigation();
     setupEventListeners();
+    setupProductSearch();
     
     // Load products and seasons (now from database)
     loadProducts();
@@ -636,16 +796,17 @@ async function fetchProductInfo() {
     }
     
     try {
-        // Simulate API call to fetch product info
-        await new Promise(resolve => setTimeout(resolve, 2000));
+        // جلب الصفحة وتحليلها مرة واحدة على الخادم
+        const extracted = await extractProductFromServer(url);
         
-        // Extract product data from URL
         const productData = {
-            name: await extractProductName(url),
+            name: extracted.name || await extractProductName(url),
             description: generateProductDescription(url),
-            image: await extractProductImage(url),
-            price: await extractProductPrice(url),
-            currency: detectCurrencyFromUrl(url),
+            image: extracted.images && extracted.images.length > 0
+                ? extracted.images
+                : await fetchGenericProductImages(extractDomainFromUrl(url)),
+            price: extracted.price || 0,
+            currency: extracted.currency || detectCurrencyFromUrl(url),
             url: url
         };
         
@@ -723,488 +884,25 @@ async function extractProductName(url) {
     }
 }
 
-async function extractProductImage(url) {
+// استخراج الاسم والصور والسعر والعملة معاً عبر الخادم (طلب واحد لكل رابط)
+async function extractProductFromServer(url) {
     try {
-        const domain = extractDomainFromUrl(url);
-        
-        // Try to fetch actual product images from the URL
-        if (domain.includes('etsy.com')) {
-            return await fetchEtsyProductImages(url);
-
-        } else if (domain.includes('ebay.')) {
-            return await fetchEbayProductImages(url);
-
-        } else if (domain.includes('salla.sa') || domain.includes('.salla.me')) {
-            return await fetchSallaProductImages(url);
-        } else if (domain.includes('zid.sa') || domain.includes('.zid.store')) {
-            return await fetchZidProductImages(url);
-        } else {
-            // Try generic web scraping for other sites
-            return await fetchGenericWebImages(url);
-        }
-        
-        // Fallback to generic product images
-        return await fetchGenericProductImages(domain);
-    } catch {
-        return '/placeholder.svg';
-    }
-}
-
-async function extractProductPrice(url) {
-    try {
-        const domain = extractDomainFromUrl(url);
-        
-        // Try to fetch actual product price from the URL
-        if (domain.includes('etsy.com')) {
-            return await fetchEtsyProductPrice(url);
-        } else if (domain.includes('ebay.')) {
-            return await fetchEbayProductPrice(url);
-        } else if (domain.includes('amazon.')) {
-            return await fetchAmazonProductPrice(url);
-        } else if (domain.includes('salla.sa') || domain.includes('.salla.me')) {
-            return await fetchSallaProductPrice(url);
-        } else if (domain.includes('zid.sa') || domain.includes('.zid.store')) {
-            return await fetchZidProductPrice(url);
-        } else if (domain.includes('noon.com')) {
-            return await fetchNoonProductPrice(url);
-        } else {
-            // Try generic price extraction
-            return await fetchGenericProductPrice(url);
-        }
-    } catch (error) {
-        console.log('Error extracting price:', error);
-        return 0;
-    }
-}
-
-async function fetchEtsyProductImages(url) {
-    try {
-        // Use a CORS proxy to fetch the actual page
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        
-        if (data.contents) {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.contents, 'text/html');
-            
-            // Extract images from Etsy page
-            const images = [];
-            
-            // Try different selectors for Etsy images
-            const imageSelectors = [
-                'img[data-src*="il_794xN"]',
-                'img[src*="il_794xN"]',
-                '.carousel-image img',
-                '.listing-page-image img',
-                'img[alt*="listing"]'
-            ];
-            
-            for (const selector of imageSelectors) {
-                const imgElements = doc.querySelectorAll(selector);
-                imgElements.forEach(img => {
-                    const src = img.getAttribute('data-src') || img.getAttribute('src');
-                    if (src && src.includes('etsystatic.com') && !images.includes(src)) {
-                        images.push(src);
-                    }
-                });
-                if (images.length >= 5) break;
-            }
-            
-            if (images.length > 0) {
-                return images.slice(0, 5);
-            }
-        }
-    } catch (e) {
-        console.log('Error fetching Etsy images:', e);
-    }
-    return await fetchGenericProductImages('etsy.com');
-}
-
-async function fetchAmazonProductImages(url) {
-    try {
-        // Use a CORS proxy to fetch the actual page
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        
-        if (data.contents) {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.contents, 'text/html');
-            
-            // Extract images from Amazon page
-            const images = [];
-            
-            // Try different selectors for Amazon images
-            const imageSelectors = [
-                '#landingImage',
-                '#imgBlkFront',
-                '.a-dynamic-image',
-                'img[data-src*="images/I/"]',
-                'img[src*="images/I/"]',
-                '.image.item img',
-                '#altImages img'
-            ];
-            
-            for (const selector of imageSelectors) {
-                const imgElements = doc.querySelectorAll(selector);
-                imgElements.forEach(img => {
-                    const src = img.getAttribute('data-src') || img.getAttribute('src') || img.getAttribute('data-a-dynamic-image');
-                    if (src) {
-                        // Parse dynamic image data if it exists
-                        if (src.startsWith('{')) {
-                            try {
-                                const imageData = JSON.parse(src);
-                                const imageUrl = Object.keys(imageData)[0];
-                                if (imageUrl && imageUrl.includes('images/I/') && !images.includes(imageUrl)) {
-                                    images.push(imageUrl);
-                                }
-                            } catch (e) {}
-                        } else if (src.includes('images/I/') && !images.includes(src)) {
-                            images.push(src);
-                        }
-                    }
-                });
-                if (images.length >= 5) break;
-            }
-            
-            if (images.length > 0) {
-                return images.slice(0, 5);
-            }
-        }
-    } catch (e) {
-        console.log('Error fetching Amazon images:', e);
-    }
-    return await fetchGenericProductImages('amazon.com');
-}
-
-async function fetchEbayProductImages(url) {
-    try {
-        // Use a CORS proxy to fetch the actual page
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        
-        if (data.contents) {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.contents, 'text/html');
-            
-            // Extract images from eBay page
-            const images = [];
-            
-            // Try different selectors for eBay images
-            const imageSelectors = [
-                '#icImg',
-                '#mainImgHldr img',
-                '.ux-image-carousel-item img',
-                '.ux-image-filmstrip-carousel-item img',
-                'img[src*="ebayimg.com"]',
-                '.img img',
-                '#PicturePanel img'
-            ];
-            
-            for (const selector of imageSelectors) {
-                const imgElements = doc.querySelectorAll(selector);
-                imgElements.forEach(img => {
-                    const src = img.getAttribute('data-src') || img.getAttribute('src');
-                    if (src && src.includes('ebayimg.com') && !images.includes(src)) {
-                        // Convert to high resolution if possible
-                        const highResSrc = src.replace(/s-l\d+/, 's-l1600');
-                        images.push(highResSrc);
-                    }
-                });
-                if (images.length >= 5) break;
-            }
-            
-            if (images.length > 0) {
-                return images.slice(0, 5);
-            }
-        }
-    } catch (e) {
-        console.log('Error fetching eBay images:', e);
-    }
-    return await fetchGenericProductImages('ebay.com');
-}
-
-async function fetchShopifyProductImages(url) {
-    try {
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        
-        if (data.contents) {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.contents, 'text/html');
-            
-            const images = [];
-            const imageSelectors = [
-                '.product__media img',
-                '.product-single__photo img',
-                '.product-photo-container img',
-                'img[src*="cdn.shopify.com"]',
-                '.product-image-main img',
-                '.featured-image img'
-            ];
-            
-            for (const selector of imageSelectors) {
-                const imgElements = doc.querySelectorAll(selector);
-                imgElements.forEach(img => {
-                    const src = img.getAttribute('data-src') || img.getAttribute('src');
-                    if (src && src.includes('shopify.com') && !images.includes(src)) {
-                        images.push(src);
-                    }
-                });
-                if (images.length >= 5) break;
-            }
-            
-            if (images.length > 0) {
-                return images.slice(0, 5);
-            }
-        }
-    } catch (e) {
-        console.log('Error fetching Shopify images:', e);
-    }
-    return await fetchGenericProductImages('shopify.com');
-}
-
-async function fetchAliExpressProductImages(url) {
-    try {
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        
-        if (data.contents) {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.contents, 'text/html');
-            
-            const images = [];
-            const imageSelectors = [
-                '.images-view-item img',
-                '.product-image img',
-                'img[src*="alicdn.com"]',
-                '.image-view img',
-                '.main-image img'
-            ];
-            
-            for (const selector of imageSelectors) {
-                const imgElements = doc.querySelectorAll(selector);
-                imgElements.forEach(img => {
-                    const src = img.getAttribute('data-src') || img.getAttribute('src');
-                    if (src && src.includes('alicdn.com') && !images.includes(src)) {
-                        images.push(src);
-                    }
-                });
-                if (images.length >= 5) break;
-            }
-            
-            if (images.length > 0) {
-                return images.slice(0, 5);
-            }
-        }
-    } catch (e) {
-        console.log('Error fetching AliExpress images:', e);
-    }
-    return await fetchGenericProductImages('aliexpress.com');
-}
-
-async function fetchNoonProductImages(url) {
-    try {
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        
-        if (data.contents) {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.contents, 'text/html');
-            
-            const images = [];
-            const imageSelectors = [
-                '.swiper-slide img',
-                '.product-image img',
-                'img[src*="noon.com"]',
-                'img[src*="nooncdn.com"]',
-                '.image-gallery img',
-                '.product-gallery img',
-                'img[alt*="product"]',
-                'img[class*="product"]'
-            ];
-            
-            // First try Open Graph image
-            const ogImage = doc.querySelector('meta[property="og:image"]');
-            if (ogImage) {
-                const content = ogImage.getAttribute('content');
-                if (content) images.push(content);
-            }
-            
-            for (const selector of imageSelectors) {
-                if (selector.includes('meta')) continue;
-                
-                const imgElements = doc.querySelectorAll(selector);
-                imgElements.forEach(img => {
-                    const src = img.getAttribute('data-src') || img.getAttribute('src');
-                    if (src && (src.includes('noon.com') || src.includes('nooncdn.com') || src.startsWith('http')) && !images.includes(src)) {
-                        images.push(src);
-                    }
-                });
-                if (images.length >= 5) break;
-            }
-            
-            if (images.length > 0) {
-                return images.slice(0, 5);
-            }
-        }
-    } catch (e) {
-        console.log('Error fetching Noon images:', e);
-    }
-    return await fetchGenericProductImages('noon.com');
-}
-
-async function fetchSallaProductImages(url) {
-    try {
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        const parser = new DOMParser();
-        const doc = parser.parseFromString(data.contents, 'text/html');
-        
-        const images = [];
-        
-        // Salla specific selectors
-        const selectors = [
-            '.product-gallery img',
-            '.product-images img',
-            '.gallery-item img',
-            '.product-image img',
-            '[data-src*="salla"]',
-            'img[src*="salla"]',
-            '.swiper-slide img',
-            '.product-slider img'
-        ];
-        
-        for (const selector of selectors) {
-            const imgElements = doc.querySelectorAll(selector);
-            imgElements.forEach(img => {
-                const src = img.getAttribute('data-src') || img.getAttribute('src');
-                if (src && (src.includes('salla') || src.startsWith('http')) && !images.includes(src)) {
-                    images.push(src);
-                }
-            });
-            if (images.length >= 5) break;
-        }
-        
-        if (images.length > 0) {
-            return images[0];
-        }
-        
-        return await fetchGenericProductImages('salla.sa');
-    } catch (error) {
-        console.error('Error fetching Salla product images:', error);
-        return await fetchGenericProductImages('salla.sa');
-    }
-}
-
-async function fetchZidProductImages(url) {
-    try {
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        const parser = new DOMParser();
-        const doc = parser.parseFromString(data.contents, 'text/html');
-        
-        const images = [];
-        
-        // Zid specific selectors
-        const selectors = [
-            '.product-gallery img',
-            '.product-images img',
-            '.gallery-item img',
-            '.product-image img',
-            '[data-src*="zid"]',
-            'img[src*="zid"]',
-            '.swiper-slide img',
-            '.product-slider img',
-            '.product-photos img'
-        ];
-        
-        for (const selector of selectors) {
-            const imgElements = doc.querySelectorAll(selector);
-            imgElements.forEach(img => {
-                const src = img.getAttribute('data-src') || img.getAttribute('src');
-                if (src && (src.includes('zid') || src.startsWith('http')) && !images.includes(src)) {
-                    images.push(src);
-                }
-            });
-            if (images.length >= 5) break;
-        }
-        
-        if (images.length > 0) {
-            return images[0];
+        const response = await fetch('/api/extract', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            credentials: 'include',
+            body: JSON.stringify({ url: url })
+        });
+        if (response.ok) {
+            return await response.json();
         }
-        
-        return await fetchGenericProductImages('zid.sa');
+        console.error('Server extraction failed:', response.status);
     } catch (error) {
-        console.error('Error fetching Zid product images:', error);
-        return await fetchGenericProductImages('zid.sa');
-    }
-}
-
-async function fetchGenericWebImages(url) {
-    try {
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        
-        if (data.contents) {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.contents, 'text/html');
-            
-            const images = [];
-            
-            // Generic selectors for product images
-            const imageSelectors = [
-                'meta[property="og:image"]',
-                '.product-image img',
-                '.product-photo img',
-                '.main-image img',
-                '.featured-image img',
-                'img[alt*="product"]',
-                'img[alt*="Product"]',
-                'img[class*="product"]',
-                'img[id*="product"]'
-            ];
-            
-            // First try Open Graph image
-            const ogImage = doc.querySelector('meta[property="og:image"]');
-            if (ogImage) {
-                const content = ogImage.getAttribute('content');
-                if (content) images.push(content);
-            }
-            
-            // Then try other selectors
-            for (const selector of imageSelectors) {
-                if (selector.includes('meta')) continue; // Skip meta tags
-                
-                const imgElements = doc.querySelectorAll(selector);
-                imgElements.forEach(img => {
-                    const src = img.getAttribute('data-src') || img.getAttribute('src');
-                    if (src && src.startsWith('http') && !images.includes(src)) {
-                        images.push(src);
-                    }
-                });
-                if (images.length >= 5) break;
-            }
-            
-            if (images.length > 0) {
-                return images.slice(0, 5);
-            }
-        }
-    } catch (e) {
-        console.log('Error fetching generic web images:', e);
+        console.error('Error extracting product on server:', error);
     }
-    
-    // Fallback to domain-specific generic images
-    const domain = extractDomainFromUrl(url);
-    return await fetchGenericProductImages(domain);
+    return {};
 }
 
 async function fetchGenericProductImages(domain) {
@@ -1229,271 +927,6 @@ async function fetchGenericProductImages(domain) {
     ];
 }
 
-// دوال استخراج السعر من المواقع المختلفة
-async function fetchEtsyProductPrice(url) {
-    try {
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        
-        if (data.contents) {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.contents, 'text/html');
-            
-            // محاولة العثور على السعر في Etsy
-            const priceSelectors = [
-                '.currency-value',
-                '.notranslate',
-                '[data-test-id="price"]',
-                '.shop2-review-review .currency-symbol + .currency-value',
-                '.listing-page-title + .wt-mb-xs-2 .currency-value'
-            ];
-            
-            for (const selector of priceSelectors) {
-                const priceElement = doc.querySelector(selector);
-                if (priceElement) {
-                    const priceText = priceElement.textContent.trim();
-                    const price = parseFloat(priceText.replace(/[^\d.]/g, ''));
-                    if (!isNaN(price) && price > 0) {
-                        return price;
-                    }
-                }
-            }
-        }
-    } catch (error) {
-        console.log('Error fetching Etsy price:', error);
-    }
-    return 0;
-}
-
-async function fetchEbayProductPrice(url) {
-    try {
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        
-        if (data.contents) {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.contents, 'text/html');
-            
-            // محاولة العثور على السعر في eBay
-            const priceSelectors = [
-                '.notranslate',
-                '.u-flL.condText',
-                '.ux-textspans.notranslate',
-                '[data-testid="x-price-primary"] .notranslate',
-                '.display-price .notranslate'
-            ];
-            
-            for (const selector of priceSelectors) {
-                const priceElement = doc.querySelector(selector);
-                if (priceElement) {
-                    const priceText = priceElement.textContent.trim();
-                    const price = parseFloat(priceText.replace(/[^\d.]/g, ''));
-                    if (!isNaN(price) && price > 0) {
-                        return price;
-                    }
-                }
-            }
-        }
-    } catch (error) {
-        console.log('Error fetching eBay price:', error);
-    }
-    return 0;
-}
-
-async function fetchAmazonProductPrice(url) {
-    try {
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        
-        if (data.contents) {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.contents, 'text/html');
-            
-            // محاولة العثور على السعر في Amazon
-            const priceSelectors = [
-                '.a-price-whole',
-                '.a-offscreen',
-                '#priceblock_dealprice',
-                '#priceblock_ourprice',
-                '.a-price.a-text-price.a-size-medium.apexPriceToPay .a-offscreen',
-                '.a-price-range .a-offscreen'
-            ];
-            
-            for (const selector of priceSelectors) {
-                const priceElement = doc.querySelector(selector);
-                if (priceElement) {
-                    const priceText = priceElement.textContent.trim();
-                    const price = parseFloat(priceText.replace(/[^\d.]/g, ''));
-                    if (!isNaN(price) && price > 0) {
-                        return price;
-                    }
-                }
-            }
-        }
-    } catch (error) {
-        console.log('Error fetching Amazon price:', error);
-    }
-    return 0;
-}
-
-async function fetchSallaProductPrice(url) {
-    try {
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        
-        if (data.contents) {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.contents, 'text/html');
-            
-            // محاولة العثور على السعر في Salla
-            const priceSelectors = [
-                '.product-price',
-                '.price',
-                '.s-product-card-price',
-                '[data-price]',
-                '.product-details .price',
-                '.product-info .price'
-            ];
-            
-            for (const selector of priceSelectors) {
-                const priceElement = doc.querySelector(selector);
-                if (priceElement) {
-                    const priceText = priceElement.textContent.trim();
-                    const price = parseFloat(priceText.replace(/[^\d.]/g, ''));
-                    if (!isNaN(price) && price > 0) {
-                        return price;
-                    }
-                }
-            }
-        }
-    } catch (error) {
-        console.log('Error fetching Salla price:', error);
-    }
-    return 0;
-}
-
-async function fetchZidProductPrice(url) {
-    try {
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        
-        if (data.contents) {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.contents, 'text/html');
-            
-            // محاولة العثور على السعر في Zid
-            const priceSelectors = [
-                '.product-price',
-                '.price',
-                '.product-details .price',
-                '[data-price]',
-                '.product-info .price',
-                '.price-current'
-            ];
-            
-            for (const selector of priceSelectors) {
-                const priceElement = doc.querySelector(selector);
-                if (priceElement) {
-                    const priceText = priceElement.textContent.trim();
-                    const price = parseFloat(priceText.replace(/[^\d.]/g, ''));
-                    if (!isNaN(price) && price > 0) {
-                        return price;
-                    }
-                }
-            }
-        }
-    } catch (error) {
-        console.log('Error fetching Zid price:', error);
-    }
-    return 0;
-}
-
-async function fetchNoonProductPrice(url) {
-    try {
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        
-        if (data.contents) {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.contents, 'text/html');
-            
-            // محاولة العثور على السعر في Noon
-            const priceSelectors = [
-                '.priceNow',
-                '.price',
-                '.product-price',
-                '[data-qa="pdp-price"]',
-                '.productPrice',
-                '.price-current'
-            ];
-            
-            for (const selector of priceSelectors) {
-                const priceElement = doc.querySelector(selector);
-                if (priceElement) {
-                    const priceText = priceElement.textContent.trim();
-                    const price = parseFloat(priceText.replace(/[^\d.]/g, ''));
-                    if (!isNaN(price) && price > 0) {
-                        return price;
-                    }
-                }
-            }
-        }
-    } catch (error) {
-        console.log('Error fetching Noon price:', error);
-    }
-    return 0;
-}
-
-async function fetchGenericProductPrice(url) {
-    try {
-        const proxyUrl = `https://api.allorigins.win/get?url=${encodeURIComponent(url)}`;
-        const response = await fetch(proxyUrl);
-        const data = await response.json();
-        
-        if (data.contents) {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.contents, 'text/html');
-            
-            // محاولة العثور على السعر باستخدام محددات عامة
-            const priceSelectors = [
-                '.price',
-                '.product-price',
-                '.cost',
-                '.amount',
-                '[class*="price"]',
-                '[id*="price"]',
-                '.currency',
-                '.money',
-                '.value'
-            ];
-            
-            for (const selector of priceSelectors) {
-                const priceElements = doc.querySelectorAll(selector);
-                for (const priceElement of priceElements) {
-                    const priceText = priceElement.textContent.trim();
-                    // البحث عن أرقام مع رموز العملة
-                    const priceMatch = priceText.match(/[\d,]+\.?\d*/g);
-                    if (priceMatch) {
-                        const price = parseFloat(priceMatch[0].replace(/,/g, ''));
-                        if (!isNaN(price) && price > 0) {
-                            return price;
-                        }
-                    }
-                }
-            }
-        }
-    } catch (error) {
-        console.log('Error fetching generic price:', error);
-    }
-    return 0;
-}
-
 function extractDomainFromUrl(url) {
     try {
         return new URL(url).hostname.replace('www.', '');
@@ -1888,33 +1321,82 @@ function displayProducts(productsToShow) {
     updateAllProductSeasonDropdowns();
 }
 
+// رابط نسخة مصغرة للصور المحفوظة على الخادم (thumb أو medium)، والروابط الخارجية كما هي
+function imageVariantUrl(product, src, size) {
+    if (!src || typeof src !== 'string') return src;
+    const derivative = product.derivatives && product.derivatives[src] && product.derivatives[src][size];
+    if (derivative) {
+        return '/' + derivative;
+    }
+    const localPath = src.replace(/^\//, '');
+    if (localPath.startsWith('saved_images/')) {
+        return `/thumbs/${size}/${localPath}`;
+    }
+    return src;
+}
+
+// قوائم المنتجات تحمل صورة الغلاف وعدد الصور فقط؛ القائمة الكاملة تُجلب عند الحاجة
+async function fetchProductImages(product) {
+    if (Array.isArray(product.images)) {
+        return product.images;
+    }
+    const response = await fetch(`/api/products/${product.id}/images`, {
+        credentials: 'include'
+    });
+    if (!response.ok) {
+        throw new Error(`Failed to load product images: ${response.status}`);
+    }
+    const data = await response.json();
+    product.images = (data.images || []).map(image => image.path);
+    return product.images;
+}
+
+function galleryThumbnailsHTML(product, images) {
+    return images.slice(0, 5).map((img, index) => 
+        `<img src="${imageVariantUrl(product, img, 'thumb')}" data-medium="${imageVariantUrl(product, img, 'medium')}" alt="صورة ${index + 1}" class="thumbnail" loading="lazy" onclick="changeMainImage(this, '${product.id}')" onerror="this.style.display='none'">`
+    ).join('');
+}
+
+async function loadProductGallery(card, product) {
+    try {
+        const images = await fetchProductImages(product);
+        const gallery = card.querySelector('.image-thumbnails');
+        if (gallery && images.length > 1) {
+            gallery.innerHTML = galleryThumbnailsHTML(product, images);
+        }
+    } catch (error) {
+        console.error('Error loading product gallery:', error);
+    }
+}
+
 function createProductCard(product) {
     console.log('Creating product card for:', product);
     const card = document.createElement('div');
     card.className = 'product-card';
     
     // Handle multiple images
-    const images = Array.isArray(product.image) ? product.image : [product.image];
-    const mainImage = images[0] || '/placeholder.svg';
+    const productImages = product.images || product.image || (product.cover_image ? [product.cover_image] : []);
+    const images = Array.isArray(productImages) ? productImages : [productImages];
+    const mainImage = imageVariantUrl(product, images[0], 'medium') || '/placeholder.svg';
     
     // Create image gallery HTML
     let imageGalleryHTML = '';
     if (images.length > 1) {
-        const thumbnailsHTML = images.slice(0, 5).map((img, index) => 
-            `<img src="${img}" alt="صورة ${index + 1}" class="thumbnail" onclick="changeMainImage(this, '${product.id}')" onerror="this.style.display='none'">`
-        ).join('');
-        
         imageGalleryHTML = `
             <div class="image-thumbnails">
-                ${thumbnailsHTML}
+                ${galleryThumbnailsHTML(product, images)}
             </div>
         `;
+    } else if (product.image_count > 1) {
+        // بقية الصور تُجلب عند أول مرور على البطاقة
+        imageGalleryHTML = '<div class="image-thumbnails"></div>';
+        card.addEventListener('mouseenter', () => loadProductGallery(card, product), { once: true });
     }
     
     card.innerHTML = `
         ${product.season ? `<div class="season-name-display">${product.season}</div>` : ''}
         <div class="product-image">
-            <img id="main-img-${product.id}" src="${mainImage}" alt="${product.name}" onerror="this.src='/placeholder.svg'">
+            <img id="main-img-${product.id}" src="${mainImage}" alt="${product.name}" loading="lazy" onerror="this.src='/placeholder.svg'">
             ${imageGalleryHTML}
             <div class="product-status-info">
                 <div class="status-badge ${product.status === 'approved' ? 'status-approved' : 'status-pending'}">
@@ -1948,6 +1430,10 @@ function createProductCard(product) {
                     <i class="fas fa-eye"></i>
                     عرض
                 </button>
+                <button class="btn-small btn-info" onclick="uploadProductImages('${product.id}')">
+                    <i class="fas fa-upload"></i>
+                    رفع صور
+                </button>
                 <button class="btn-small btn-danger" onclick="deleteProduct('${product.id}')" data-product-id="${product.id}">
                     <i class="fas fa-trash"></i>
                     حذف
@@ -1987,7 +1473,7 @@ function createProductCard(product) {
 function changeMainImage(thumbnailImg, productId) {
     const mainImg = document.getElementById(`main-img-${productId}`);
     if (mainImg && thumbnailImg.src) {
-        mainImg.src = thumbnailImg.src;
+        mainImg.src = thumbnailImg.dataset.medium || thumbnailImg.src;
         
         // Add visual feedback
         const thumbnails = thumbnailImg.parentElement.querySelectorAll('.thumbnail');
@@ -2072,6 +1558,52 @@ function getCurrencySymbol(currency) {
     }
 }
 
+// البحث النصي في الخادم: لا يحتاج تحميل كل المنتجات أولاً
+const SEARCH_DEBOUNCE_MS = 300;
+const SEARCH_RESULTS_LIMIT = 200;
+// نتائج البحث الحالي مرتبة بالأقرب، أو null إذا لم يكن هناك بحث
+let productSearchResults = null;
+let productSearchGeneration = 0;
+let productSearchTimer = null;
+
+async function searchProducts(query) {
+    const generation = ++productSearchGeneration;
+    query = query.trim();
+    if (!query) {
+        productSearchResults = null;
+        refreshProductsView();
+        return;
+    }
+    try {
+        const params = new URLSearchParams({ q: query, limit: SEARCH_RESULTS_LIMIT });
+        const response = await fetch(`/api/products/search?${params}`, { credentials: 'include' });
+        if (!response.ok) {
+            throw new Error(`Search failed: ${response.status}`);
+        }
+        const data = await response.json();
+        // نتيجة بحث أقدم وصلت بعد بحث أحدث
+        if (generation !== productSearchGeneration) {
+            return;
+        }
+        productSearchResults = data.products;
+        refreshProductsView();
+    } catch (error) {
+        console.error(error.message);
+        showMessage('فشل في البحث عن المنتجات', 'error');
+    }
+}
+
+function setupProductSearch() {
+    const input = document.getElementById('product-search-input');
+    if (!input) {
+        return;
+    }
+    input.addEventListener('input', () => {
+        clearTimeout(productSearchTimer);
+        productSearchTimer = setTimeout(() => searchProducts(input.value), SEARCH_DEBOUNCE_MS);
+    });
+}
+
 function filterProducts(filter) {
     const filterTabs = document.querySelectorAll('.filter-tab');
     filterTabs.forEach(btn => btn.classList.remove('active'));
@@ -2082,15 +1614,22 @@ function filterProducts(filter) {
         activeTab.classList.add('active');
     }
     
+    // أثناء البحث تُصفى نتائج الخادم بدلاً من كل المنتجات، بحالتها المحلية الأحدث
+    let source = products;
+    if (productSearchResults) {
+        const localProducts = new Map(products.map(p => [p.id, p]));
+        source = productSearchResults.map(result => localProducts.get(result.id) || result);
+    }
+    
     let filteredProducts;
     if (filter === 'approved') {
-        filteredProducts = products.filter(p => p.status === 'approved');
+        filteredProducts = source.filter(p => p.status === 'approved');
     } else if (filter === 'disapproved') {
-        filteredProducts = products.filter(p => p.status === 'disapproved' || p.status === 'rejected');
+        filteredProducts = source.filter(p => p.status === 'disapproved' || p.status === 'rejected');
     } else if (filter === 'pending') {
-        filteredProducts = products.filter(p => p.status === 'pending' || !p.status);
+        filteredProducts = source.filter(p => p.status === 'pending' || !p.status);
     } else {
-        filteredProducts = products;
+        filteredProducts = source;
     }
     
     displayProducts(filteredProducts);
@@ -2116,16 +1655,79 @@ function downloadImages(localPath, productId = null) {
     showMessage('سيتم حفظ الصور محلياً', 'info');
 }
 
+// تحميل ملف من الخادم عبر رابط مؤقت (يبث المتصفح الملف إلى القرص مباشرة)
+function triggerDownload(url) {
+    const link = document.createElement('a');
+    link.href = url;
+    link.download = '';
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
+}
+
+// رفع صور من الجهاز إلى منتج محفوظ؛ الخادم يكتبها في المخزن أثناء استقبالها
+function uploadProductImages(productId) {
+    const input = document.createElement('input');
+    input.type = 'file';
+    input.accept = 'image/*';
+    input.multiple = true;
+    input.addEventListener('change', async () => {
+        const files = Array.from(input.files || []);
+        if (files.length === 0) return;
+        
+        const formData = new FormData();
+        files.forEach(file => formData.append('images', file));
+        showMessage(`جاري رفع ${files.length} صورة...`, 'info');
+        try {
+            const response = await fetch(`/api/products/${productId}/images`, {
+                method: 'POST',
+                body: formData,
+                credentials: 'include'
+            });
+            const data = await response.json();
+            if (!response.ok) {
+                showMessage(data.error || 'فشل في رفع الصور', 'error');
+                return;
+            }
+            showMessage(`تم رفع ${data.saved_count} صورة بنجاح`, 'success');
+            await loadUserData();
+        } catch (error) {
+            console.error('Error uploading images:', error);
+            showMessage('خطأ في رفع الصور', 'error');
+        }
+    });
+    input.click();
+}
+
+function hasSavedImages(images) {
+    return images.some(img => typeof img === 'string' && img.replace(/^\//, '').startsWith('saved_images/'));
+}
+
 // وظيفة جديدة لتحميل صور المنتج مباشرة
 async function downloadProductImages(product) {
     console.log('Downloading images for product:', product);
     
-    if (!product.image) {
+    if (product.id && !product.images && product.image_count > 0) {
+        try {
+            await fetchProductImages(product);
+        } catch (error) {
+            console.error('Error loading product images:', error);
+        }
+    }
+    const productImages = product.images || product.image || (product.cover_image ? [product.cover_image] : null);
+    if (!productImages) {
         showMessage('لا توجد صور للتحميل', 'error');
         return;
     }
     
-    const images = Array.isArray(product.image) ? product.image : [product.image];
+    const images = Array.isArray(productImages) ? productImages : [productImages];
+    
+    // الصور المحفوظة على الخادم تُضغط وتُبث منه مباشرة
+    if (product.id && hasSavedImages(images)) {
+        triggerDownload(`/api/products/${product.id}/images.zip`);
+        showMessage(`جاري تحميل ملف مضغوط يحتوي على صور ${product.name}`, 'info');
+        return;
+    }
     
     showMessage(`جاري إنشاء ملف مضغوط يحتوي على ${images.length} صورة...`, 'info');
     
@@ -2186,6 +1788,31 @@ async function downloadProductImages(product) {
 
 
 
+const JOB_POLL_INTERVAL_MS = 1000;
+// مع بث الأحداث يُطلب وضع المهمة عند كل حدث، والطلب الدوري احتياطي فقط
+const JOB_EVENTS_POLL_INTERVAL_MS = 10000;
+
+// متابعة مهمة في الخادم حتى تنتهي، مع عرض تقدم تحميل الصور
+async function waitForJob(statusUrl, jobId) {
+    let lastDone = -1;
+    while (true) {
+        const response = await fetch(statusUrl, { credentials: 'include' });
+        if (!response.ok) {
+            throw new Error(`فشل في متابعة المهمة: ${response.status}`);
+        }
+        const job = await response.json();
+        if (job.status === 'done' || job.status === 'failed') {
+            return job.result || { success: false, error: job.error };
+        }
+        if (job.done_count !== lastDone && job.done_count > 0) {
+            lastDone = job.done_count;
+            showMessage(`جاري حفظ الصور: ${job.done_count} من ${job.total_count}`, 'info');
+        }
+        const connected = eventSource && eventSource.readyState === EventSource.OPEN;
+        await waitForJobEvent(jobId, connected ? JOB_EVENTS_POLL_INTERVAL_MS : JOB_POLL_INTERVAL_MS);
+    }
+}
+
 async function saveImagesLocally(product, imageUrls) {
     try {
         showMessage('بدء حفظ الصور محلياً...', 'info');
@@ -2205,7 +1832,11 @@ async function saveImagesLocally(product, imageUrls) {
         });
         
         if (response.ok) {
-            const result = await response.json();
+            const job = await response.json();
+            const result = await waitForJob(job.status_url || `/api/jobs/${job.job_id}`, job.job_id);
+            if (!result || !result.success) {
+                throw new Error((result && result.error) || 'فشل في تحميل الصور');
+            }
             
             // تحديث معلومات الحفظ المحلي في المنتج
             product.localSave = {
@@ -2245,11 +1876,68 @@ function downloadAllApprovedImages() {
     if (confirmDownload) {
         showMessage(`بدء تحميل صور ${approvedProducts.length} منتج معتمد...`, 'info');
         
-        approvedProducts.forEach((product, index) => {
-            setTimeout(() => {
-                downloadProductImages(product);
-            }, index * 1000); // تأخير ثانية واحدة بين كل منتج
-        });
+        // ملف مضغوط واحد يبنيه الخادم من الصور المحفوظة لكل المنتجات المعتمدة
+        triggerDownload('/api/products/images.zip?status=approved');
+    }
+}
+
+const PRODUCT_BATCH_DELAY_MS = 100;
+const PRODUCT_BATCH_MAX_IDS = 500;
+const pendingProductUpdates = new Map();
+
+// تحديث نفس الحقول لعدة منتجات بطلب واحد
+async function updateProductsBatch(ids, changes) {
+    const response = await fetch('/api/products/batch', {
+        method: 'PATCH',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        credentials: 'include',
+        body: JSON.stringify({ ids, ...changes })
+    });
+    const data = await response.json();
+    if (!response.ok) {
+        return { ok: false, error: data.error, updatedIds: [] };
+    }
+    return { ok: true, updatedIds: data.updated_ids };
+}
+
+// تجميع التحديثات المتشابهة القريبة زمنياً (مثل قبول عدة منتجات متتالية) في طلب واحد
+// تعيد { ok, error } لهذا المنتج، وترفض فقط عند فشل الاتصال
+function queueProductUpdate(productId, changes) {
+    const key = JSON.stringify(changes);
+    let batch = pendingProductUpdates.get(key);
+    if (!batch) {
+        batch = { changes, waiters: new Map() };
+        pendingProductUpdates.set(key, batch);
+        setTimeout(() => flushProductUpdates(key), PRODUCT_BATCH_DELAY_MS);
+    }
+    const id = parseInt(productId);
+    return new Promise((resolve, reject) => {
+        const waiters = batch.waiters.get(id) || [];
+        waiters.push({ resolve, reject });
+        batch.waiters.set(id, waiters);
+        if (batch.waiters.size >= PRODUCT_BATCH_MAX_IDS) {
+            flushProductUpdates(key);
+        }
+    });
+}
+
+async function flushProductUpdates(key) {
+    const batch = pendingProductUpdates.get(key);
+    if (!batch) return;
+    pendingProductUpdates.delete(key);
+    
+    const ids = [...batch.waiters.keys()];
+    const settle = (callback) => batch.waiters.forEach((waiters, id) => waiters.forEach(w => callback(w, id)));
+    try {
+        const result = await updateProductsBatch(ids, batch.changes);
+        const updated = new Set(result.updatedIds);
+        settle((w, id) => w.resolve(updated.has(id)
+            ? { ok: true }
+            : { ok: false, error: result.error || 'المنتج غير موجود أو غير مسموح بتعديله' }));
+    } catch (error) {
+        settle(w => w.reject(error));
     }
 }
 
@@ -2286,22 +1974,10 @@ async function toggleApproval(productId) {
     console.log('Changing status from', product.status, 'to', newStatus);
     
     try {
-        // تحديث المنتج في قاعدة البيانات
-        const response = await fetch(`/api/products/${productId}`, {
-            method: 'PUT',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            credentials: 'include',
-            body: JSON.stringify({
-                status: newStatus
-            })
-        });
+        // تحديث المنتج في قاعدة البيانات (يُجمع مع التحديثات المماثلة في طلب واحد)
+        const result = await queueProductUpdate(productId, { status: newStatus });
         
-        if (response.ok) {
-            const data = await response.json();
-            console.log('Server response:', data);
-            
+        if (result.ok) {
             // تحديث البيانات المحلية
             product.status = newStatus;
             saveProducts(); // حفظ احتياطي في localStorage
@@ -2319,9 +1995,8 @@ async function toggleApproval(productId) {
             
             showMessage(`تم ${newStatus === 'approved' ? 'قبول' : 'إلغاء قبول'} المنتج بنجاح`, 'success');
         } else {
-            const errorData = await response.json();
-            console.error('Server error:', errorData);
-            showMessage(errorData.error || 'خطأ في تحديث حالة المنتج', 'error');
+            console.error('Server error:', result.error);
+            showMessage(result.error || 'خطأ في تحديث حالة المنتج', 'error');
         }
     } catch (error) {
         console.error('Error updating product status:', error);
@@ -2365,22 +2040,10 @@ async function rejectProduct(productId) {
     console.log('Changing status from', product.status, 'to', newStatus);
     
     try {
-        // تحديث المنتج في قاعدة البيانات
-        const response = await fetch(`/api/products/${productId}`, {
-            method: 'PUT',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            credentials: 'include',
-            body: JSON.stringify({
-                status: newStatus
-            })
-        });
+        // تحديث المنتج في قاعدة البيانات (يُجمع مع التحديثات المماثلة في طلب واحد)
+        const result = await queueProductUpdate(productId, { status: newStatus });
         
-        if (response.ok) {
-            const data = await response.json();
-            console.log('Server response:', data);
-            
+        if (result.ok) {
             // تحديث البيانات المحلية
             product.status = newStatus;
             saveProducts();
@@ -2396,9 +2059,8 @@ async function rejectProduct(productId) {
             
             showMessage('تم رفض المنتج بنجاح', 'success');
         } else {
-            const errorData = await response.json();
-            console.error('Server error:', errorData);
-            showMessage(errorData.error || 'خطأ في رفض المنتج', 'error');
+            console.error('Server error:', result.error);
+            showMessage(result.error || 'خطأ في رفض المنتج', 'error');
         }
     } catch (error) {
         console.error('Error rejecting product:', error);
@@ -2440,21 +2102,10 @@ async function assignProductToSeason(productId, seasonName) {
     const product = products.find(p => p.id === productId);
     if (product) {
         try {
-            // تحديث المنتج في قاعدة البيانات
-            const response = await fetch(`/api/products/${productId}`, {
-                method: 'PUT',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                credentials: 'include',
-                body: JSON.stringify({
-                    season: seasonName
-                })
-            });
+            // تحديث المنتج في قاعدة البيانات (يُجمع مع التحديثات المماثلة في طلب واحد)
+            const result = await queueProductUpdate(productId, { season: seasonName });
             
-            const data = await response.json();
-            
-            if (response.ok) {
+            if (result.ok) {
                 // Remove from previous season if exists
                 if (product.season) {
                     const oldSeasonProducts = seasons[product.season];
@@ -2490,7 +2141,7 @@ async function assignProductToSeason(productId, seasonName) {
                 
                 showMessage(`تم تعيين المنتج للمناسبة: ${seasonName || 'بدون مناسبة'}`, 'success');
             } else {
-                showMessage(data.error || 'خطأ في تحديث المنتج', 'error');
+                showMessage(result.error || 'خطأ في تحديث المنتج', 'error');
             }
         } catch (error) {
             console.error('Error updating product season:', error);
@@ -2511,8 +2162,8 @@ async function loadSeasons() {
             
             // Update seasons object with data from server
             const serverSeasons = {};
-            data.seasons.forEach(seasonName => {
-                serverSeasons[seasonName] = seasons[seasonName] || [];
+            data.seasons.forEach(season => {
+                serverSeasons[season.name] = seasons[season.name] || [];
             });
             
             seasons = serverSeasons;
@@ -2522,11 +2173,36 @@ async function loadSeasons() {
         console.error('Error loading seasons:', error);
     }
     
+    await loadSeasonStats();
     updateSeasonSelect();
     displaySeasonsList();
     displaySeasonalProducts();
 }
 
+async function loadSeasonStats() {
+    try {
+        const response = await fetch('/api/seasons/stats', {
+            credentials: 'include'
+        });
+        if (response.ok) {
+            const data = await response.json();
+            seasonStats = {};
+            data.seasons.forEach(season => {
+                seasonStats[season.season || ''] = season;
+            });
+        }
+    } catch (error) {
+        console.error('Error loading season stats:', error);
+    }
+}
+
+function formatImageBytes(bytes) {
+    if (bytes >= 1024 * 1024) {
+        return `${(bytes / (1024 * 1024)).toFixed(1)} ميجابايت`;
+    }
+    return `${Math.ceil(bytes / 1024)} كيلوبايت`;
+}
+
 function updateSeasonSelect() {
     if (!seasonSelect) return;
     
@@ -2580,11 +2256,16 @@ function displaySeasonsList() {
         const seasonItem = document.createElement('div');
         seasonItem.className = 'season-item';
         
-        const productCount = seasons[seasonName].length;
+        // العدد من إحصاءات الخادم إن وُجدت، وإلا من المنتجات المحملة
+        const stats = seasonStats ? seasonStats[seasonName] : null;
+        const productCount = seasonStats ? (stats ? stats.product_count : 0) : seasons[seasonName].length;
+        const statusDetails = stats
+            ? Object.entries(stats.statuses).map(([status, count]) => `${status}: ${count}`).join('، ')
+            : '';
         
         seasonItem.innerHTML = `
             <div class="season-name">${seasonName}</div>
-            <div class="season-count">(${productCount} منتج)</div>
+            <div class="season-count" title="${statusDetails}">(${productCount} منتج${stats && stats.image_bytes ? ` - ${formatImageBytes(stats.image_bytes)}` : ''})</div>
             <div class="season-actions">
                 <button class="btn-edit" onclick="editSeason('${seasonName}')">
                     <i class="fas fa-edit"></i> تعديل
@@ -0,0 +1,145 @@
+"""تطبيع النص العربي وبناء استعلامات البحث النصي ومقتطفات النتائج
+
+الفهرس (FTS5 في SQLite و tsvector في PostgreSQL) يُبنى من النص بعد تطبيعه
+هنا، ويُطبع نص البحث بالطريقة نفسها، فتتطابق الكلمات مهما اختلف تشكيلها
+أو شكل الهمزة والتاء المربوطة والألف المقصورة فيها. الكلمة التي تبدأ بأداة
+التعريف أو حرف متصل (ال، لل، بال، وال، و، ب، ل، ك) تُفهرس بشكلها وبجذعها
+بدونها، وكلمة البحث تطابق أياً من شكليها، فيجد "المنتج" كلمة "للمنتج" ويجد
+"منتج" كلمة "والمنتج". المقتطفات تُبنى من النص الأصلي للمنتج فيظهر كما كُتب.
+"""
+import html
+import re
+
+# التشكيل وعلامات القرآن والتطويل تُحذف لأن محلل SQLite يفصل الكلمة عندها
+_ARABIC_MARKS = [chr(code) for code in range(0x0610, 0x061B)] + \
+    [chr(code) for code in range(0x064B, 0x0660)] + ['ٰ', 'ـ']
+
+_ARABIC_TRANSLATION = str.maketrans({
+    **{mark: None for mark in _ARABIC_MARKS},
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+    # الأرقام العربية الهندية والفارسية
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)},
+})
+
+# \w لا يشمل علامات التشكيل، فتُضاف حتى لا تنقسم الكلمة المشكولة
+WORD_RE = re.compile(r'[\w\u0610-\u061a\u064b-\u065f\u0670]+')
+# أداة التعريف والحروف المتصلة بأول الكلمة (الأطول أولاً) مع أقل طول يبقى بعد حذفها
+_ARTICLE_PREFIXES = ('وبال', 'وكال', 'فال', 'وال', 'بال', 'كال', 'ولل', 'لل', 'ال')
+_LETTER_PREFIXES = ('و', 'ب', 'ل', 'ك')
+MIN_STEM_AFTER_ARTICLE = 2
+MIN_STEM_AFTER_LETTER = 3
+# كلمات البحث الزائدة عن هذا تُهمل
+MAX_QUERY_TERMS = 10
+# عدد الكلمات حول أول تطابق في مقتطف الوصف
+SNIPPET_WORDS = 12
+
+
+def _fold(text):
+    """توحيد الحروف وحذف التشكيل"""
+    return text.translate(_ARABIC_TRANSLATION).casefold()
+
+
+def strip_clitics(word):
+    """الكلمة الموحدة بدون أداة التعريف أو الحرف المتصل بأولها (للمنتج ← منتج)
+
+    الحرف المفرد لا يُحذف إذا قصرت الكلمة بعده أو بدأت بـ"ال" (والد، بالغ).
+    """
+    for prefix in _ARTICLE_PREFIXES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= MIN_STEM_AFTER_ARTICLE:
+            return word[len(prefix):]
+    for prefix in _LETTER_PREFIXES:
+        stem = word[len(prefix):]
+        if word.startswith(prefix) and len(stem) >= MIN_STEM_AFTER_LETTER and not stem.startswith('ال'):
+            return stem
+    return word
+
+
+def word_forms(word):
+    """شكلا الكلمة الموحدة: كما هي وبدون السوابق (شكل واحد إذا لم تكن لها سابقة)"""
+    stem = strip_clitics(word)
+    return (word,) if stem == word else (word, stem)
+
+
+def normalize_arabic(text):
+    """نص موحد للفهرسة: كل كلمة لها سابقة تتبعها نسختها بدونها"""
+    if not text:
+        return ''
+    return WORD_RE.sub(lambda match: ' '.join(word_forms(match.group())), _fold(text))
+
+
+def query_terms(query):
+    """كلمات البحث بعد التطبيع (بدون تكرار)، كل كلمة بأشكالها من word_forms"""
+    words = list(dict.fromkeys(WORD_RE.findall(_fold(query or ''))))
+    return [word_forms(word) for word in words[:MAX_QUERY_TERMS]]
+
+
+def fts5_query(terms):
+    """استعلام MATCH في FTS5: كل الكلمات مطلوبة بأي من أشكالها، وآخر كل شكل بادئة"""
+    groups = (' OR '.join(f'"{form}"*' for form in forms) for forms in terms)
+    return ' AND '.join(group if len(forms) == 1 else f'({group})' for group, forms in zip(groups, terms))
+
+
+def tsquery(terms):
+    """استعلام to_tsquery في PostgreSQL بنفس المعنى"""
+    groups = (' | '.join(f"{form}:*" for form in forms) for forms in terms)
+    return ' & '.join(group if len(forms) == 1 else f'({group})' for group, forms in zip(groups, terms))
+
+
+def _matches(word, terms):
+    return any(form.startswith(term) for form in word_forms(_fold(word)) for forms in terms for term in forms)
+
+
+def highlight(text, terms, max_words=None):
+    """النص الأصلي (HTML آمن) مع <mark> حول الكلمات المطابقة
+
+    مع max_words يُقتطع جزء حول أول تطابق فقط.
+    """
+    if not text:
+        return ''
+    words = list(WORD_RE.finditer(text))
+    start, end = 0, len(text)
+    if max_words and len(words) > max_words:
+        first = next((i for i, word in enumerate(words) if _matches(word.group(), terms)), 0)
+        begin = max(0, min(first - max_words // 3, len(words) - max_words))
+        last = begin + max_words - 1
+        start = words[begin].start() if begin else 0
+        end = words[last].end() if last < len(words) - 1 else len(text)
+        words = words[begin:last + 1]
+
+    parts = ['…'] if start > 0 else []
+    position = start
+    for word in words:
+        if _matches(word.group(), terms):
+            parts.append(html.escape(text[position:word.start()]))
+            parts.append(f"<mark>{html.escape(word.group())}</mark>")
+            position = word.end()
+    parts.append(html.escape(text[position:end]))
+    if end < len(text):
+        parts.append('…')
+    return ''.join(parts)
+
+
+def write_search_index(cursor, use_postgres, rows):
+    """تحديث فهرس البحث لصفوف منتجات (id, name, description) ضمن المعاملة الحالية"""
+    rows = [(normalize_arabic(row['name']), normalize_arabic(row['description']), row['id']) for row in rows]
+    if not rows:
+        return
+    if use_postgres:
+        # الاسم بوزن أعلى من الوصف في الترتيب
+        cursor.executemany(
+            """UPDATE products SET search_vector =
+                   setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B')
+               WHERE id = %s""",
+            rows
+        )
+    else:
+        cursor.executemany("DELETE FROM products_fts WHERE rowid = ?", [(row[2],) for row in rows])
+        cursor.executemany("INSERT INTO products_fts (name, description, rowid) VALUES (?, ?, ?)", rows)
+
+
+def backfill_search_index(cursor, use_postgres):
+    """خطوة ترحيل: فهرسة المنتجات الموجودة"""
+    cursor.execute("SELECT id, name, description FROM products")
+    write_search_index(cursor, use_postgres, cursor.fetchall())
@@ -0,0 +1,81 @@
+"""ملخص المنتجات لكل (مستخدم، رقم موسم، حالة) في جدول season_stats
+
+كل كتابة على المنتجات في database_cloud.py تأخذ لقطة من مجاميع الصفوف التي
+تغيرها قبل الكتابة وبعدها، وتضيف الفرق إلى الجدول في المعاملة نفسها، فتُقرأ
+الإحصاءات بصفوف قليلة مهما كبر عدد المنتجات. المنتج بلا موسم يُسجل برقم
+الموسم 0. حجم الصور هو مجموع أحجام صور المنتجات المحفوظة في المخزن.
+
+الاستخدام من سطر الأوامر:
+    python season_stats.py rebuild [USER_ID]   # إعادة حساب الملخص من المنتجات
+"""
+import sys
+
+# مجاميع المنتجات المطابقة لشرط على الجدول p، مجمعة حسب المستخدم والموسم والحالة
+_STATS_QUERY = """
+    SELECT user_id, season_id, status, COUNT(*) AS product_count, COALESCE(SUM(image_bytes), 0) AS image_bytes
+    FROM (
+        SELECT p.user_id, COALESCE(p.season_id, 0) AS season_id, COALESCE(p.status, '') AS status,
+               (SELECT SUM(i.size) FROM product_images i WHERE i.product_id = p.id) AS image_bytes
+        FROM products p WHERE {condition}
+    ) s
+    GROUP BY user_id, season_id, status
+"""
+
+
+def collect_stats(cursor, condition, params):
+    """{(المستخدم، الموسم، الحالة): (عدد المنتجات، حجم الصور)} للمنتجات المطابقة"""
+    cursor.execute(_STATS_QUERY.format(condition=condition), params)
+    return {
+        (row['user_id'], row['season_id'], row['status']): (row['product_count'], int(row['image_bytes']))
+        for row in cursor.fetchall()
+    }
+
+
+def apply_stats_delta(cursor, use_postgres, before, after):
+    """إضافة الفرق بين لقطتين من collect_stats إلى season_stats ضمن المعاملة الحالية"""
+    deltas = []
+    for key in set(before) | set(after):
+        old_count, old_bytes = before.get(key, (0, 0))
+        new_count, new_bytes = after.get(key, (0, 0))
+        if (old_count, old_bytes) != (new_count, new_bytes):
+            deltas.append(key + (new_count - old_count, new_bytes - old_bytes))
+    if not deltas:
+        return
+    ph = '%s' if use_postgres else '?'
+    cursor.executemany(
+        f"""INSERT INTO season_stats (user_id, season_id, status, product_count, image_bytes)
+            VALUES ({ph}, {ph}, {ph}, {ph}, {ph})
+            ON CONFLICT (user_id, season_id, status) DO UPDATE SET
+                product_count = season_stats.product_count + excluded.product_count,
+                image_bytes = season_stats.image_bytes + excluded.image_bytes""",
+        deltas
+    )
+    cursor.executemany(
+        f"DELETE FROM season_stats WHERE user_id = {ph} AND season_id = {ph} AND status = {ph} AND product_count <= 0",
+        [delta[:3] for delta in deltas]
+    )
+
+
+def rebuild_season_stats(cursor, use_postgres, user_id=None):
+    """إعادة حساب الملخص كاملاً من المنتجات (لمستخدم واحد أو للجميع)؛ خطوة ترحيل أيضاً"""
+    ph = '%s' if use_postgres else '?'
+    condition, params = (f"p.user_id = {ph}", (user_id,)) if user_id is not None else ("1 = 1", ())
+    if user_id is not None:
+        cursor.execute(f"DELETE FROM season_stats WHERE user_id = {ph}", params)
+    else:
+        cursor.execute("DELETE FROM season_stats")
+    cursor.execute(
+        f"""INSERT INTO season_stats (user_id, season_id, status, product_count, image_bytes)
+            {_STATS_QUERY.format(condition=condition)}""",
+        params
+    )
+
+
+if __name__ == '__main__':
+    from database_cloud import Database
+
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print(__doc__)
+        sys.exit(1)
+    user_id = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    print(f"Rebuilt season stats for {Database().rebuild_season_stats(user_id)} season/status groups")
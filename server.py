@@ -1,15 +1,32 @@
-from flask import Flask, request, jsonify, send_from_directory, session
+from flask import Flask, Response, g, request, jsonify, send_from_directory, session, stream_with_context
 from flask_cors import CORS
+from werkzeug.http import parse_options_header
 import sys
 import os
-import requests
-import uuid
-from urllib.parse import urlparse
-from database_cloud import Database
+import json
+import re
+import hmac
+import time
+from urllib.parse import quote
+from cache import TTLCache
+from database_cloud import Database, IMPORT_FIELDS
+from migrations import pending_migrations
+from image_downloader import downloader
+from http_cache import HttpCache
+from jobs import JobQueue
+from events import EventBroker, TooManyConnections, event_stream, SSE_RETRY_MS
+from image_store import HASH_RE, ImageStore, UnsupportedImageType
+from thumbnails import DERIVATIVE_SIZES, ThumbnailPipeline
+from product_extractor import extractor
+from zip_stream import stream_zip
+from uploads import MAX_UPLOAD_REQUEST_SIZE, UploadTooLarge, save_uploads
+from static_assets import StaticAssets, send_immutable, send_revalidated, SAVED_IMAGE_MAX_AGE
 from functools import wraps
+import metrics
 
 app = Flask(__name__)
-app.secret_key = 'your-secret-key-change-this-in-production'  # غير هذا في الإنتاج
+# يجب أن يكون نفسه في كل العمال والخوادم لتبقى الجلسات صالحة
+app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this-in-production')  # غير هذا في الإنتاج
 CORS(app, supports_credentials=True)  # للسماح بطلبات من المتصفح مع الكوكيز
 
 # إنشاء قاعدة البيانات
@@ -20,9 +37,150 @@ UPLOADS_DIR = 'saved_images'
 if not os.path.exists(UPLOADS_DIR):
     os.makedirs(UPLOADS_DIR)
 
+# مخزن الصور المعنون بالمحتوى (ملف واحد لكل محتوى مهما تكرر)
+image_store = ImageStore(db, UPLOADS_DIR)
+# الصور الخارجية المحملة سابقاً تُستخدم من المخزن بعد تحقق شرطي من موقعها
+http_cache = HttpCache(image_store)
+
+# توليد الصور المصغرة في الخلفية بعد حفظ الصور
+thumbnails = ThumbnailPipeline(db, UPLOADS_DIR)
+
+# بث الأحداث للمتصفح (تقدم المهام وتغيرات المنتجات والمواسم)
+broker = EventBroker(db)
+
+# طابور المهام الطويلة (تحميل الصور) في قاعدة البيانات
+jobs = JobQueue(db, on_event=broker.notify)
+
+# الملفات النصية (html/js/css) مع نسخها المضغوطة، تُبنى مرة واحدة عند التشغيل
+static_assets = StaticAssets(os.path.dirname(os.path.abspath(__file__)))
+
+# ردود القراءة المسلسلة لكل مستخدم، مفهرسة برقم إصدار بياناته فلا تحتاج إبطالاً
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+response_cache = TTLCache(max_entries=RESPONSE_CACHE_SIZE)
+
+# الحد الأقصى لحجم صفحة المنتجات
+MAX_PRODUCTS_PAGE_SIZE = 500
+
+# البحث النصي: حجم الصفحة الافتراضي وأقصى طول لنص البحث
+SEARCH_PAGE_SIZE = 50
+MAX_SEARCH_QUERY_LENGTH = 200
+
+# الحد الأقصى لعدد الروابط في طلب استخراج واحد
+MAX_EXTRACT_URLS = 20
+
+# التحديث الجماعي: الحقول المسموحة وأقصى عدد منتجات في الطلب
+BATCH_UPDATE_FIELDS = ['status', 'season', 'price']
+MAX_BATCH_IDS = 500
+
+# إعدادات الاستيراد الجماعي
+IMPORT_BATCH_SIZE = 500
+MAX_IMPORT_ERRORS = 1000
+
 # وظائف البريد الإلكتروني
 # تم إزالة دوال البريد الإلكتروني لأنها لم تعد مطلوبة
 
+def cached_user_response(build):
+    """رد JSON لبيانات المستخدم مع ETag من رقم إصدارها، و 304 إذا لم تتغير
+
+    build() تُستدعى فقط إذا لم يكن الرد في الذاكرة المؤقتة لنفس الإصدار.
+    """
+    user_id = session['user_id']
+    version = db.get_user_version(user_id)
+    etag = f"u{user_id}-v{version}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        key = (request.path, user_id, version, request.query_string)
+        body = response_cache.get(key)
+        if body is None:
+            body = app.json.dumps(build()).encode('utf-8')
+            response_cache.set(key, body)
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # موضع المزامنة: يبدأ منه العميل طلب /api/products/changes بعد التحميل الكامل
+    response.headers['X-Sync-Cursor'] = str(version)
+    # يُعاد التحقق في كل مرة لأن البيانات تتغير مع كل كتابة
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+# رمز اختياري لحماية /metrics (Authorization: Bearer <الرمز>)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.http_requests_in_flight.inc()
+    metrics.registry.start()
+
+def record_request(status):
+    # قالب المسار وليس الرابط الفعلي حتى لا تتضخم التسميات
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.http_request_duration.observe(
+        time.perf_counter() - g.pop('request_started'),
+        method=request.method, route=route, status=status
+    )
+
+@app.after_request
+def record_request_metrics(response):
+    # للردود المبثوثة (SSE و ZIP) يُقاس الزمن حتى بدء الرد
+    if 'request_started' in g:
+        record_request(response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if 'request_started' in g:
+        # استثناء لم يصل إلى after_request
+        record_request(500)
+    metrics.http_requests_in_flight.dec()
+
+@app.route('/healthz')
+def healthz():
+    """العملية تعمل (liveness)"""
+    return jsonify({'status': 'ok'}), 200
+
+@app.route('/readyz')
+def readyz():
+    """جاهزية العامل لاستقبال الطلبات: قاعدة البيانات متاحة والمخطط محدث والعمال يعملون"""
+    checks = {}
+    try:
+        pending = pending_migrations(db)
+        checks['database'] = 'ok'
+        checks['migrations'] = 'ok' if not pending else f"pending: {', '.join(pending)}"
+    except Exception as e:
+        checks['database'] = f"error: {e}"
+    checks['jobs'] = 'ok' if jobs.healthy() else 'stopped'
+    ready = all(value == 'ok' for value in checks.values())
+    response = jsonify({'ready': ready, 'checks': checks, 'pid': os.getpid()})
+    response.cache_control.no_store = True
+    return response, 200 if ready else 503
+
+@metrics.registry.on_collect
+def collect_cache_metrics():
+    caches = dict(db.cache_stats(), responses=response_cache.stats())
+    for name, stats in caches.items():
+        metrics.cache_hits.set(stats['hits'], cache=name)
+        metrics.cache_misses.set(stats['misses'], cache=name)
+        metrics.cache_evictions.set(stats['evictions'], cache=name)
+        metrics.cache_entries.set(stats['entries'], cache=name)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """مقاييس كل العمليات بصيغة Prometheus النصية"""
+    if METRICS_TOKEN:
+        expected = f"Bearer {METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            return jsonify({'error': 'غير مصرح'}), 401
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.after_request
+def wake_event_broker(response):
+    # طلبات الكتابة قد تسجل أحداثاً: تُقرأ فوراً بدلاً من انتظار دورة القراءة التالية
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        broker.notify()
+    return response
+
 # دالة للتحقق من تسجيل الدخول
 def login_required(f):
     @wraps(f)
@@ -112,170 +270,325 @@ def logout():
 @app.route('/api/current-user', methods=['GET'])
 def current_user():
     if 'user_id' in session:
-        user = db.get_user_by_id(session['user_id'])
-        if user:
-            return jsonify({'user': user}), 200
+        # الحساب الثابت (10AI) ليس له صف في جدول المستخدمين
+        user = db.get_user_by_id(session['user_id']) or {
+            'id': session['user_id'],
+            'username': session.get('username'),
+        }
+        return jsonify({'user': user}), 200
     return jsonify({'user': None}), 200
 
 @app.route('/')
 def index():
-    return send_from_directory('.', 'index.html')
+    return static_assets.response('index.html')
 
 @app.route('/saved_images/<path:filename>')
 def serve_saved_images(filename):
-    """تقديم الصور المحفوظة محلياً"""
-    return send_from_directory(UPLOADS_DIR, filename)
+    """تقديم الصور المحفوظة محلياً، أو ملف من المخزن المعنون عبر /saved_images/<hash>"""
+    blob_hash = os.path.splitext(filename)[0]
+    if '/' not in filename and HASH_RE.match(blob_hash):
+        blob_path = image_store.find(blob_hash)
+        if not blob_path:
+            return jsonify({'error': 'الصورة غير موجودة'}), 404
+        return send_immutable(os.path.dirname(blob_path), os.path.basename(blob_path), blob_hash)
+    # ملفات المخزن والنسخ المصغرة أسماؤها بصمات محتواها فلا تتغير
+    parts = filename.split('/')
+    if parts[0] in ('blobs', 'derivatives') and HASH_RE.match(os.path.splitext(parts[-1])[0]):
+        etag = '-'.join(parts[:-2] + [os.path.splitext(parts[-1])[0]])
+        return send_immutable(UPLOADS_DIR, filename, etag)
+    return send_revalidated(UPLOADS_DIR, filename, max_age=SAVED_IMAGE_MAX_AGE)
+
+@app.route('/thumbs/<size>/<path:image_path>')
+def serve_thumbnail(size, image_path):
+    """تقديم نسخة مصغرة بالحجم المطلوب (thumb أو medium)، أو الأصل إذا لم تجهز بعد"""
+    if size not in DERIVATIVE_SIZES or not image_path.startswith(UPLOADS_DIR + '/'):
+        return jsonify({'error': 'طلب غير صالح'}), 404
+    derivative = thumbnails.derivative_path(size, image_path)
+    if os.path.exists(derivative):
+        etag = f"{size}-{os.path.splitext(os.path.basename(derivative))[0]}"
+        return send_immutable(os.path.dirname(derivative), os.path.basename(derivative), etag)
+    # توليدها في الخلفية للطلبات القادمة، والأصل مؤقتاً دون تخزين طويل
+    thumbnails.ensure(image_path)
+    return send_revalidated(UPLOADS_DIR, image_path[len(UPLOADS_DIR) + 1:])
 
 @app.route('/<path:filename>')
 def serve_static(filename):
-    return send_from_directory('.', filename)
+    if filename in static_assets:
+        return static_assets.response(filename)
+    return send_revalidated('.', filename)
+
+@app.route('/api/extract', methods=['POST'])
+@login_required
+def extract_product():
+    """جلب صفحة المنتج وتحليلها على الخادم: الاسم والصور والسعر والعملة معاً"""
+    try:
+        data = request.get_json() or {}
+        urls = data.get('urls') or ([data['url']] if data.get('url') else [])
+        
+        if not urls:
+            return jsonify({'error': 'رابط المنتج مطلوب'}), 400
+        if len(urls) > MAX_EXTRACT_URLS:
+            return jsonify({'error': f'الحد الأقصى {MAX_EXTRACT_URLS} رابط في الطلب الواحد'}), 400
+        
+        results = extractor.extract_many(urls)
+        if 'url' in data and 'urls' not in data:
+            result = results[0]
+            if 'error' in result:
+                return jsonify(result), 502
+            return jsonify(result), 200
+        return jsonify({'results': results}), 200
+        
+    except Exception as e:
+        print(f"Error extracting product: {e}")
+        return jsonify({'error': 'خطأ في تحليل المنتج'}), 500
+
+def run_save_images_job(job, context):
+    """تحميل صور منتج وحفظه (تعمل في عامل الطابور)، وتستأنف من التقدم المحفوظ"""
+    payload = job['payload']
+    image_urls = payload['image_urls']
+    progress = job['progress'] or [{'url': url, 'status': 'pending'} for url in image_urls]
+
+    # الصور المحفوظة قبل التوقف لا تُحمّل مرة أخرى ما دام ملفها موجوداً
+    pending = [
+        index for index, item in enumerate(progress)
+        if item['status'] != 'done' or not image_store.find(item['hash'])
+    ]
+    for index in pending:
+        progress[index] = {'url': image_urls[index], 'status': 'downloading'}
+    context.progress(progress)
+
+    for position, img in downloader.download_iter([image_urls[index] for index in pending], image_store, http_cache):
+        index = pending[position]
+        if img:
+            status = 'stored' if img.pop('created') else 'already stored'
+            print(f"Successfully downloaded image ({status}): {img['filename']}")
+            progress[index] = dict(img, url=image_urls[index], status='done')
+        else:
+            progress[index] = {'url': image_urls[index], 'status': 'failed'}
+        context.progress(progress)
+
+    # الصور تُحفظ في المخزن المعنون بالمحتوى
+    product_folder = image_store.blobs_dir
+    saved_images = [
+        {key: item[key] for key in ('filename', 'path', 'size', 'hash')}
+        for item in progress if item['status'] == 'done'
+    ]
+    total_images = len(image_urls)
+    success_count = len(saved_images)
+
+    if not saved_images:
+        context.complete({
+            'success': False,
+            'saved_count': 0,
+            'total_count': total_images,
+            'error': f'فشل في تحميل جميع الصور ({total_images} صور). يرجى التحقق من اتصال الإنترنت أو صحة روابط الصور.',
+            'suggestions': [
+                'تحقق من اتصال الإنترنت',
+                'تأكد من صحة روابط الصور',
+                'حاول مرة أخرى بعد قليل'
+            ]
+        }, status='failed')
+        return
 
+    result = {
+        'success': True,
+        'saved_count': success_count,
+        'total_count': total_images,
+        'folder_path': product_folder,
+        'images': saved_images,
+        'message': f'تم حفظ {success_count} من أصل {total_images} صورة محلياً في مجلد: {product_folder}'
+    }
+    # تحضير قائمة الصور المحفوظة محلياً (مسارات نسبية) مع مصدر كل صورة وأبعادها
+    local_image_paths = [img['path'] for img in saved_images]
+    product_images = [
+        {'source_url': item['url'], **{key: item.get(key) for key in ('path', 'size', 'hash', 'width', 'height')}}
+        for item in progress if item['status'] == 'done'
+    ]
+    try:
+        # المنتج وإنهاء المهمة في معاملة واحدة فلا يتكرر المنتج عند الاستئناف
+        with db.connection():
+            product_db_id = db.create_product(
+                user_id=job['user_id'],
+                name=payload['product_name'],
+                season=payload.get('season'),
+                images=product_images,
+                url=payload.get('url', ''),
+                description=payload.get('description', '')
+            )
+            result['product_id'] = product_db_id
+            context.complete(result)
+    except Exception as db_error:
+        if context.finished:
+            raise
+        print(f"Database error: {db_error}")
+        # حتى لو فشل حفظ قاعدة البيانات، الصور محفوظة
+        result.pop('product_id', None)
+        result['warning'] = 'تم حفظ الصور ولكن فشل في حفظ البيانات في قاعدة البيانات'
+        context.complete(result)
+        return
+    thumbnails.submit(product_db_id, local_image_paths)
+
+jobs.register('save_images', run_save_images_job)
 
+def job_response(job):
+    """وصف حالة المهمة وتقدم كل صورة للعميل"""
+    progress = job['progress'] or []
+    return {
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'total_count': len(job['payload'].get('image_urls', [])),
+        'done_count': sum(1 for item in progress if item['status'] == 'done'),
+        'failed_count': sum(1 for item in progress if item['status'] == 'failed'),
+        'progress': progress,
+        'result': job['result'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+    }
 
 @app.route('/save-images-locally', methods=['POST'])
 @login_required
 def save_images_locally():
+    """إضافة مهمة حفظ الصور إلى الطابور والرد فوراً برقمها (202)"""
     try:
         data = request.get_json()
         product_name = data.get('product_name')
         image_urls = data.get('image_urls')
-        product_id = data.get('product_id')
-        season = data.get('season', 'غير محدد')
         
         if not product_name or not image_urls:
             return jsonify({'error': 'اسم المنتج وروابط الصور مطلوبة'}), 400
         
-        # إنشاء مجلد للمنتج
-        product_folder = os.path.join(UPLOADS_DIR, product_name.replace(' ', '_'))
-        if not os.path.exists(product_folder):
-            os.makedirs(product_folder)
-        
-        saved_images = []
-        
-        for i, url in enumerate(image_urls):
-            success = False
-            max_retries = 3
-            
-            for attempt in range(max_retries):
-                try:
-                    # تحميل الصورة مع timeout أطول وheaders
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                    }
-                    response = requests.get(url, timeout=60, headers=headers, stream=True)
-                    response.raise_for_status()
-                    
-                    # تحديد امتداد الملف
-                    parsed_url = urlparse(url)
-                    file_extension = os.path.splitext(parsed_url.path)[1]
-                    if not file_extension:
-                        content_type = response.headers.get('content-type', '')
-                        if 'jpeg' in content_type or 'jpg' in content_type:
-                            file_extension = '.jpg'
-                        elif 'png' in content_type:
-                            file_extension = '.png'
-                        elif 'webp' in content_type:
-                            file_extension = '.webp'
-                        else:
-                            file_extension = '.jpg'  # افتراضي
-                    
-                    # إنشاء اسم ملف فريد
-                    filename = f"{product_name.replace(' ', '_')}_image_{i+1}_{uuid.uuid4().hex[:8]}{file_extension}"
-                    file_path = os.path.join(product_folder, filename)
-                    
-                    # حفظ الصورة
-                    with open(file_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                    
-                    saved_images.append({
-                        'filename': filename,
-                        'path': file_path,
-                        'size': os.path.getsize(file_path)
-                    })
-                    
-                    success = True
-                    print(f"Successfully downloaded image {i+1}: {filename}")
-                    break
-                    
-                except Exception as e:
-                    print(f"Attempt {attempt + 1} failed for image {url}: {e}")
-                    if attempt == max_retries - 1:
-                        print(f"Failed to download image after {max_retries} attempts: {url}")
-                    else:
-                        import time
-                        time.sleep(2)  # انتظار قبل المحاولة التالية
-        
-        if saved_images:
-            # حفظ المنتج في قاعدة البيانات
-            try:
-                # تحضير قائمة الصور المحفوظة محلياً (مسارات نسبية)
-                local_image_paths = [os.path.join('saved_images', product_name.replace(' ', '_'), os.path.basename(img['path'])) for img in saved_images]
-                
-                product_db_id = db.create_product(
-                    user_id=session['user_id'],
-                    name=product_name,
-                    season=season,
-                    images=local_image_paths,
-                    url=data.get('url', ''),
-                    description=data.get('description', '')
-                )
-                
-                total_images = len(image_urls)
-                success_count = len(saved_images)
-                
-                return jsonify({
-                    'success': True,
-                    'saved_count': success_count,
-                    'total_count': total_images,
-                    'folder_path': product_folder,
-                    'images': saved_images,
-                    'product_id': product_db_id,
-                    'message': f'تم حفظ {success_count} من أصل {total_images} صورة محلياً في مجلد: {product_folder}'
-                })
-            except Exception as db_error:
-                print(f"Database error: {db_error}")
-                # حتى لو فشل حفظ قاعدة البيانات، الصور محفوظة
-                total_images = len(image_urls)
-                success_count = len(saved_images)
-                
-                return jsonify({
-                    'success': True,
-                    'saved_count': success_count,
-                    'total_count': total_images,
-                    'folder_path': product_folder,
-                    'images': saved_images,
-                    'warning': 'تم حفظ الصور ولكن فشل في حفظ البيانات في قاعدة البيانات',
-                    'message': f'تم حفظ {success_count} من أصل {total_images} صورة محلياً في مجلد: {product_folder}'
-                })
-        else:
-            total_images = len(image_urls)
-            return jsonify({
-                'success': False,
-                'saved_count': 0,
-                'total_count': total_images,
-                'error': f'فشل في تحميل جميع الصور ({total_images} صور). يرجى التحقق من اتصال الإنترنت أو صحة روابط الصور.',
-                'suggestions': [
-                    'تحقق من اتصال الإنترنت',
-                    'تأكد من صحة روابط الصور',
-                    'حاول مرة أخرى بعد قليل'
-                ]
-            }), 400
+        job_id = jobs.enqueue(session['user_id'], 'save_images', {
+            'product_name': product_name,
+            'image_urls': image_urls,
+            'product_id': data.get('product_id'),
+            'season': data.get('season') or None,
+            'url': data.get('url', ''),
+            'description': data.get('description', ''),
+        })
+        status_url = f'/api/jobs/{job_id}'
+        response = jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': status_url,
+            'total_count': len(image_urls),
+        })
+        response.headers['Location'] = status_url
+        return response, 202
             
     except Exception as e:
         print(f"Error saving images locally: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """حالة مهمة وتقدمها"""
+    try:
+        job = jobs.get(job_id, session['user_id'])
+        if not job:
+            return jsonify({'error': 'المهمة غير موجودة'}), 404
+        return jsonify(job_response(job))
+    except Exception as e:
+        print(f"Error getting job: {e}")
+        return jsonify({'error': 'خطأ في جلب حالة المهمة'}), 500
+
 # نقاط النهاية لإدارة المنتجات
 @app.route('/api/products', methods=['GET'])
 @login_required
 def get_products():
     try:
-        products = db.get_user_products(session['user_id'])
-        return jsonify({'products': products}), 200
+        # معاملات اختيارية: limit و cursor للتصفح، fields للإسقاط، status و season للتصفية
+        limit = request.args.get('limit', type=int)
+        if limit is not None:
+            limit = max(1, min(limit, MAX_PRODUCTS_PAGE_SIZE))
+        fields = request.args.get('fields')
+        fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+        
+        def build():
+            products, next_cursor = db.get_user_products_page(
+                session['user_id'],
+                limit=limit,
+                cursor=request.args.get('cursor'),
+                fields=fields,
+                status=request.args.get('status'),
+                season=request.args.get('season')
+            )
+            return {'products': products, 'next_cursor': next_cursor}
+        
+        return cached_user_response(build)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'خطأ في جلب المنتجات'}), 500
 
+@app.route('/api/products/search', methods=['GET'])
+@login_required
+def search_products():
+    """البحث في اسم ووصف المنتجات: q للنص، limit و offset للتصفح، fields للإسقاط"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'المعامل q مطلوب'}), 400
+        if len(query) > MAX_SEARCH_QUERY_LENGTH:
+            return jsonify({'error': 'نص البحث طويل جداً'}), 400
+        limit = request.args.get('limit', default=SEARCH_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, MAX_PRODUCTS_PAGE_SIZE))
+        offset = max(0, request.args.get('offset', default=0, type=int))
+        fields = request.args.get('fields')
+        fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+        
+        def build():
+            products, next_offset = db.search_products(session['user_id'], query, limit=limit, offset=offset, fields=fields)
+            return {'products': products, 'next_offset': next_offset}
+        
+        return cached_user_response(build)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error searching products: {e}")
+        return jsonify({'error': 'خطأ في البحث'}), 500
+
+@app.route('/api/events', methods=['GET'])
+@login_required
+def stream_events():
+    """بث أحداث المستخدم (SSE)؛ يستأنف من Last-Event-ID عند إعادة الاتصال"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID غير صالح'}), 400
+    try:
+        subscriber = broker.subscribe(session['user_id'])
+    except TooManyConnections:
+        response = jsonify({'error': 'عدد الاتصالات المفتوحة كبير، حاول لاحقاً'})
+        response.headers['Retry-After'] = str(SSE_RETRY_MS // 1000)
+        return response, 503
+    return Response(
+        event_stream(broker, subscriber, last_event_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/api/products/changes', methods=['GET'])
+@login_required
+def get_product_changes():
+    """المنتجات المتغيرة والمحذوفة منذ موضع المزامنة since (من X-Sync-Cursor أو cursor السابق)"""
+    try:
+        since = request.args.get('since')
+        if since is None:
+            return jsonify({'error': 'المعامل since مطلوب'}), 400
+        limit = request.args.get('limit', default=MAX_PRODUCTS_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, MAX_PRODUCTS_PAGE_SIZE))
+        return jsonify(db.get_product_changes(session['user_id'], since, limit)), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error getting product changes: {e}")
+        return jsonify({'error': 'خطأ في جلب التغييرات'}), 500
+
 @app.route('/api/products', methods=['POST'])
 @login_required
 def create_product():
@@ -313,6 +626,217 @@ def create_product():
         print(f"Error creating product: {e}")
         return jsonify({'error': 'خطأ في حفظ المنتج'}), 500
 
+@app.route('/api/products/export', methods=['GET'])
+@login_required
+def export_products():
+    """تصدير منتجات المستخدم بصيغة NDJSON (منتج في كل سطر) عبر البث"""
+    user_id = session['user_id']
+    
+    def generate():
+        for product in db.iter_user_products(user_id):
+            yield json.dumps(product, ensure_ascii=False, default=str) + '\n'
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': 'attachment; filename=products.ndjson'}
+    )
+
+def archive_name(name):
+    """اسم آمن داخل الأرشيف (دون فواصل مسارات أو محارف تحكم)"""
+    name = re.sub(r'[\\/:*?"<>|\x00-\x1f]+', '_', str(name or '')).strip(' .')
+    return name[:100] or 'product'
+
+def product_archive_entries(product, folder=None):
+    """ملفات صور المنتج المحفوظة محلياً كـ (الاسم في الأرشيف، المسار)"""
+    base = archive_name(product.get('name'))
+    entries = []
+    for image in product.get('images') or []:
+        if not isinstance(image, str):
+            continue
+        path = os.path.normpath(image.lstrip('/'))
+        # الصور الخارجية أو خارج مجلد الصور لا تُضاف
+        if not path.startswith(UPLOADS_DIR + os.sep) or not os.path.isfile(path):
+            continue
+        number = len(entries) + 1
+        filename = f"{base}_صورة_{number}{os.path.splitext(path)[1].lower()}"
+        entries.append((f"{folder}/{filename}" if folder else filename, path))
+    return entries
+
+def zip_response(entries, filename):
+    """بث أرشيف ZIP للتحميل"""
+    return Response(
+        stream_with_context(stream_zip(entries)),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f"attachment; filename=images.zip; filename*=UTF-8''{quote(filename)}",
+            'Cache-Control': 'no-store',
+        }
+    )
+
+@app.route('/api/products/<int:product_id>/images.zip', methods=['GET'])
+@login_required
+def download_product_images(product_id):
+    """تحميل صور منتج واحد المحفوظة على الخادم كملف ZIP"""
+    product = db.get_product(product_id, session['user_id'], fields=['name', 'images'])
+    if not product:
+        return jsonify({'error': 'المنتج غير موجود'}), 404
+    entries = product_archive_entries(product)
+    if not entries:
+        return jsonify({'error': 'لا توجد صور محفوظة لهذا المنتج'}), 404
+    return zip_response(entries, f"{archive_name(product['name'])}_صور.zip")
+
+@app.route('/api/products/images.zip', methods=['GET'])
+@login_required
+def download_products_images():
+    """تحميل صور عدة منتجات (مع تصفية بالحالة والموسم) في ملف ZIP واحد"""
+    products = db.get_user_products(
+        session['user_id'],
+        fields=['name', 'images'],
+        status=request.args.get('status') or None,
+        season=request.args.get('season') or None
+    )
+    entries = []
+    folders = set()
+    for product in products:
+        # مجلد لكل منتج، مع رقم المنتج إذا تكرر الاسم
+        folder = archive_name(product['name'])
+        if folder in folders:
+            folder = f"{folder}_{product['id']}"
+        folders.add(folder)
+        entries.extend(product_archive_entries(product, folder))
+    if not entries:
+        return jsonify({'error': 'لا توجد صور محفوظة للمنتجات المطلوبة'}), 404
+    return zip_response(entries, 'صور_المنتجات.zip')
+
+def parse_import_line(line):
+    """تحويل سطر NDJSON إلى منتج صالح للإدراج، ويرفع ValueError عند الخطأ"""
+    try:
+        data = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f'JSON غير صالح: {e}')
+    if not isinstance(data, dict):
+        raise ValueError('يجب أن يكون كل سطر كائن JSON')
+    if not data.get('name'):
+        raise ValueError('اسم المنتج مطلوب')
+    images = data.get('images')
+    if images is not None and not isinstance(images, list):
+        raise ValueError('images يجب أن تكون قائمة')
+    price = data.get('price') or 0
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        raise ValueError('السعر غير صالح')
+    product = {k: data.get(k) for k in IMPORT_FIELDS}
+    product['price'] = price
+    return product
+
+@app.route('/api/products/import', methods=['POST'])
+@login_required
+def import_products():
+    """استيراد منتجات من جسم NDJSON مبثوث على دفعات، مع تقرير أخطاء كل سطر"""
+    user_id = session['user_id']
+    imported = 0
+    failed = 0
+    errors = []
+    batch = []
+    
+    def record_error(line_number, message):
+        nonlocal failed
+        failed += 1
+        if len(errors) < MAX_IMPORT_ERRORS:
+            errors.append({'line': line_number, 'error': message})
+    
+    def flush():
+        nonlocal imported
+        if not batch:
+            return
+        try:
+            imported += db.bulk_create_products(user_id, [product for _, product in batch])
+        except Exception as e:
+            # فشل الدفعة: إعادة المحاولة سطراً سطراً لتحديد الأسطر المعطوبة
+            print(f"Import batch failed, retrying row by row: {e}")
+            for line_number, product in batch:
+                try:
+                    imported += db.bulk_create_products(user_id, [product])
+                except Exception as row_error:
+                    record_error(line_number, str(row_error))
+        batch.clear()
+    
+    try:
+        for line_number, raw_line in enumerate(request.stream, start=1):
+            line = raw_line.decode('utf-8', errors='replace').strip()
+            if not line:
+                continue
+            try:
+                batch.append((line_number, parse_import_line(line)))
+            except ValueError as e:
+                record_error(line_number, str(e))
+                continue
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush()
+        flush()
+    except Exception as e:
+        print(f"Error importing products: {e}")
+        return jsonify({'error': 'خطأ في استيراد المنتجات', 'imported': imported, 'errors': errors}), 500
+    
+    return jsonify({'imported': imported, 'failed': failed, 'errors': errors}), 200
+
+@app.route('/api/products/<int:product_id>/images', methods=['GET'])
+@login_required
+def get_product_images(product_id):
+    """صور منتج كاملة بترتيبها مع بياناتها (القوائم تعرض الغلاف فقط)"""
+    images = db.get_product_images(product_id, session['user_id'])
+    if images is None:
+        return jsonify({'error': 'المنتج غير موجود'}), 404
+    return jsonify({'images': images}), 200
+
+@app.route('/api/products/<int:product_id>/images', methods=['POST'])
+@login_required
+def upload_product_images(product_id):
+    """رفع صور من جهاز المستخدم (multipart/form-data) وإضافتها بعد صور المنتج
+
+    الجسم يُبث إلى المخزن المعنون على دفعات (uploads.py) دون تحليل النموذج
+    عبر request.files.
+    """
+    user_id = session['user_id']
+    if not db.get_product(product_id, user_id, fields=['id']):
+        return jsonify({'error': 'المنتج غير موجود'}), 404
+    mimetype, options = parse_options_header(request.headers.get('Content-Type', ''))
+    if mimetype != 'multipart/form-data' or not options.get('boundary'):
+        return jsonify({'error': 'يجب إرسال الصور بصيغة multipart/form-data'}), 400
+    if request.content_length and request.content_length > MAX_UPLOAD_REQUEST_SIZE:
+        return jsonify({'error': f'الحد الأقصى لحجم الطلب {MAX_UPLOAD_REQUEST_SIZE // (1024 * 1024)} ميجابايت'}), 413
+    
+    try:
+        saved = save_uploads(request.stream, options['boundary'].encode('latin-1'), image_store)
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except UnsupportedImageType as e:
+        return jsonify({'error': str(e)}), 415
+    except ValueError as e:
+        print(f"Invalid upload: {e}")
+        return jsonify({'error': 'طلب رفع غير صالح'}), 400
+    if not saved:
+        return jsonify({'error': 'لا توجد صور في الطلب'}), 400
+    
+    # الصور تُسجل مع المنتج كما تفعل مهمة حفظ الصور، ثم تُولد نسخها المصغرة
+    images = [{key: img[key] for key in ('path', 'size', 'hash', 'width', 'height')} for img in saved]
+    if not db.add_product_images(product_id, user_id, images):
+        return jsonify({'error': 'المنتج غير موجود'}), 404
+    thumbnails.submit(product_id, [img['path'] for img in saved])
+    for img in saved:
+        status = 'stored' if img['created'] else 'already stored'
+        print(f"Uploaded image ({status}): {img['filename']}")
+    return jsonify({
+        'success': True,
+        'saved_count': len(saved),
+        'images': [
+            {key: img[key] for key in ('name', 'filename', 'path', 'size', 'hash', 'width', 'height')}
+            for img in saved
+        ],
+    }), 201
+
 @app.route('/api/products/<int:product_id>', methods=['PUT'])
 @login_required
 def update_product(product_id):
@@ -333,6 +857,37 @@ def update_product(product_id):
         print(f"Error updating product: {e}")
         return jsonify({'error': 'خطأ في تحديث المنتج'}), 500
 
+@app.route('/api/products/batch', methods=['PATCH'])
+@login_required
+def update_products_batch():
+    """تطبيق نفس التحديث (status أو season أو price) على عدة منتجات في معاملة واحدة"""
+    try:
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids')
+        if not isinstance(ids, list) or not ids:
+            return jsonify({'error': 'قائمة أرقام المنتجات مطلوبة'}), 400
+        if len(ids) > MAX_BATCH_IDS:
+            return jsonify({'error': f'الحد الأقصى {MAX_BATCH_IDS} منتج في الطلب الواحد'}), 400
+        try:
+            ids = [int(product_id) for product_id in ids]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'أرقام المنتجات غير صالحة'}), 400
+        
+        changes = {k: v for k, v in data.items() if k in BATCH_UPDATE_FIELDS}
+        if not changes:
+            return jsonify({'error': f"حقل واحد على الأقل مطلوب من: {', '.join(BATCH_UPDATE_FIELDS)}"}), 400
+        
+        updated_ids = db.update_products(session['user_id'], ids, **changes)
+        return jsonify({
+            'message': f'تم تحديث {len(updated_ids)} منتج',
+            'updated_ids': updated_ids,
+            'not_found_ids': sorted(set(ids) - set(updated_ids)),
+        }), 200
+        
+    except Exception as e:
+        print(f"Error batch updating products: {e}")
+        return jsonify({'error': 'خطأ في تحديث المنتجات'}), 500
+
 @app.route('/api/products/<int:product_id>', methods=['DELETE'])
 @login_required
 def delete_product(product_id):
@@ -366,12 +921,21 @@ def delete_all_products():
 @login_required
 def get_seasons():
     try:
-        seasons = db.get_user_seasons(session['user_id'])
-        return jsonify({'seasons': seasons}), 200
+        return cached_user_response(lambda: {'seasons': db.get_user_seasons(session['user_id'])})
     except Exception as e:
         print(f"Error getting seasons: {e}")
         return jsonify({'error': 'خطأ في جلب المواسم'}), 500
 
+@app.route('/api/seasons/stats', methods=['GET'])
+@login_required
+def get_season_stats():
+    """عدد المنتجات لكل موسم وحالة وحجم الصور المحفوظة، دون تحميل المنتجات"""
+    try:
+        return cached_user_response(lambda: db.get_season_stats(session['user_id']))
+    except Exception as e:
+        print(f"Error getting season stats: {e}")
+        return jsonify({'error': 'خطأ في جلب إحصاءات المواسم'}), 500
+
 @app.route('/api/seasons', methods=['POST'])
 @login_required
 def save_season():
@@ -382,10 +946,10 @@ def save_season():
         if not season_name:
             return jsonify({'error': 'اسم الموسم مطلوب'}), 400
         
-        success = db.save_season(session['user_id'], season_name)
+        season_id = db.create_season(session['user_id'], season_name, data.get('description'))
         
-        if success:
-            return jsonify({'message': 'تم حفظ الموسم بنجاح'}), 201
+        if season_id:
+            return jsonify({'message': 'تم حفظ الموسم بنجاح', 'season_id': season_id}), 201
         else:
             return jsonify({'error': 'هذا الموسم موجود بالفعل'}), 400
             
@@ -397,7 +961,7 @@ def save_season():
 @login_required
 def delete_season(season_name):
     try:
-        success = db.delete_season(session['user_id'], season_name)
+        success = db.delete_season(season_name, session['user_id'])
         
         if success:
             return jsonify({'message': 'تم حذف الموسم بنجاح'}), 200
@@ -418,7 +982,7 @@ def update_season(old_name):
         if not new_name:
             return jsonify({'error': 'الاسم الجديد مطلوب'}), 400
         
-        success = db.update_season_name(session['user_id'], old_name, new_name)
+        success = db.update_season(old_name, new_name, session['user_id'], data.get('description'))
         
         if success:
             return jsonify({'message': 'تم تحديث اسم الموسم بنجاح'}), 200
@@ -432,9 +996,14 @@ def update_season(old_name):
 if __name__ == '__main__':
     print("بدء تشغيل الخادم...")
     port = int(os.environ.get('PORT', 5000))
-    debug = os.environ.get('DEBUG', 'True').lower() == 'true'
+    # وضع التطوير فقط عند طلبه صراحة؛ للإنتاج: gunicorn -c gunicorn.conf.py wsgi:app
+    debug = os.environ.get('DEBUG', 'False').lower() == 'true'
     
     if debug:
         print(f"الموقع متاح على: http://localhost:{port}")
     
+    # عملية المراقبة في وضع إعادة التحميل لا تشغل العمال
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        jobs.start()
+    
     app.run(debug=debug, port=port, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,185 @@
+"""تقديم الملفات الثابتة مع التخزين المؤقت في المتصفح
+
+- ETag مبني على بصمة المحتوى، ورد 304 عند عدم التغيير
+- الملفات النصية (html/js/css/svg) تُضغط مسبقاً بـ gzip و brotli مرة واحدة عند التشغيل
+- صفحات HTML تشير إلى script.js و styles.css مع ?v=<البصمة>، فتُخزن هذه
+  الملفات في المتصفح كـ immutable وتتغير روابطها تلقائياً عند تعديلها
+- طلبات Range للملفات الكبيرة
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+
+from flask import Response, current_app, request, send_from_directory
+from werkzeug.security import safe_join
+
+from cache import TTLCache
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# سنة كاملة للملفات التي يتغير رابطها مع محتواها
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# الصور القديمة (أسماء بالتاريخ) لا تُعدل بعد حفظها
+SAVED_IMAGE_MAX_AGE = 24 * 3600
+TEXT_ASSET_EXTENSIONS = ('.html', '.js', '.css', '.svg')
+# الملفات الأصغر من هذا لا تستحق الضغط
+MIN_COMPRESS_SIZE = 1024
+# أقل فاصل بين فحصين لتعديل الملفات على القرص
+STATIC_RELOAD_INTERVAL = float(os.environ.get('STATIC_RELOAD_INTERVAL', 2))
+
+ASSET_REF_RE = re.compile(r'''((?:src|href)=["'])([^"'?#:]+\.(?:js|css))(["'])''')
+
+# بصمات محتوى الملفات مفهرسة بـ (المسار، وقت التعديل، الحجم)
+_file_hashes = TTLCache(max_entries=4096)
+
+
+def file_etag(path):
+    """بصمة محتوى الملف (تُحسب مرة واحدة لكل نسخة منه)"""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    etag = _file_hashes.get(key)
+    if etag is None:
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                hasher.update(chunk)
+        etag = hasher.hexdigest()
+        _file_hashes.set(key, etag)
+    return etag
+
+
+def send_immutable(directory, filename, etag):
+    """تقديم ملف اسمه مشتق من محتواه: لا يتغير أبداً فيُخزن لمدة سنة"""
+    response = send_from_directory(directory, filename, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def send_revalidated(directory, filename, max_age=0):
+    """تقديم ملف مع ETag من محتواه، ويُعاد التحقق منه بعد max_age"""
+    path = safe_join(os.path.join(current_app.root_path, directory), filename)
+    etag = file_etag(path) if path and os.path.isfile(path) else True
+    response = send_from_directory(directory, filename, etag=etag, max_age=max_age)
+    if not max_age:
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+    return response
+
+
+class StaticAssets:
+    """الملفات النصية في جذر المشروع مع نسخها المضغوطة في الذاكرة"""
+
+    def __init__(self, root='.'):
+        self.root = root
+        self._assets = {}
+        self._mtimes = {}
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self.build()
+
+    def _scan(self):
+        mtimes = {}
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(TEXT_ASSET_EXTENSIONS):
+                    mtimes[entry.name] = entry.stat().st_mtime_ns
+        return mtimes
+
+    def _fingerprint(self, html, versions):
+        def replace(match):
+            version = versions.get(match.group(2))
+            if not version:
+                return match.group(0)
+            return f"{match.group(1)}{match.group(2)}?v={version}{match.group(3)}"
+        return ASSET_REF_RE.sub(replace, html)
+
+    def _entry(self, name, content):
+        etag = hashlib.sha256(content).hexdigest()[:20]
+        entry = {
+            'etag': etag,
+            'mimetype': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+            'identity': content,
+        }
+        if len(content) >= MIN_COMPRESS_SIZE:
+            compressed = gzip.compress(content, compresslevel=9, mtime=0)
+            if len(compressed) < len(content):
+                entry['gzip'] = compressed
+            if BROTLI_AVAILABLE:
+                compressed = brotli.compress(content, quality=11)
+                if len(compressed) < len(content):
+                    entry['br'] = compressed
+        return entry
+
+    def build(self):
+        """قراءة وضغط كل الملفات النصية (HTML أخيراً لتضمين بصمات الملفات الأخرى)"""
+        mtimes = self._scan()
+        assets = {}
+        names = sorted(mtimes, key=lambda name: name.endswith('.html'))
+        for name in names:
+            with open(os.path.join(self.root, name), 'rb') as f:
+                content = f.read()
+            if name.endswith('.html'):
+                versions = {other: asset['etag'] for other, asset in assets.items()}
+                content = self._fingerprint(content.decode('utf-8'), versions).encode('utf-8')
+            assets[name] = self._entry(name, content)
+        with self._lock:
+            self._assets = assets
+            self._mtimes = mtimes
+            self._checked_at = time.monotonic()
+
+    def _refresh(self):
+        # إعادة البناء إذا عُدل ملف على القرص (أثناء التطوير)
+        if time.monotonic() - self._checked_at < STATIC_RELOAD_INTERVAL:
+            return
+        self._checked_at = time.monotonic()
+        if self._scan() != self._mtimes:
+            self.build()
+
+    def __contains__(self, name):
+        self._refresh()
+        return name in self._assets
+
+    def _encoding(self, asset):
+        for encoding in ('br', 'gzip'):
+            if encoding in asset and request.accept_encodings[encoding]:
+                return encoding
+        return 'identity'
+
+    def response(self, name):
+        """رد الملف بأفضل ترميز يقبله المتصفح، مع 304 و Range"""
+        self._refresh()
+        asset = self._assets[name]
+        encoding = self._encoding(asset)
+        body = asset[encoding]
+
+        response = Response(body, mimetype=asset['mimetype'])
+        response.vary.add('Accept-Encoding')
+        if encoding == 'identity':
+            response.set_etag(asset['etag'])
+        else:
+            response.headers['Content-Encoding'] = encoding
+            response.set_etag(f"{asset['etag']}-{encoding}")
+
+        # الرابط المتضمن للبصمة الحالية لا يتغير محتواه أبداً
+        if request.args.get('v') == asset['etag']:
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+
+        return response.make_conditional(
+            request,
+            accept_ranges=encoding == 'identity',
+            complete_length=len(body),
+        )
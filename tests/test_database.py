@@ -0,0 +1,61 @@
+import pytest
+
+from database_cloud import Database
+
+
+@pytest.fixture
+def db(workdir):
+    return Database()
+
+
+def test_update_products_inside_open_transaction(db):
+    product_id = db.create_product(1, 'منتج', season='صيف')
+    with db.connection() as conn:
+        conn.cursor().execute("UPDATE products SET name = ? WHERE id = ?", ('منتج جديد', product_id))
+        assert db.update_products(1, [product_id], status='approved', season='شتاء') == [product_id]
+    product = db.get_product(product_id, 1)
+    assert (product['name'], product['status'], product['season']) == ('منتج جديد', 'approved', 'شتاء')
+
+
+def _season_names(db, user_id):
+    return sorted(season['name'] for season in db.get_user_seasons(user_id))
+
+
+def test_season_list_is_current_across_instances(workdir):
+    # نسختان من Database على الملف نفسه تمثلان عاملين في gunicorn
+    worker_a, worker_b = Database(), Database()
+    worker_a.create_season(1, 'A')
+    assert _season_names(worker_a, 1) == ['A']
+
+    worker_b.create_season(1, 'B')
+    # الإصدار الذي يقرؤه العامل الأول يطابق ما يعيده من مواسم، فلا يُخزن رد قديم بإصدار جديد
+    assert worker_a.get_user_version(1) == worker_b.get_user_version(1)
+    assert _season_names(worker_a, 1) == ['A', 'B']
+
+    worker_b.update_season('A', 'C', 1)
+    assert _season_names(worker_a, 1) == ['B', 'C']
+    worker_b.delete_season('B', 1)
+    assert _season_names(worker_a, 1) == ['C']
+
+
+def _stats(db, user_id):
+    return sorted(
+        (season['season'], season['product_count'], season['image_bytes'])
+        for season in db.get_season_stats(user_id)['seasons']
+    )
+
+
+def test_delete_all_products_subtracts_only_removed_rows(db):
+    for season in ('صيف', 'صيف', 'شتاء'):
+        db.create_product(1, 'منتج', season=season)
+    other = db.create_product(2, 'منتج', season='صيف')
+    with db.connection() as conn:
+        # فرق منتج أضافته معاملة أخرى ولم يشمله الحذف
+        conn.cursor().execute(
+            "UPDATE season_stats SET product_count = product_count + 1 WHERE user_id = 1 AND status = 'pending' "
+            "AND season_id = (SELECT id FROM seasons WHERE user_id = 1 AND name = 'صيف')"
+        )
+        assert db.delete_all_products(1) == 3
+    assert _stats(db, 1) == [('صيف', 1, 0)]
+    assert _stats(db, 2) == [('صيف', 1, 0)]
+    assert db.get_product(other, 2) is not None
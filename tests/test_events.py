@@ -0,0 +1,29 @@
+import threading
+
+import pytest
+
+from database_cloud import Database
+from events import EventBroker, TooManyConnections, event_stream
+
+
+@pytest.fixture
+def broker(workdir):
+    return EventBroker(Database())
+
+
+def test_close_ends_open_streams_and_refuses_new_ones(broker):
+    subscriber = broker.subscribe(1)
+    stream = event_stream(broker, subscriber)
+    assert next(stream).startswith('retry:')
+
+    chunks = []
+    reader = threading.Thread(target=lambda: chunks.extend(stream))
+    reader.start()
+    broker.close()
+    # ينتهي البث فوراً دون انتظار النبضة التالية أو SSE_MAX_DURATION
+    reader.join(2)
+    assert not reader.is_alive()
+    assert chunks == []
+    assert broker.stats()['connections'] == 0
+    with pytest.raises(TooManyConnections):
+        broker.subscribe(1)
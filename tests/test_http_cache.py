@@ -0,0 +1,88 @@
+import pytest
+
+import metrics
+from database_cloud import Database
+from http_cache import HttpCache
+from image_downloader import ImageDownloader
+from image_store import ImageStore
+
+
+def _png(fill):
+    return b'\x89PNG\r\n\x1a\n' + fill * 600
+
+
+@pytest.fixture
+def outcomes():
+    """نتائج الكاش المسجلة في image_http_cache_requests_total أثناء الاختبار"""
+    metrics.image_http_cache_requests.reset()
+    metrics.image_http_cache_evictions.reset()
+    return lambda: {key[0]: count for key, count in metrics.image_http_cache_requests.values.items()}
+
+
+@pytest.fixture
+def cache(workdir):
+    return HttpCache(ImageStore(Database()))
+
+
+@pytest.fixture
+def downloader():
+    return ImageDownloader(max_workers=2, max_retries=1)
+
+
+def test_fresh_response_is_reused_without_request(local_server, cache, downloader, outcomes):
+    server = local_server(lambda path, headers: (200, {'Cache-Control': 'max-age=60', 'ETag': '"v1"'}, _png(b'a')))
+    first = downloader.download(f'{server.url}/a.png', cache.store, cache)
+    second = downloader.download(f'{server.url}/a.png', cache.store, cache)
+    assert second['path'] == first['path'] and not second['created']
+    assert server.paths() == ['/a.png']
+    assert outcomes() == {'miss': 1, 'fresh': 1}
+
+
+def test_stale_response_is_revalidated_with_304(local_server, cache, downloader, outcomes):
+    def respond(path, headers):
+        if headers.get('If-None-Match') == '"v1"':
+            return 304, {'ETag': '"v1"', 'Cache-Control': 'max-age=60'}, b''
+        return 200, {'Cache-Control': 'no-cache', 'ETag': '"v1"'}, _png(b'a')
+
+    server = local_server(respond)
+    first = downloader.download(f'{server.url}/a.png', cache.store, cache)
+    second = downloader.download(f'{server.url}/a.png', cache.store, cache)
+    assert second['hash'] == first['hash'] and not second['created']
+    assert server.requests[1][1]['If-None-Match'] == '"v1"'
+    # max-age من رد 304 يجدد طزاجة السجل فلا يُرسل طلب ثالث
+    downloader.download(f'{server.url}/a.png', cache.store, cache)
+    assert len(server.requests) == 2
+    assert outcomes() == {'miss': 1, 'revalidated': 1, 'fresh': 1}
+
+
+def test_changed_response_replaces_entry(local_server, cache, downloader, outcomes):
+    versions = iter([('"v1"', _png(b'a')), ('"v2"', _png(b'b'))])
+
+    def respond(path, headers):
+        etag, body = next(versions)
+        return 200, {'Cache-Control': 'no-cache', 'ETag': etag}, body
+
+    server = local_server(respond)
+    first = downloader.download(f'{server.url}/a.png', cache.store, cache)
+    second = downloader.download(f'{server.url}/a.png', cache.store, cache)
+    assert second['hash'] != first['hash'] and second['created']
+    assert server.requests[1][1]['If-None-Match'] == '"v1"'
+    entry = cache.lookup(f'{server.url}/a.png')
+    assert (entry['etag'], entry['hash']) == ('"v2"', second['hash'])
+    assert outcomes() == {'miss': 1, 'changed': 1}
+
+
+def test_least_recently_used_url_is_evicted(local_server, cache, downloader, outcomes):
+    bodies = {'/a.png': _png(b'a'), '/b.png': _png(b'b')}
+    server = local_server(lambda path, headers: (200, {'Cache-Control': 'max-age=60'}, bodies[path]))
+    # الحد يتسع لصورة واحدة
+    cache.max_bytes = len(bodies['/a.png'])
+    downloader.download(f'{server.url}/a.png', cache.store, cache)
+    downloader.download(f'{server.url}/b.png', cache.store, cache)
+    assert cache.lookup(f'{server.url}/a.png') is None
+    assert metrics.image_http_cache_evictions.values == {(): 1}
+
+    downloader.download(f'{server.url}/b.png', cache.store, cache)
+    downloader.download(f'{server.url}/a.png', cache.store, cache)
+    assert server.paths() == ['/a.png', '/b.png', '/a.png']
+    assert outcomes() == {'miss': 3, 'fresh': 1}
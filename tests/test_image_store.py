@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+
+import pytest
+
+import image_store
+from database_cloud import Database
+from image_store import ImageStore, UnsupportedImageType
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 600
+
+
+@pytest.fixture
+def store(workdir):
+    return ImageStore(Database())
+
+
+def test_put_streams_to_store_and_deduplicates(store):
+    first = store.put([PNG[:100], PNG[100:]])
+    second = store.put([PNG])
+    assert first['created'] and not second['created']
+    assert first['path'] == second['path'] and first['path'].endswith('.png')
+    with open(first['path'], 'rb') as f:
+        assert f.read() == PNG
+    assert os.listdir(store.tmp_dir) == []
+
+
+@pytest.fixture
+def temp_files(monkeypatch):
+    """عدد الملفات المؤقتة التي أنشأها المخزن (المسماة أو المنقولة من الذاكرة)"""
+    created = []
+    mkstemp, temporary_file = image_store.tempfile.mkstemp, image_store.tempfile.TemporaryFile
+
+    def counting(original):
+        def create(*args, **kwargs):
+            created.append(original.__name__)
+            return original(*args, **kwargs)
+        return create
+
+    monkeypatch.setattr(image_store.tempfile, 'mkstemp', counting(mkstemp))
+    monkeypatch.setattr(image_store.tempfile, 'TemporaryFile', counting(temporary_file))
+    return created
+
+
+def test_duplicate_put_writes_nothing_to_disk(store, temp_files):
+    store.put([PNG])
+    assert temp_files == ['mkstemp']
+    assert not store.put([PNG[:100], PNG[100:]])['created']
+    assert temp_files == ['mkstemp']
+
+
+def test_put_spools_large_content_to_disk(store, temp_files, monkeypatch):
+    monkeypatch.setattr(image_store, 'SPOOL_MAX_SIZE', 100)
+    first = store.put([PNG[:100], PNG[100:]])
+    second = store.put([PNG])
+    assert first['created'] and not second['created']
+    with open(first['path'], 'rb') as f:
+        assert f.read() == PNG
+    assert temp_files.count('TemporaryFile') == 2
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_put_rejects_type_and_removes_temp_file(store):
+    with pytest.raises(UnsupportedImageType):
+        store.put([b'<html>' + b' ' * 600], allowed_extensions={'.png'})
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_put_waits_for_gc_deleting_the_same_blob(store):
+    image = store.put([PNG])
+    # released_at بدقة الثانية في SQLite
+    time.sleep(1.1)
+    deleting = threading.Event()
+    finish_gc = threading.Event()
+
+    def gc():
+        with store.db.deleting_unreferenced_blob(image['hash'], 0) as deleted:
+            assert deleted
+            os.remove(image['path'])
+            deleting.set()
+            finish_gc.wait(5)
+
+    results = []
+    gc_thread = threading.Thread(target=gc)
+    gc_thread.start()
+    assert deleting.wait(5)
+    put_thread = threading.Thread(target=lambda: results.append(store.put([PNG])))
+    put_thread.start()
+    put_thread.join(0.3)
+    # put ينتظر اعتماد الحذف بدل أن يعتمد على الملف الذي يُحذف
+    assert put_thread.is_alive()
+    finish_gc.set()
+    gc_thread.join(5)
+    put_thread.join(5)
+    assert results[0]['created']
+    assert os.path.exists(image['path'])
+
+
+def test_collect_garbage_removes_blob_after_grace(store):
+    image = store.put([PNG])
+    assert store.collect_garbage(grace_seconds=1) == 0
+    assert os.path.exists(image['path'])
+    time.sleep(2.1)
+    assert store.collect_garbage(grace_seconds=1) == 1
+    assert not os.path.exists(image['path'])
@@ -0,0 +1,47 @@
+import os
+
+import metrics
+
+
+def _registry(directory):
+    registry = metrics.Registry(directory)
+    counter = metrics.Counter(registry, 'requests_total', 'Requests', labels=('result',))
+    gauge = metrics.Gauge(registry, 'in_flight', 'In flight')
+    histogram = metrics.Histogram(registry, 'duration_seconds', 'Duration', buckets=(1, 5))
+    return registry, counter, gauge, histogram
+
+
+def _write_worker(directory, pid, requests, in_flight, duration):
+    """ملف عامل بقيمه، كما يكتبه flush في عملية العامل"""
+    registry, counter, gauge, histogram = _registry(directory)
+    counter.inc(requests, result='ok')
+    gauge.set(in_flight)
+    histogram.observe(duration)
+    registry._write(registry._path(pid), registry.snapshot())
+
+
+def test_retire_merges_dead_workers_into_one_file(tmp_path):
+    # أرقام عمليات لا توجد (أكبر من أي pid_max) تمثل عمالاً انتهوا
+    dead = [2 ** 30 + 1, 2 ** 30 + 2]
+    _write_worker(tmp_path, dead[0], 3, 2, 0.5)
+    _write_worker(tmp_path, dead[1], 4, 1, 3)
+    master, *_ = _registry(tmp_path)
+    before = master.collect()
+
+    for pid in dead:
+        master.retire(pid)
+    master.retire(dead[0])
+    assert os.listdir(tmp_path) == [metrics.RETIRED_FILE]
+
+    totals = master.collect()
+    assert totals == before
+    assert totals['requests_total'] == {('ok',): 7}
+    assert totals['duration_seconds'] == {(): [1, 1, 3.5, 2]}
+    assert totals['in_flight'] == {}
+
+
+def test_live_worker_gauges_are_summed(tmp_path):
+    _write_worker(tmp_path, os.getppid(), 1, 2, 0.5)
+    master, *_ = _registry(tmp_path)
+    master.retire(2 ** 30 + 1)
+    assert master.collect()['in_flight'] == {(): 2}
@@ -0,0 +1,57 @@
+import pytest
+
+import migrations
+from database_cloud import Database
+
+
+def _database_at(monkeypatch, version):
+    """قاعدة بيانات طُبقت عليها الترحيلات حتى version فقط"""
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [m for m in migrations.MIGRATIONS if m[0] <= version])
+    db = Database()
+    monkeypatch.undo()
+    return db
+
+
+def _add_product(db, season, status, image_size):
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO products (user_id, name, season, status) VALUES (1, 'منتج', ?, ?)", (season, status))
+        product_id = cursor.lastrowid
+        cursor.execute(
+            "INSERT INTO product_images (product_id, position, path, size) VALUES (?, 0, 'saved_images/a.jpg', ?)",
+            (product_id, image_size)
+        )
+
+
+def _stats(db):
+    return sorted(
+        (season['season'], season['statuses'], season['product_count'], season['image_bytes'])
+        for season in db.get_season_stats(1)['seasons']
+    )
+
+
+EXPECTED = [('شتاء', {'approved': 1}, 1, 30), ('صيف', {'pending': 2}, 2, 30)]
+
+
+@pytest.mark.parametrize('version', [12, 13])
+def test_season_stats_survive_upgrade(workdir, monkeypatch, version):
+    db = _database_at(monkeypatch, version)
+    for season, status, size in [('صيف', 'pending', 10), ('صيف', 'pending', 20), ('شتاء', 'approved', 30)]:
+        _add_product(db, season, status, size)
+    if version == 13:
+        # الترحيل 13 كما طُبق: الملخص بمفتاح اسم الموسم، ومنتجات هذه القاعدة أُضيفت بعده
+        with db.connection() as conn:
+            conn.cursor().execute("DELETE FROM season_stats")
+            conn.cursor().execute(migrations.SEASON_STATS_BY_NAME)
+
+    migrations.run_migrations(db)
+    assert 14 in migrations.applied_versions(db)
+    assert _stats(db) == EXPECTED
+
+
+def test_season_stats_steps_do_not_call_current_code():
+    # خطوات الترحيلات المطبقة لا تتبع تغيّر الكود بعدها
+    for version, _, steps in migrations.MIGRATIONS:
+        if version in (13, 14):
+            assert all(isinstance(step, str) or step.__module__ == 'migrations'
+                       for engine_steps in steps.values() for step in engine_steps)
@@ -0,0 +1,147 @@
+import ipaddress
+import json
+import socket
+
+import pytest
+
+import product_extractor
+from product_extractor import ProductExtractor, extract_from_html, normalize_url, validate_url
+
+PUBLIC_ADDRESS = '93.184.216.34'
+
+PRODUCT_PAGE = """<html><head><title>عنوان الصفحة</title>
+<meta property="og:image" content="/og.jpg">
+<script type="application/ld+json">{ld}</script>
+</head><body></body></html>""".format(ld=json.dumps({
+    '@context': 'https://schema.org',
+    '@type': 'Product',
+    'name': 'عطر فاخر',
+    'image': ['https://cdn.example/a.jpg', {'url': '/b.jpg'}],
+    'offers': {'price': '١٢٥٫٥٠', 'priceCurrency': 'aed'},
+}))
+
+
+class FakeDNS:
+    """جدول DNS للاختبار: {المضيف: العنوان} أو قائمة عناوين تُعاد بالترتيب لكل استعلام
+
+    العناوين في public تُعامل كعامة، فيمثل الخادم المحلي (127.0.0.1) موقعاً عاماً.
+    """
+
+    def __init__(self):
+        self.answers = {}
+        self.public = set()
+        self.queries = []
+
+    def __setitem__(self, host, addresses):
+        self.answers[host] = [addresses] if isinstance(addresses, str) else list(addresses)
+
+
+@pytest.fixture
+def resolve(monkeypatch):
+    """استبدال socket.getaddrinfo لـ validate_url و requests معاً؛ العناوين الحرفية تُحل كالمعتاد"""
+    dns = FakeDNS()
+    real_getaddrinfo = socket.getaddrinfo
+    is_internal_address = product_extractor.is_internal_address
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        dns.queries.append(host)
+        if host not in dns.answers:
+            try:
+                ipaddress.ip_address(host)
+            except ValueError:
+                raise socket.gaierror(host)
+            return real_getaddrinfo(host, port, *args, **kwargs)
+        answers = dns.answers[host]
+        address = answers.pop(0) if len(answers) > 1 else answers[0]
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        return [(family, socket.SOCK_STREAM, 6, '', (address, port or 0))]
+
+    monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+    monkeypatch.setattr(product_extractor, 'is_internal_address',
+                        lambda address: address not in dns.public and is_internal_address(address))
+    return dns
+
+
+def _public_url(server, resolve, host='shop.example'):
+    """رابط الخادم المحلي باسم مضيف يُحل إلى 127.0.0.1 ويُعامل كموقع عام"""
+    resolve[host] = '127.0.0.1'
+    resolve.public.add('127.0.0.1')
+    return server.url.replace('127.0.0.1', host)
+
+
+def test_normalize_url_drops_tracking_and_www():
+    assert normalize_url('HTTPS://www.Shop.sa/p/1/?utm_source=x&b=2&a=1&fbclid=z#top') == 'https://shop.sa/p/1?a=1&b=2'
+
+
+@pytest.mark.parametrize('address', [
+    '127.0.0.1', '10.0.0.5', '192.168.1.1', '169.254.169.254', '0.0.0.0', '::1', '::ffff:127.0.0.1', 'fe80::1',
+])
+def test_validate_url_rejects_internal_addresses(resolve, address):
+    resolve['internal.example'] = address
+    with pytest.raises(ValueError):
+        validate_url('http://internal.example/')
+
+
+def test_validate_url_rejects_bad_urls(resolve):
+    for url in ('ftp://shop.example/', 'file:///etc/passwd', 'http:///path', 'http://unknown.example/'):
+        with pytest.raises(ValueError):
+            validate_url(url)
+
+
+def test_validate_url_accepts_public_host(resolve):
+    resolve['shop.example'] = PUBLIC_ADDRESS
+    validate_url('https://shop.example/product')
+
+
+def test_extract_from_html_reads_json_ld_and_open_graph():
+    result = extract_from_html('https://www.shop.ae/p/1', PRODUCT_PAGE)
+    assert result['name'] == 'عطر فاخر'
+    assert result['images'] == ['https://cdn.example/a.jpg', 'https://www.shop.ae/b.jpg', 'https://www.shop.ae/og.jpg']
+    assert result['price'] == 125.5
+    assert result['currency'] == 'AED'
+
+
+def test_extract_follows_redirects_on_public_hosts(local_server, resolve):
+    def respond(path, headers):
+        if path == '/old':
+            return 301, {'Location': '/product'}, b''
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, PRODUCT_PAGE.encode('utf-8')
+
+    server = local_server(respond)
+    result = ProductExtractor(max_workers=1).extract(f'{_public_url(server, resolve)}/old')
+    assert result['name'] == 'عطر فاخر'
+    assert result['cached'] is False
+    assert server.paths() == ['/old', '/product']
+
+
+def test_redirect_to_private_address_is_not_followed(local_server, resolve):
+    server = local_server(lambda path, headers: (302, {'Location': 'http://internal.example/admin'}, b''))
+    resolve['internal.example'] = '10.0.0.5'
+    with pytest.raises(ValueError):
+        ProductExtractor(max_workers=1).extract(f'{_public_url(server, resolve)}/product')
+    assert server.paths() == ['/product']
+
+
+def test_redirect_to_metadata_address_is_not_followed(local_server, resolve):
+    server = local_server(lambda path, headers: (302, {'Location': 'http://169.254.169.254/latest/meta-data/'}, b''))
+    results = ProductExtractor(max_workers=1).extract_many([f'{_public_url(server, resolve)}/product'])
+    assert 'error' in results[0]
+    assert server.paths() == ['/product']
+
+
+def test_redirect_loop_stops_after_limit(local_server, resolve):
+    server = local_server(lambda path, headers: (302, {'Location': '/loop'}, b''))
+    with pytest.raises(ValueError):
+        ProductExtractor(max_workers=1).extract(f'{_public_url(server, resolve)}/loop')
+    assert len(server.paths()) == product_extractor.MAX_REDIRECTS + 1
+
+
+def test_connects_to_the_validated_address(local_server, resolve):
+    server = local_server(lambda path, headers: (200, {'Content-Type': 'text/html'}, PRODUCT_PAGE.encode('utf-8')))
+    url = _public_url(server, resolve, 'rebind.example')
+    # عنوان عام عند التحقق ثم داخلي لأي استعلام بعده (DNS rebinding)
+    resolve['rebind.example'] = ['127.0.0.1', '127.0.0.2']
+    result = ProductExtractor(max_workers=1).extract(f'{url}/product')
+    assert result['name'] == 'عطر فاخر'
+    assert resolve.queries.count('rebind.example') == 1
+    assert server.requests[0][1]['Host'] == url.split('//')[1]
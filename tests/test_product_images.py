@@ -0,0 +1,60 @@
+import pytest
+
+import migrations
+from database_cloud import Database
+from product_images import legacy_images
+
+
+@pytest.mark.parametrize('value, images', [
+    ('["a.jpg", {"path": "b.jpg"}]', ['a.jpg', {'path': 'b.jpg'}]),
+    ('"a.jpg"', ['a.jpg']),
+    ('https://shop.example/a.jpg', ['https://shop.example/a.jpg']),
+    ('https://shop.example/a.jpg, https://shop.example/b.jpg', ['https://shop.example/a.jpg', 'https://shop.example/b.jpg']),
+    ('saved_images/a.jpg,saved_images/b.jpg', ['saved_images/a.jpg', 'saved_images/b.jpg']),
+    # الفاصلة داخل رابط تحويل الصورة جزء منه
+    ('https://cdn.example/upload/w_100,h_100/a.jpg', ['https://cdn.example/upload/w_100,h_100/a.jpg']),
+    ('', []),
+    ('5', None),
+])
+def test_legacy_images(value, images):
+    assert legacy_images(value) == images
+
+
+@pytest.fixture
+def old_db(workdir, monkeypatch):
+    """قاعدة بيانات عند الترحيل 10، قبل نقل الصور من عمود products.images"""
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [m for m in migrations.MIGRATIONS if m[0] <= 10])
+    db = Database()
+    monkeypatch.undo()
+    return db
+
+
+def _add_product(db, images):
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO products (user_id, name, images) VALUES (1, 'منتج', ?)", (images,))
+        return cursor.lastrowid
+
+
+def test_migration_moves_legacy_image_values(old_db):
+    ids = [
+        _add_product(old_db, '["saved_images/a.jpg", "saved_images/b.jpg"]'),
+        _add_product(old_db, 'https://shop.example/a.jpg'),
+        _add_product(old_db, 'https://shop.example/a.jpg,https://shop.example/b.jpg'),
+    ]
+    migrations.run_migrations(old_db)
+    assert [len(old_db.get_product(product_id, 1)['images']) for product_id in ids] == [2, 1, 2]
+    assert old_db.get_product(ids[1], 1)['images'][0] == 'https://shop.example/a.jpg'
+
+
+def test_migration_stops_on_unreadable_images(old_db):
+    _add_product(old_db, '["saved_images/a.jpg"]')
+    bad = [_add_product(old_db, '5'), _add_product(old_db, '[1, 2]')]
+    with pytest.raises(ValueError, match=f'{bad[0]}, {bad[1]}'):
+        migrations.run_migrations(old_db)
+    # الترحيل يُلغى كاملاً فيبقى العمود القديم بقيمه
+    assert 11 not in migrations.applied_versions(old_db)
+    with old_db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) AS n FROM products WHERE images IS NOT NULL")
+        assert cursor.fetchone()['n'] == 3
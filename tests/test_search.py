@@ -0,0 +1,66 @@
+import pytest
+
+from database_cloud import Database
+from search import fts5_query, highlight, normalize_arabic, query_terms, strip_clitics
+
+
+@pytest.mark.parametrize('word, stem', [
+    ('المنتج', 'منتج'),
+    ('للمنتج', 'منتج'),
+    ('بالمنتج', 'منتج'),
+    ('والمنتج', 'منتج'),
+    ('ومنتج', 'منتج'),
+    ('بمنتج', 'منتج'),
+    ('لمنتج', 'منتج'),
+    ('كمنتج', 'منتج'),
+    ('منتج', 'منتج'),
+    # كلمات قصيرة أو تبدأ بحروف من أصلها لا تُقص
+    ('ورد', 'ورد'),
+    ('والد', 'والد'),
+    ('بالغ', 'بالغ'),
+])
+def test_strip_clitics(word, stem):
+    assert strip_clitics(word) == stem
+
+
+def test_normalize_arabic_indexes_word_and_stem():
+    assert normalize_arabic('عطرٌ للمنتجِ الجديدة') == 'عطر للمنتج منتج الجديده جديده'
+
+
+def test_query_terms_group_forms():
+    terms = query_terms('أحمر المنتج المنتج')
+    assert terms == [('احمر',), ('المنتج', 'منتج')]
+    assert fts5_query(terms) == '"احمر"* AND ("المنتج"* OR "منتج"*)'
+
+
+def test_highlight_matches_prefixed_forms():
+    assert highlight('هدية للمنتج الجديد', query_terms('منتج')) == 'هدية <mark>للمنتج</mark> الجديد'
+
+
+@pytest.fixture
+def db(workdir):
+    db = Database()
+    for name, description in [
+        ('غلاف للمنتج', 'حماية كاملة'),
+        ('عطر', 'يأتي مع الهدية والمنتج الأصلي'),
+        ('منتج مميز', None),
+        ('ورد طبيعي', 'باقة'),
+    ]:
+        db.create_product(1, name, description=description)
+    return db
+
+
+def _names(db, query):
+    products, _ = db.search_products(1, query)
+    return sorted(product['name'] for product in products)
+
+
+@pytest.mark.parametrize('query', ['المنتج', 'للمنتج', 'منتج', 'والمنتج', 'منت'])
+def test_search_matches_article_and_clitic_forms(db, query):
+    assert _names(db, query) == ['عطر', 'غلاف للمنتج', 'منتج مميز']
+
+
+def test_search_keeps_other_words_apart(db):
+    assert _names(db, 'الورد') == ['ورد طبيعي']
+    assert _names(db, 'الهدية الاصلي') == ['عطر']
+    assert _names(db, 'غلاف الهدية') == []
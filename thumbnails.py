@@ -0,0 +1,190 @@
+"""توليد الصور المصغرة والمعاينات بصيغة WebP في مجمع عمليات
+
+لكل صورة محفوظة تُولد نسخ بأحجام ثابتة تحت saved_images/derivatives/<الحجم>/
+باسم مشتق من بصمة الصورة، فلا تتكرر النسخ للمحتوى نفسه.
+
+الاستخدام من سطر الأوامر:
+    python thumbnails.py backfill    # توليد النسخ لكل صور المنتجات الموجودة
+"""
+import hashlib
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+from database_cloud import BLOB_PATH_RE
+
+# الحجم الأقصى (العرض، الارتفاع) لكل نوع
+DERIVATIVE_SIZES = {
+    'thumb': (240, 240),
+    'medium': (800, 800),
+}
+WEBP_QUALITY = 80
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+
+
+def derivative_key(image_path):
+    """مفتاح النسخ المشتقة: بصمة المخزن المعنون أو بصمة المسار للصور القديمة"""
+    normalized = image_path.replace('\\', '/').lstrip('/')
+    match = BLOB_PATH_RE.search(normalized)
+    if match:
+        return match.group(1)
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def render_derivatives(source_path, targets):
+    """توليد النسخ المطلوبة لصورة واحدة (تعمل داخل عملية منفصلة)
+
+    targets: {الحجم: (مسار الوجهة, (العرض, الارتفاع))}
+    يعيد {الحجم: مسار الوجهة} لما أصبح موجوداً.
+    """
+    done = {}
+    pending = {size: target for size, target in targets.items() if not os.path.exists(target[0])}
+    for size, (dest, _) in targets.items():
+        if size not in pending:
+            done[size] = dest
+    if not pending:
+        return done
+
+    try:
+        with Image.open(source_path) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA'):
+                has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+                image = image.convert('RGBA' if has_alpha else 'RGB')
+            # الأكبر أولاً ثم التصغير منه لتقليل العمل
+            for size, (dest, box) in sorted(pending.items(), key=lambda item: -item[1][1][0]):
+                copy = image.copy()
+                copy.thumbnail(box, Image.LANCZOS)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                tmp_path = f"{dest}.{os.getpid()}.tmp"
+                copy.save(tmp_path, 'WEBP', quality=WEBP_QUALITY, method=4)
+                os.replace(tmp_path, dest)
+                done[size] = dest
+    except Exception as e:
+        print(f"Failed to render derivatives for {source_path}: {e}")
+    return done
+
+
+def render_product(images):
+    """توليد نسخ كل صور منتج واحد؛ images قائمة (مسار الصورة, targets)"""
+    derivatives = {}
+    for image_path, targets in images:
+        done = render_derivatives(image_path, targets)
+        if done:
+            derivatives[image_path] = done
+    return derivatives
+
+
+class ThumbnailPipeline:
+    """جدولة توليد النسخ في الخلفية وتسجيل مساراتها مع المنتج"""
+
+    def __init__(self, db, root='saved_images', max_workers=THUMBNAIL_WORKERS):
+        self.db = db
+        self.root = root
+        self.max_workers = max_workers
+        self.enabled = PIL_AVAILABLE
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._inflight = set()
+
+    def _pool(self):
+        with self._lock:
+            # مجمع جديد في كل عملية (بعد fork لا يصلح مجمع العملية الأم)
+            if self._executor is None or self._pid != os.getpid():
+                context = multiprocessing.get_context('spawn')
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+                self._pid = os.getpid()
+            return self._executor
+
+    def derivative_path(self, size, image_path):
+        key = derivative_key(image_path)
+        return os.path.join(self.root, 'derivatives', size, key[:2], f"{key}.webp")
+
+    def _targets(self, image_path):
+        return {size: (self.derivative_path(size, image_path), box) for size, box in DERIVATIVE_SIZES.items()}
+
+    def _is_local(self, path):
+        # منع الخروج من مجلد الصور عبر ../
+        return (isinstance(path, str) and os.path.normpath(path).startswith(self.root + os.sep)
+                and os.path.isfile(path))
+
+    def _local_images(self, image_paths):
+        return [(path, self._targets(path)) for path in image_paths if self._is_local(path)]
+
+    def submit(self, product_id, image_paths):
+        """جدولة توليد النسخ لصور منتج ثم حفظ مساراتها معه؛ يعيد Future أو None"""
+        images = self._local_images(image_paths or [])
+        if not self.enabled or not images:
+            return None
+        future = self._pool().submit(render_product, images)
+
+        def record(done_future):
+            if done_future.cancelled():
+                return
+            try:
+                derivatives = done_future.result()
+                if derivatives:
+                    self.db.set_product_derivatives(product_id, derivatives)
+            except Exception as e:
+                print(f"Error generating thumbnails for product {product_id}: {e}")
+
+        future.add_done_callback(record)
+        return future
+
+    def ensure(self, image_path):
+        """جدولة توليد نسخ صورة واحدة عند طلبها قبل جهوزيتها"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if image_path in self._inflight:
+                return
+            self._inflight.add(image_path)
+        images = self._local_images([image_path])
+        if not images:
+            self._inflight.discard(image_path)
+            return
+        future = self._pool().submit(render_product, images)
+        future.add_done_callback(lambda _: self._inflight.discard(image_path))
+
+    def shutdown(self):
+        """إيقاف مجمع هذه العملية وإلغاء ما لم يبدأ بعد (يُولد لاحقاً عند طلبه أو عبر backfill)"""
+        with self._lock:
+            executor = self._executor if self._pid == os.getpid() else None
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def backfill(self):
+        """توليد النسخ لكل المنتجات الموجودة وانتظار اكتمالها"""
+        futures = []
+        for product in self.db.iter_products_with_images():
+            images = self._local_images(product['images'])
+            if images:
+                futures.append((product['id'], self._pool().submit(render_product, images)))
+        for product_id, future in futures:
+            derivatives = future.result()
+            if derivatives:
+                self.db.set_product_derivatives(product_id, derivatives)
+        return len(futures)
+
+
+if __name__ == '__main__':
+    from database_cloud import Database
+
+    if len(sys.argv) < 2 or sys.argv[1] != 'backfill':
+        print(__doc__)
+        sys.exit(1)
+    if not PIL_AVAILABLE:
+        print('Pillow غير مثبت')
+        sys.exit(1)
+    pipeline = ThumbnailPipeline(Database())
+    print(f"Generated derivatives for {pipeline.backfill()} products")
@@ -0,0 +1,76 @@
+"""رفع الصور من جهاز المستخدم (multipart/form-data) مباشرة إلى المخزن المعنون
+
+جسم الطلب يُقرأ على دفعات ويُحلل تدريجياً، وكل ملف يُبث إلى ImageStore.put
+فيُحسب هاشه ويُعرف نوعه من بايتاته الأولى أثناء القراءة، ويُكتب على القرص
+مباشرة دون أن يحفظ Werkzeug الطلب كاملاً في الذاكرة أو في ملفات مؤقتة.
+"""
+import os
+
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+MAX_UPLOAD_FILE_SIZE = int(os.environ.get('MAX_UPLOAD_FILE_SIZE', 20 * 1024 * 1024))
+MAX_UPLOAD_REQUEST_SIZE = int(os.environ.get('MAX_UPLOAD_REQUEST_SIZE', 100 * 1024 * 1024))
+MAX_UPLOAD_FILES = 20
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# الصيغ المقبولة حسب محتوى الملف (SVG مستبعد لأنه قد يحمل سكربتات)
+UPLOAD_EXTENSIONS = {'.jpg', '.png', '.gif', '.webp', '.avif', '.bmp'}
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def _iter_events(stream, boundary):
+    """أحداث المحلل (File و Field و Data) أثناء قراءة الجسم على دفعات"""
+    decoder = MultipartDecoder(boundary)
+    received = 0
+    while True:
+        event = decoder.next_event()
+        if isinstance(event, NeedData):
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            received += len(chunk)
+            if received > MAX_UPLOAD_REQUEST_SIZE:
+                raise UploadTooLarge(f'الحد الأقصى لحجم الطلب {MAX_UPLOAD_REQUEST_SIZE // (1024 * 1024)} ميجابايت')
+            decoder.receive_data(chunk or None)
+        elif isinstance(event, Epilogue):
+            return
+        else:
+            yield event
+
+
+def _file_data(events):
+    """بايتات الملف الحالي حتى نهايته، مع حد الحجم لكل ملف"""
+    size = 0
+    for event in events:
+        if not isinstance(event, Data):
+            raise ValueError('طلب رفع غير صالح')
+        size += len(event.data)
+        if size > MAX_UPLOAD_FILE_SIZE:
+            raise UploadTooLarge(f'الحد الأقصى لحجم الصورة {MAX_UPLOAD_FILE_SIZE // (1024 * 1024)} ميجابايت')
+        yield event.data
+        if not event.more_data:
+            return
+
+
+def save_uploads(stream, boundary, store):
+    """حفظ كل ملفات الطلب في المخزن وإرجاع وصفها مع اسمها الأصلي
+
+    يرفع UploadTooLarge عند تجاوز الحدود، و UnsupportedImageType لملف ليس
+    صورة، و ValueError لطلب غير مكتمل. الحقول النصية تُتجاهل.
+    """
+    events = _iter_events(stream, boundary)
+    saved = []
+    for event in events:
+        # بيانات الحقول النصية وخانات الملفات الفارغة تُتخطى
+        if not isinstance(event, File) or not event.filename:
+            continue
+        if len(saved) >= MAX_UPLOAD_FILES:
+            raise UploadTooLarge(f'الحد الأقصى {MAX_UPLOAD_FILES} صورة في الطلب الواحد')
+        image = store.put(
+            _file_data(events),
+            default_extension=None,
+            allowed_extensions=UPLOAD_EXTENSIONS
+        )
+        image['name'] = event.filename
+        saved.append(image)
+    return saved
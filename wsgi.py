@@ -0,0 +1,15 @@
+"""نقطة دخول WSGI للإنتاج
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+مع preload_app يُستورد هذا الملف مرة واحدة في العملية الرئيسية قبل إنشاء
+العمال، فتُنشأ قاعدة البيانات وتُطبق الترحيلات وتُبنى الملفات الثابتة مرة
+واحدة. الموارد الخاصة بكل عامل (الاتصالات، خيوط المهام والأحداث، مجمع
+الصور المصغرة) تُنشأ من جديد بعد fork.
+"""
+from server import app, db
+
+# الاتصالات المفتوحة أثناء التهيئة لا يجوز أن يرثها العمال
+db.close()
+
+application = app
@@ -0,0 +1,65 @@
+"""بث ملف ZIP أثناء كتابته دون ملفات مؤقتة وبذاكرة ثابتة
+
+يُكتب الأرشيف إلى مخزن صغير يُفرغ بعد كل قطعة، فلا يبقى في الذاكرة أكثر
+من قطعة واحدة. الصور المضغوطة أصلاً (jpg/png/webp...) تُخزن كما هي دون
+إعادة ضغط لأن ذلك يستهلك المعالج ولا يوفر شيئاً تقريباً.
+"""
+import io
+import os
+import time
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+
+# صيغ مضغوطة أصلاً تُخزن دون ضغط
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.zip', '.gz'}
+
+
+class _StreamBuffer(io.RawIOBase):
+    """وجهة كتابة غير قابلة للتنقل يفرغها المولد بعد كل قطعة"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries):
+    """توليد بايتات أرشيف ZIP من (الاسم داخل الأرشيف، مسار الملف)"""
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, mode='w') as archive:
+        for arcname, path in entries:
+            try:
+                stat = os.stat(path)
+                source = open(path, 'rb')
+            except OSError as e:
+                print(f"Skipping {path} in archive: {e}")
+                continue
+            with source:
+                info = zipfile.ZipInfo(arcname, date_time=time.localtime(stat.st_mtime)[:6])
+                info.file_size = stat.st_size
+                if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+                    info.compress_type = zipfile.ZIP_STORED
+                else:
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                with archive.open(info, mode='w') as dest:
+                    for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                        dest.write(chunk)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    # الفهرس المركزي يُكتب عند إغلاق الأرشيف
+    yield buffer.drain()